@@ -0,0 +1,193 @@
+"""Display pipeline benchmark.
+
+Runs the real EventletVNCClient and VMDisplay encode pipeline against the
+fake RFB server for each synthetic workload and reports FPS, bytes on the
+wire, CPU per frame, memory and pipeline latency as JSON.
+
+    python -m benchmarks.display_bench --duration 10 --output results.json
+    python -m benchmarks.display_bench --compare results.json
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import logging
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+import psutil
+
+from qemuweb.core.display import VMDisplay
+from benchmarks.fake_vnc import WORKLOADS
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_WORKLOADS = ['static', 'typing', 'scrolling', 'video', 'resize']
+
+class RecordingSocketIO:
+    """Stands in for the Socket.IO server and tallies what would be sent."""
+
+    def __init__(self):
+        self.events: Dict[str, int] = {}
+        self.frames = 0
+        self.frame_bytes = 0
+
+    def emit(self, event: str, data: Dict[str, Any], room: Optional[str] = None):
+        self.events[event] = self.events.get(event, 0) + 1
+        if event == 'vm_frame':
+            self.frames += 1
+            self.frame_bytes += len(data['frame'])
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            eventlet.sleep(0.05)
+    raise RuntimeError(f"fake VNC server did not start on port {port}")
+
+def type_continuously(display: VMDisplay, interval: float):
+    """Synthetic typing so the input channel is exercised alongside frames"""
+    keys = 'the quick brown fox jumps over the lazy dog '
+    index = 0
+    while display._running or not display.connected:
+        if display.connected:
+            key = keys[index % len(keys)]
+            display.handle_input('keydown', {'key': key, 'ts': time.time() * 1000})
+            display.handle_input('keyup', {'key': key, 'ts': time.time() * 1000})
+            index += 1
+        eventlet.sleep(interval)
+
+def run_workload(workload: str, duration: float, width: int, height: int) -> Dict[str, Any]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_vnc', '--port', str(port), '--workload', workload,
+         '--width', str(width), '--height', str(height)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        process = psutil.Process()
+        sio = RecordingSocketIO()
+        display = VMDisplay(host='127.0.0.1', port=port, vm_name=f'bench-{workload}')
+
+        rss_before = process.memory_info().rss
+        cpu_before = time.process_time()
+        started = time.monotonic()
+
+        streamer = eventlet.spawn(display.connect_and_stream, sio, 'bench')
+        typist = eventlet.spawn(type_continuously, display, 0.08) if workload in ('typing', 'resize') else None
+        eventlet.sleep(duration)
+
+        elapsed = time.monotonic() - started
+        cpu_seconds = time.process_time() - cpu_before
+        vnc_bytes = display.client.bytes_received if display.client else 0
+        stats = display.get_stats()
+        rss_after = process.memory_info().rss
+
+        display.stop_streaming()
+        streamer.wait()
+        if typist:
+            typist.kill()
+    finally:
+        server.terminate()
+        server.wait(timeout=5)
+
+    captured = stats['frames_captured']
+    return {
+        'workload': workload,
+        'duration_s': round(elapsed, 3),
+        'frames_captured': captured,
+        'frames_unchanged': stats['frames_unchanged'],
+        'frames_sent': sio.frames,
+        'capture_fps': round(captured / elapsed, 2),
+        'fps': round(sio.frames / elapsed, 2),
+        'vnc_bytes_received': vnc_bytes,
+        'socketio_bytes_sent': sio.frame_bytes,
+        'vnc_mbps': round(vnc_bytes * 8 / elapsed / 1e6, 2),
+        'socketio_mbps': round(sio.frame_bytes * 8 / elapsed / 1e6, 2),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'cpu_percent': round(cpu_seconds / elapsed * 100, 1),
+        'cpu_ms_per_captured_frame': round(cpu_seconds * 1000 / captured, 3) if captured else None,
+        'cpu_ms_per_sent_frame': round(cpu_seconds * 1000 / sio.frames, 3) if sio.frames else None,
+        'rss_mb': round(rss_after / 1024 / 1024, 1),
+        'rss_growth_mb': round((rss_after - rss_before) / 1024 / 1024, 1),
+        'resolution_changes': sio.events.get('resolution_changed', 0),
+        'input': stats['input'],
+        'latency_ms': {stage: values for stage, values in stats['latency_ms'].items() if values['count']},
+    }
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Human-readable per-workload deltas for the headline numbers"""
+    previous = {result['workload']: result for result in baseline.get('results', [])}
+    lines = []
+    for result in current['results']:
+        old = previous.get(result['workload'])
+        if not old:
+            continue
+        parts = []
+        for key in ('fps', 'cpu_ms_per_captured_frame', 'socketio_mbps', 'rss_mb'):
+            before, after = old.get(key), result.get(key)
+            if before and after is not None:
+                parts.append(f"{key} {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+        lines.append(f"{result['workload']}: " + ', '.join(parts))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VNC capture and encode pipeline')
+    parser.add_argument('--workloads', default=','.join(DEFAULT_WORKLOADS),
+                        help=f"Comma separated list from: {', '.join(sorted(WORKLOADS))}")
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per workload')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--output', type=Path, help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', type=Path, help='Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    for workload in args.workloads.split(','):
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload: {workload}")
+        print(f"Running {workload} for {args.duration:.0f}s...", file=sys.stderr)
+        results.append(run_workload(workload, args.duration, args.width, args.height))
+
+    report = {
+        'benchmark': 'display',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': psutil.cpu_count(logical=True),
+        'params': {'duration': args.duration, 'width': args.width, 'height': args.height},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        for line in compare(json.loads(args.compare.read_text()), report):
+            print(line, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Stand-in for qemu-system-* used by the load tests.
+
+Understands the subset of the QEMU command line that VMManager generates:
+serves a fake VNC display for ``-vnc addr:N``, a minimal QMP server for
+``-qmp unix:PATH,...``, an echoing serial console for ``-chardev socket``
+backing ``-serial``, and answers the ``help`` probes QEMUCapabilities
+runs at startup. Install it on PATH as ``qemu-system-<arch>`` with a small
+wrapper script (see benchmarks/loadtest.py).
+
+The served workload can be chosen with FAKE_QEMU_WORKLOAD (default: typing).
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+from benchmarks.fake_vnc import FakeRFBServer
+
+logger = logging.getLogger('fake_qemu')
+
+VNC_BASE_PORT = 5900
+
+HELP_OUTPUT = {
+    '-accel': "Accelerators supported in QEMU binary:\ntcg\n",
+    '-cpu': "Available CPUs:\nx86 qemu64               QEMU Virtual CPU version 2.5+\nx86 max                  Enables all features\n",
+    '-machine': "Supported machines are:\nq35                  Standard PC (Q35 + ICH9, 2009)\npc                   Standard PC (i440FX + PIIX, 1996)\nnone                 empty machine\n",
+    '-device': 'name "VGA", bus PCI, desc "VGA compatible controller"\nname "virtio-gpu-pci", bus PCI, desc "Display controller"\n',
+}
+
+def parse_args(argv: List[str]) -> Dict[str, str]:
+    """Collect the value of every -option in the command line"""
+    options = {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('-') and i + 1 < len(argv) and not argv[i + 1].startswith('-'):
+            options[arg] = argv[i + 1]
+            i += 2
+        else:
+            options[arg] = ''
+            i += 1
+    return options
+
+class FakeQMPServer:
+    """Answers QMP commands on a unix socket and emits lifecycle events."""
+
+    def __init__(self, path: str, on_quit):
+        self.path = path
+        self.on_quit = on_quit
+        self.status = 'running'
+        self._clients: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(16)
+        threading.Thread(target=self._accept, args=(server,), daemon=True).start()
+
+    def _accept(self, server: socket.socket):
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _send(self, conn: socket.socket, message: Dict[str, Any]):
+        conn.sendall((json.dumps(message) + '\r\n').encode())
+
+    def broadcast_event(self, event: str, data: Optional[Dict[str, Any]] = None):
+        now = time.time()
+        message = {'event': event, 'data': data or {},
+                   'timestamp': {'seconds': int(now), 'microseconds': int(now % 1 * 1e6)}}
+        with self._lock:
+            clients = list(self._clients)
+        for conn in clients:
+            try:
+                self._send(conn, message)
+            except OSError:
+                pass
+
+    def _handle(self, conn: socket.socket):
+        self._send(conn, {'QMP': {'version': {'qemu': {'major': 8, 'minor': 0, 'micro': 0}, 'package': 'fake'},
+                                  'capabilities': []}})
+        with self._lock:
+            self._clients.append(conn)
+        buffer = b''
+        try:
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                buffer += chunk
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    if line.strip():
+                        self._dispatch(conn, json.loads(line))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                if conn in self._clients:
+                    self._clients.remove(conn)
+            conn.close()
+
+    def _dispatch(self, conn: socket.socket, request: Dict[str, Any]):
+        command = request.get('execute')
+        reply: Dict[str, Any] = {'return': {}}
+        after = None
+
+        if command == 'query-status':
+            reply = {'return': {'status': self.status, 'running': self.status == 'running', 'singlestep': False}}
+        elif command == 'query-blockstats':
+            reply = {'return': []}
+        elif command == 'query-cpus-fast':
+            reply = {'return': [{'cpu-index': 0, 'thread-id': threading.get_native_id(), 'target': 'x86_64'}]}
+        elif command == 'system_powerdown':
+            after = lambda: (self.broadcast_event('POWERDOWN'), time.sleep(0.2),
+                             self.broadcast_event('SHUTDOWN', {'guest': True, 'reason': 'guest-shutdown'}),
+                             self.on_quit())
+        elif command == 'system_reset':
+            after = lambda: self.broadcast_event('RESET', {'guest': False, 'reason': 'host-qmp-system-reset'})
+        elif command == 'stop':
+            self.status = 'paused'
+            after = lambda: self.broadcast_event('STOP')
+        elif command == 'cont':
+            self.status = 'running'
+            after = lambda: self.broadcast_event('RESUME')
+        elif command == 'quit':
+            after = lambda: (self.broadcast_event('SHUTDOWN', {'guest': False, 'reason': 'host-qmp-quit'}),
+                             self.on_quit())
+        elif command != 'qmp_capabilities':
+            reply = {'error': {'class': 'CommandNotFound', 'desc': f"The command {command} has not been found"}}
+
+        if 'id' in request:
+            reply['id'] = request['id']
+        self._send(conn, reply)
+        if after:
+            threading.Thread(target=after, daemon=True).start()
+
+class FakeSerialConsole:
+    """A guest login prompt on the serial chardev socket that echoes what is typed."""
+
+    def __init__(self, path: str, name: str, logfile: Optional[str] = None):
+        self.path = path
+        self.name = name
+        self.log = open(logfile, 'ab', buffering=0) if logfile else None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(1)
+        threading.Thread(target=self._accept, args=(server,), daemon=True).start()
+
+    def _write(self, conn: socket.socket, data: bytes):
+        conn.sendall(data)
+        if self.log:
+            self.log.write(data)
+
+    def _accept(self, server: socket.socket):
+        # Like QEMU, one client at a time
+        while True:
+            conn, _ = server.accept()
+            try:
+                self._write(conn, f"\r\n{self.name} login: ".encode())
+                while True:
+                    data = conn.recv(4096)
+                    if not data:
+                        break
+                    self._write(conn, data.replace(b'\r', b'\r\n'))
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+def main(argv: List[str]) -> int:
+    if '--version' in argv:
+        print("QEMU emulator version 8.0.0 (fake)")
+        return 0
+    for option, output in HELP_OUTPUT.items():
+        if argv[-2:] == [option, 'help']:
+            print(output, end='')
+            return 0
+    if argv[-2:] == ['-spice', 'help']:
+        print("qemu-system: -spice help: spice is not supported by this qemu build", file=sys.stderr)
+        return 1
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s fake-qemu %(message)s', stream=sys.stdout)
+    options = parse_args(argv)
+    name = options.get('-name', 'fake')
+    stopping = threading.Event()
+
+    if '-pidfile' in options:
+        with open(options['-pidfile'], 'w') as f:
+            f.write(f"{os.getpid()}\n")
+
+    if options.get('-vnc'):
+        address, display = options['-vnc'].split(',')[0].rsplit(':', 1)
+        host = '127.0.0.1' if address in ('', '0.0.0.0') else address
+        vnc = FakeRFBServer(host, VNC_BASE_PORT + int(display), os.environ.get('FAKE_QEMU_WORKLOAD', 'typing'))
+        vnc.start()
+
+    if options.get('-qmp', '').startswith('unix:'):
+        FakeQMPServer(options['-qmp'][len('unix:'):].split(',')[0], stopping.set).start()
+
+    chardev = dict(part.split('=', 1) for part in options.get('-chardev', '').split(',') if '=' in part)
+    if options.get('-chardev', '').startswith('socket,') and options.get('-serial') == f"chardev:{chardev.get('id')}":
+        FakeSerialConsole(chardev['path'], name, chardev.get('logfile')).start()
+
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    logger.info(f"VM {name} running")
+    stopping.wait()
+    logger.info(f"VM {name} exiting")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,284 @@
+"""Stand-in RFB (VNC) server that replays synthetic desktop workloads.
+
+Speaks just enough of RFB 3.8 for EventletVNCClient: no authentication,
+raw encoding and the DesktopSize pseudo-encoding. Frames are generated on
+demand from the elapsed time, so the content changes at a realistic rate no
+matter how fast the client polls.
+
+    python -m benchmarks.fake_vnc --port 5999 --workload typing
+"""
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DESKTOP_SIZE_PSEUDO_ENCODING = -223
+
+class Workload:
+    """Base class: a desktop that never changes."""
+
+    name = 'static'
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.started = time.monotonic()
+        self._background = self._make_background(width, height)
+
+    @staticmethod
+    def _make_background(width: int, height: int) -> np.ndarray:
+        """A desktop-like background: gradient, a taskbar and a few windows (BGRX)"""
+        frame = np.zeros((height, width, 4), dtype=np.uint8)
+        frame[:, :, 0] = np.linspace(90, 160, height, dtype=np.uint8)[:, None]
+        frame[:, :, 1] = 60
+        frame[:, :, 2] = 30
+        frame[height - 32:, :, :3] = 40
+        for i in range(3):
+            x, y = 60 + i * 120, 50 + i * 80
+            frame[y:y + height // 3, x:x + width // 3, :3] = 230 - i * 20
+            frame[y:y + 24, x:x + width // 3, :3] = (180, 110, 40)
+        return frame
+
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def frame(self) -> np.ndarray:
+        return self._background
+
+class TypingWorkload(Workload):
+    """A terminal-like window where characters appear at typing speed."""
+
+    name = 'typing'
+    chars_per_second = 12
+    glyph = (8, 16)
+
+    def frame(self) -> np.ndarray:
+        frame = self._background.copy()
+        gw, gh = self.glyph
+        cols = max(1, (self.width - 120) // gw)
+        typed = int(self.elapsed() * self.chars_per_second)
+        rows = (self.height - 200) // gh
+        for index in range(max(0, typed - cols * rows), typed):
+            row, col = divmod(index % (cols * rows), cols)
+            x, y = 60 + col * gw, 100 + row * gh
+            shade = 20 + (index * 37) % 60
+            frame[y + 3:y + gh - 3, x + 1:x + gw - 1, :3] = shade
+        return frame
+
+class ScrollingWorkload(Workload):
+    """A long document scrolling by a few lines per frame."""
+
+    name = 'scrolling'
+    pixels_per_second = 300
+
+    def __init__(self, width: int, height: int):
+        super().__init__(width, height)
+        page = np.full((height * 4, width, 4), 245, dtype=np.uint8)
+        for line in range(0, page.shape[0], 18):
+            length = (line * 7919) % (width - 160) + 80
+            page[line + 4:line + 14, 40:40 + length, :3] = 40
+        self._page = page
+
+    def frame(self) -> np.ndarray:
+        offset = int(self.elapsed() * self.pixels_per_second) % (self._page.shape[0] - self.height)
+        return self._page[offset:offset + self.height]
+
+class VideoWorkload(Workload):
+    """Full-motion content: every pixel changes on every frame."""
+
+    name = 'video'
+
+    def __init__(self, width: int, height: int):
+        super().__init__(width, height)
+        ys, xs = np.mgrid[0:height, 0:width]
+        self._xs = xs.astype(np.float32) / 40.0
+        self._ys = ys.astype(np.float32) / 40.0
+        self._rng = np.random.default_rng(0)
+
+    def frame(self) -> np.ndarray:
+        t = self.elapsed() * 3
+        plasma = np.sin(self._xs + t) + np.sin(self._ys * 1.3 - t) + np.sin((self._xs + self._ys) * 0.7 + t * 0.5)
+        base = ((plasma + 3) * 42).astype(np.uint8)
+        frame = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        frame[:, :, 0] = base
+        frame[:, :, 1] = 255 - base
+        frame[:, :, 2] = base // 2
+        frame[:, :, :3] += self._rng.integers(0, 16, size=(self.height, self.width, 1), dtype=np.uint8)
+        return frame
+
+class ResizeWorkload(TypingWorkload):
+    """Typing while the guest cycles through display resolutions."""
+
+    name = 'resize'
+    resolutions = ((640, 480), (1024, 768), (1280, 800), (800, 600))
+    interval = 2.0
+
+    def size(self) -> Tuple[int, int]:
+        return self.resolutions[int(self.elapsed() / self.interval) % len(self.resolutions)]
+
+    def frame(self) -> np.ndarray:
+        width, height = self.size()
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            self._background = self._make_background(width, height)
+        return super().frame()
+
+WORKLOADS: Dict[str, type] = {
+    workload.name: workload
+    for workload in (Workload, TypingWorkload, ScrollingWorkload, VideoWorkload, ResizeWorkload)
+}
+
+class FakeRFBServer:
+    """Serves one workload to any number of RFB clients."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 5999, workload: str = 'static',
+                 width: int = 1024, height: int = 768):
+        self.host = host
+        self.port = port
+        self.workload = WORKLOADS[workload](width, height)
+        self.bytes_sent = 0
+        self.updates_sent = 0
+        self.input_events = 0
+        self._server: Optional[socket.socket] = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(64)
+        self._running = True
+        logger.info(f"Fake RFB server ({self.workload.name}) listening on {self.host}:{self.port}")
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_client, args=(conn,), daemon=True).start()
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._running = False
+        if self._server:
+            self._server.close()
+
+    def _send(self, conn: socket.socket, data: bytes):
+        conn.sendall(data)
+        with self._lock:
+            self.bytes_sent += len(data)
+
+    @staticmethod
+    def _recv_exact(conn: socket.socket, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data += chunk
+        return data
+
+    def _handle_client(self, conn: socket.socket):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            # Version and security (None)
+            self._send(conn, b'RFB 003.008\n')
+            self._recv_exact(conn, 12)
+            self._send(conn, struct.pack('!BB', 1, 1))
+            self._recv_exact(conn, 1)
+            self._send(conn, struct.pack('!I', 0))
+
+            # ClientInit / ServerInit
+            self._recv_exact(conn, 1)
+            width, height = self.workload.size()
+            name = f'fake-{self.workload.name}'.encode()
+            pixel_format = struct.pack('!BBBBHHHBBBxxx', 32, 24, 0, 1, 255, 255, 255, 16, 8, 0)
+            self._send(conn, struct.pack('!HH', width, height) + pixel_format + struct.pack('!I', len(name)) + name)
+
+            client_size = (width, height)
+            desktop_size = False
+            while True:
+                msg_type = self._recv_exact(conn, 1)[0]
+                if msg_type == 0:  # SetPixelFormat (always answered in BGRX anyway)
+                    self._recv_exact(conn, 19)
+                elif msg_type == 2:  # SetEncodings
+                    _, count = struct.unpack('!BH', self._recv_exact(conn, 3))
+                    encodings = struct.unpack(f'!{count}i', self._recv_exact(conn, count * 4))
+                    desktop_size = DESKTOP_SIZE_PSEUDO_ENCODING in encodings
+                elif msg_type == 3:  # FramebufferUpdateRequest
+                    incremental, _, _, _, _ = struct.unpack('!BHHHH', self._recv_exact(conn, 9))
+                    if incremental:
+                        # Liveness probes only; never answered so the client's
+                        # request/response pairing stays intact
+                        continue
+                    client_size = self._send_update(conn, client_size, desktop_size)
+                elif msg_type == 4:  # KeyEvent
+                    self._recv_exact(conn, 7)
+                    self.input_events += 1
+                elif msg_type == 5:  # PointerEvent
+                    self._recv_exact(conn, 5)
+                    self.input_events += 1
+                elif msg_type == 6:  # ClientCutText
+                    _, length = struct.unpack('!3sI', self._recv_exact(conn, 7))
+                    self._recv_exact(conn, length)
+                else:
+                    logger.warning(f"Unknown client message type {msg_type}, closing")
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _send_update(self, conn: socket.socket, client_size: Tuple[int, int], desktop_size: bool) -> Tuple[int, int]:
+        """Answer a full update request, announcing resolution changes first"""
+        frame = self.workload.frame()
+        height, width = frame.shape[:2]
+        if (width, height) != client_size:
+            if not desktop_size:
+                # Client can't follow the resize; keep sending the old geometry
+                frame = np.resize(frame, (client_size[1], client_size[0], 4))
+                height, width = frame.shape[:2]
+            else:
+                self._send(conn, struct.pack('!BxH', 0, 1) + struct.pack('!HHHHi', 0, 0, width, height,
+                                                                          DESKTOP_SIZE_PSEUDO_ENCODING))
+                self.updates_sent += 1
+                return width, height
+
+        header = struct.pack('!BxH', 0, 1) + struct.pack('!HHHHi', 0, 0, width, height, 0)
+        self._send(conn, header + np.ascontiguousarray(frame).tobytes())
+        self.updates_sent += 1
+        return width, height
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5999)
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='static')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = FakeRFBServer(args.host, args.port, args.workload, args.width, args.height)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""VM inventory benchmark.
+
+Loads a large synthetic inventory of VM configs into a VMManager (no QEMU
+processes are started) and reports the memory per config and the latency
+of building, listing, filtering, looking up and JSON-encoding it as JSON.
+Runs against a throwaway HOME so the real configuration is never touched.
+
+    python -m benchmarks.inventory_bench --vms 10000 --output results.json
+    python -m benchmarks.inventory_bench --compare results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Any, Callable
+
+import psutil
+
+ARCHES = ['x86_64', 'x86_64', 'x86_64', 'aarch64']
+TAGS = ['web', 'db', 'ci', 'staging', 'prod']
+
+def vm_record(index: int) -> Dict[str, Any]:
+    """A plausible VM config, varied enough that the indexes are not degenerate"""
+    return {
+        'name': f'vm-{index:05d}',
+        'arch': ARCHES[index % len(ARCHES)],
+        'machine': 'q35',
+        'memory': 512 + 256 * (index % 8),
+        'cpu_cores': 1 + index % 4,
+        'disks': [{'path': f'/var/lib/qemuweb/vm-{index:05d}.qcow2', 'type': 'hdd'},
+                  {'path': '/isos/installer.iso', 'type': 'cdrom'}],
+        'display': {'type': 'vnc', 'port': None},
+        'tags': [TAGS[index % len(TAGS)]] + (['canary'] if index % 100 == 0 else []),
+    }
+
+def timed(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Median and worst wall time of ``repeat`` calls, in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': round(statistics.median(samples), 3), 'max_ms': round(max(samples), 3)}
+
+def run(count: int, repeat: int) -> Dict[str, Any]:
+    # Imported here so config_manager initialises under the throwaway HOME set by main()
+    from qemuweb.core.machine import VMManager, VMConfig
+    from qemuweb.web.json_provider import dumps_bytes, orjson
+
+    records = [vm_record(index) for index in range(count)]
+    manager = VMManager()
+    process = psutil.Process()
+
+    # Memory is traced on a separate build, tracemalloc would distort the timing
+    tracemalloc.start()
+    configs = [VMConfig.create_from_dict(record) for record in records]
+    config_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del configs
+
+    rss_before = process.memory_info().rss
+    started = time.perf_counter()
+    configs = [VMConfig.create_from_dict(record) for record in records]
+    build_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for config in configs:
+        manager.vms[config.name] = config
+    index_ms = (time.perf_counter() - started) * 1000
+    del configs
+
+    started = time.perf_counter()
+    statuses = manager.get_all_vms()
+    list_cold_ms = (time.perf_counter() - started) * 1000
+    rss_after = process.memory_info().rss
+
+    uuids = [manager.vms[f'vm-{index:05d}'].uuid for index in range(0, count, max(1, count // 1000))]
+    started = time.perf_counter()
+    for vm_uuid in uuids:
+        manager.find_vm(vm_uuid)
+    lookup_us = (time.perf_counter() - started) * 1e6 / len(uuids)
+
+    return {
+        'vms': count,
+        'orjson': orjson is not None,
+        'build_ms': round(build_ms, 1),
+        'index_ms': round(index_ms, 1),
+        'bytes_per_config': round(config_bytes / count),
+        'rss_growth_mb': round((rss_after - rss_before) / 1024 / 1024, 1),
+        'list_cold_ms': round(list_cold_ms, 1),
+        'list': timed(manager.get_all_vms, repeat),
+        'list_filtered': dict(timed(lambda: manager.get_all_vms(tag='canary', arch='x86_64'), repeat),
+                              matches=len(manager.get_all_vms(tag='canary', arch='x86_64'))),
+        'encode': dict(timed(lambda: dumps_bytes(statuses), repeat), bytes=len(dumps_bytes(statuses))),
+        'encode_stdlib': timed(lambda: json.dumps(statuses), repeat),
+        'lookup_by_uuid_us': round(lookup_us, 3),
+    }
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Human-readable deltas for the headline numbers"""
+    lines = []
+    for key in ('bytes_per_config', 'build_ms', 'list', 'list_filtered', 'encode', 'lookup_by_uuid_us'):
+        before, after = baseline['results'].get(key), current['results'].get(key)
+        if isinstance(before, dict):
+            before, after = before.get('median_ms'), (after or {}).get('median_ms')
+        if before and after is not None:
+            lines.append(f"{key} {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark VM config memory and listing latency')
+    parser.add_argument('--vms', type=int, default=10000, help='Number of VM configs')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per timed operation')
+    parser.add_argument('--output', type=Path, help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', type=Path, help='Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='qemuweb-bench-') as home:
+        os.environ['HOME'] = home
+        print(f"Building {args.vms} VM configs...", file=sys.stderr)
+        results = run(args.vms, args.repeat)
+
+    report = {
+        'benchmark': 'inventory',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': psutil.cpu_count(logical=True),
+        'params': {'vms': args.vms, 'repeat': args.repeat},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        for line in compare(json.loads(args.compare.read_text()), report):
+            print(line, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Multi-client load test for the Socket.IO display and REST API layer.
+
+Starts a real qemuweb server in an isolated HOME with benchmarks/fake_qemu.py
+installed as qemu-system-x86_64, creates and boots a set of fake VMs, then
+simulates growing numbers of browser clients. Each client connects over
+Socket.IO, calls init_display, consumes vm_frame events, sends synthetic
+vm_input, subscribes to state patches and reloads /api/vms the way app.js
+does.
+
+Requires the Socket.IO client extras: pip install "python-socketio[client]"
+
+    python -m benchmarks.loadtest --vms 4 --clients 1,5,10,25 --duration 20
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+import psutil
+import socketio
+
+from qemuweb.core.metrics import LatencyHistogram
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class QemuwebServer:
+    """A qemuweb process running against fake QEMU binaries."""
+
+    def __init__(self, workload: str):
+        self.workload = workload
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.home = Path(tempfile.mkdtemp(prefix='qemuweb-loadtest-'))
+        self.process: Optional[subprocess.Popen] = None
+
+    def _install_fake_qemu(self) -> Path:
+        bin_dir = self.home / 'bin'
+        bin_dir.mkdir()
+        wrapper = bin_dir / 'qemu-system-x86_64'
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" -m benchmarks.fake_qemu "$@"\n')
+        wrapper.chmod(0o755)
+        return bin_dir
+
+    def start(self, timeout: float = 30.0):
+        bin_dir = self._install_fake_qemu()
+        env = dict(os.environ)
+        env.update({
+            'HOME': str(self.home),  # Keeps ~/.config/qemuweb away from the real one
+            'PATH': f"{bin_dir}{os.pathsep}{env.get('PATH', '')}",
+            'PYTHONPATH': f"{REPO_ROOT}{os.pathsep}{env.get('PYTHONPATH', '')}",
+            'FAKE_QEMU_WORKLOAD': self.workload,
+        })
+        log = open(self.home / 'server.log', 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', 'from qemuweb.cli import run; run()',
+             '--host', '127.0.0.1', '--port', str(self.port), '--no-debug'],
+            cwd=self.home, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self.get('/api/system/info')
+                return
+            except OSError:
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.2)
+        raise RuntimeError(f"qemuweb did not start, see {self.home / 'server.log'}")
+
+    def request(self, method: str, path: str, body: Optional[Dict] = None, timeout: float = 30.0) -> Any:
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read() or b'null')
+
+    def get(self, path: str) -> Any:
+        return self.request('GET', path)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            children = psutil.Process(self.process.pid).children(recursive=True)
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            # Fake VMs qemuweb didn't manage to stop on its own
+            for child in children:
+                try:
+                    child.kill()
+                except psutil.NoSuchProcess:
+                    pass
+        shutil.rmtree(self.home, ignore_errors=True)
+
+class SimulatedBrowser:
+    """One dashboard tab with an open console."""
+
+    def __init__(self, server: QemuwebServer, vm_name: str, input_interval: float, poll_interval: float):
+        self.server = server
+        self.vm_name = vm_name
+        self.input_interval = input_interval
+        self.poll_interval = poll_interval
+        self.frame_latency = LatencyHistogram()
+        self.api_latency = LatencyHistogram()
+        self.frames = 0
+        self.frame_bytes = 0
+        self.dropped = 0
+        self.api_errors = 0
+        self.inputs_sent = 0
+        self.state_patches = 0
+        self.connected = False
+        self.error: Optional[str] = None
+        self._last_frame_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('connect', self._on_connect)
+        self.sio.on('vm_frame', self._on_frame)
+        self.sio.on('state_patch', self._on_state_patch)
+        self.sio.on('error', self._on_error)
+
+    def _on_connect(self):
+        self.connected = True
+        self.sio.emit('init_display', {'vm_id': self.vm_name})
+        self.sio.emit('state_subscribe', {'id': 'vm-list', 'fields': ['running', 'state', 'error']})
+
+    def _on_state_patch(self, data):
+        self.state_patches += 1
+
+    def _on_error(self, data):
+        self.error = str(data)
+
+    def _on_frame(self, data):
+        now_ms = time.time() * 1000
+        emitted = (data.get('timings') or {}).get('emit')
+        if emitted:
+            self.frame_latency.observe(now_ms - emitted)
+        frame_id = data.get('frame_id')
+        if frame_id is not None:
+            if self._last_frame_id is not None and frame_id > self._last_frame_id + 1:
+                self.dropped += frame_id - self._last_frame_id - 1
+            self._last_frame_id = frame_id
+        self.frames += 1
+        self.frame_bytes += len(data.get('frame', ''))
+
+    def start(self):
+        try:
+            self.sio.connect(self.server.base_url, transports=['websocket'], wait_timeout=10)
+        except Exception as e:
+            self.error = f"connect failed: {e}"
+            return
+        for target in (self._send_input, self._poll_api):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _send_input(self):
+        keys = 'abcdefghijklmnopqrstuvwxyz '
+        index = 0
+        while not self._stop.wait(self.input_interval):
+            key = keys[index % len(keys)]
+            index += 1
+            try:
+                for event_type in ('keydown', 'keyup'):
+                    self.sio.emit('vm_input', {'type': event_type, 'key': key, 'code': f'Key{key.upper()}',
+                                               'ts': time.time() * 1000})
+                self.inputs_sent += 2
+            except Exception:
+                pass
+
+    def _poll_api(self):
+        # Same request as app.js loadVMs(); status updates arrive as state patches
+        while not self._stop.wait(self.poll_interval):
+            started = time.monotonic()
+            try:
+                self.server.get('/api/vms?fields=name,running,state,config')
+                self.api_latency.observe((time.monotonic() - started) * 1000)
+            except Exception:
+                self.api_errors += 1
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+def merge(histograms: List[LatencyHistogram]) -> Dict[str, Any]:
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged.to_dict()
+
+def run_step(server: QemuwebServer, vm_names: List[str], clients: int, duration: float,
+             input_interval: float, poll_interval: float) -> Dict[str, Any]:
+    server_proc = psutil.Process(server.process.pid)
+    browsers = [SimulatedBrowser(server, vm_names[i % len(vm_names)], input_interval, poll_interval)
+                for i in range(clients)]
+    for browser in browsers:
+        browser.start()
+
+    # Let displays connect before measuring
+    time.sleep(2)
+    start_counts = [browser.frames for browser in browsers]
+    for browser in browsers:
+        browser.frame_latency.reset()
+        browser.api_latency.reset()
+    server_proc.cpu_percent(None)
+    cpu_samples = []
+    rss_peak = 0
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        time.sleep(1)
+        cpu_samples.append(server_proc.cpu_percent(None))
+        rss_peak = max(rss_peak, server_proc.memory_info().rss)
+    elapsed = time.monotonic() - started
+
+    for browser in browsers:
+        browser.stop()
+
+    frames = sum(browser.frames - start for browser, start in zip(browsers, start_counts))
+    connected = sum(1 for browser in browsers if browser.connected)
+    return {
+        'clients': clients,
+        'clients_connected': connected,
+        'client_errors': sorted({browser.error for browser in browsers if browser.error}),
+        'duration_s': round(elapsed, 2),
+        'frames_received': frames,
+        'fps_per_client': round(frames / elapsed / max(connected, 1), 2),
+        'frames_dropped': sum(browser.dropped for browser in browsers),
+        'frame_bytes_mb': round(sum(browser.frame_bytes for browser in browsers) / 1024 / 1024, 1),
+        'frame_latency_ms': merge([browser.frame_latency for browser in browsers]),
+        'api_poll_latency_ms': merge([browser.api_latency for browser in browsers]),
+        'api_errors': sum(browser.api_errors for browser in browsers),
+        'inputs_sent': sum(browser.inputs_sent for browser in browsers),
+        'state_patches': sum(browser.state_patches for browser in browsers),
+        'server_cpu_percent_avg': round(sum(cpu_samples) / len(cpu_samples), 1) if cpu_samples else None,
+        'server_cpu_percent_max': max(cpu_samples) if cpu_samples else None,
+        'server_rss_peak_mb': round(rss_peak / 1024 / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the qemuweb display and API layer')
+    parser.add_argument('--vms', type=int, default=4, help='Number of fake VMs to boot')
+    parser.add_argument('--clients', default='1,5,10,25', help='Comma separated client counts to step through')
+    parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds per step')
+    parser.add_argument('--workload', default='typing', help='Fake VNC workload served by every VM')
+    parser.add_argument('--input-interval', type=float, default=0.1, help='Seconds between synthetic key presses')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between /api/vms polls')
+    parser.add_argument('--output', type=Path, help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    server = QemuwebServer(args.workload)
+    steps = []
+    try:
+        print(f"Starting qemuweb on port {server.port}...", file=sys.stderr)
+        server.start()
+        vm_names = [f'load-{i}' for i in range(args.vms)]
+        for name in vm_names:
+            server.request('POST', '/api/vms', {'name': name, 'arch': 'x86_64', 'machine': 'q35', 'memory': 256})
+            server.request('POST', f'/api/vms/{name}/start')
+
+        for clients in [int(count) for count in args.clients.split(',')]:
+            print(f"Running {clients} clients for {args.duration:.0f}s...", file=sys.stderr)
+            steps.append(run_step(server, vm_names, clients, args.duration,
+                                  args.input_interval, args.poll_interval))
+    finally:
+        server.stop()
+
+    report = {
+        'benchmark': 'loadtest',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': psutil.cpu_count(logical=True),
+        'params': {'vms': args.vms, 'duration': args.duration, 'workload': args.workload,
+                   'input_interval': args.input_interval, 'poll_interval': args.poll_interval},
+        'steps': steps,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
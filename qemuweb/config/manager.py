@@ -1,9 +1,11 @@
 import json
 import os
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 import shutil
 
+from .vm_store import VMConfigStore
+
 # Default config directory setup
 DEFAULT_CONFIG_DIR = Path.home() / '.config' / 'qemuweb'
 
@@ -13,9 +15,12 @@ class ConfigManager:
         
         # Config files
         self.config_file = self.config_dir / 'config.json'
-        self.vm_file = self.config_dir / 'vm.json'
+        self.vm_file = self.config_dir / 'vm.json'  # Legacy single-file inventory, migrated into vms_dir
+        self.vms_dir = self.config_dir / 'vms'
         self.capabilities_file = self.config_dir / 'capabilities.json'
         self.logs_dir = self.config_dir / 'logs'
+        self.recordings_dir = self.config_dir / 'recordings'
+        self.run_dir = self.config_dir / 'run'  # QEMU pidfiles
         
         # Legacy paths for migration
         self.legacy_config_file = Path('config.json')
@@ -27,11 +32,14 @@ class ConfigManager:
         self.ensure_config_dir()
         self.migrate_legacy_files()
         self.config = self.load_config()
+        self.vm_store = VMConfigStore(self.vms_dir)
 
     def ensure_config_dir(self):
         """Create config directory and subdirectories if they don't exist."""
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.logs_dir.mkdir(parents=True, exist_ok=True)
+        self.recordings_dir.mkdir(parents=True, exist_ok=True)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
 
     def migrate_legacy_files(self):
         """Migrate configs and logs from current directory to config dir."""
@@ -40,7 +48,8 @@ class ConfigManager:
             shutil.copy2(self.legacy_config_file, self.config_file)
             print(f"Migrated legacy config from {self.legacy_config_file} to {self.config_file}")
         
-        if self.legacy_vm_file.exists() and not self.vm_file.exists():
+        migrated_vm_file = self.vm_file.with_name(self.vm_file.name + '.migrated')
+        if self.legacy_vm_file.exists() and not self.vm_file.exists() and not migrated_vm_file.exists():
             shutil.copy2(self.legacy_vm_file, self.vm_file)
             print(f"Migrated legacy VM configs from {self.legacy_vm_file} to {self.vm_file}")
         
@@ -80,28 +89,23 @@ class ConfigManager:
         with open(self.config_file, 'w') as f:
             json.dump(config, f, indent=4)
 
-    def load_vm_configs(self) -> Dict[str, Any]:
-        """Load VM configurations from file."""
-        try:
-            if self.vm_file.exists():
-                with open(self.vm_file, 'r') as f:
-                    return json.load(f)
-            else:
-                # Create empty VM configs if file doesn't exist
-                empty_configs = {}
-                with open(self.vm_file, 'w') as f:
-                    json.dump(empty_configs, f, indent=4)
-                print(f"Created new VM configs file at {self.vm_file}")
-                return empty_configs
-        except Exception as e:
-            print(f"Error loading VM configs: {e}")
-            print(f"Using empty VM configurations")
-            return {}
+    def load_vm_configs(self) -> List[Dict[str, Any]]:
+        """Load all VM configurations, migrating a legacy vm.json first."""
+        if self.vm_file.exists():
+            try:
+                count = self.vm_store.migrate_from(self.vm_file)
+                print(f"Migrated {count} VM configs from {self.vm_file} to {self.vms_dir}")
+            except Exception as e:
+                print(f"Error migrating VM configs from {self.vm_file}: {e}")
+        return self.vm_store.load_all()
 
-    def save_vm_configs(self, vm_configs: Dict[str, Any]):
-        """Save VM configurations to file."""
-        with open(self.vm_file, 'w') as f:
-            json.dump(vm_configs, f, indent=4)
+    def save_vm_config(self, vm_config: Dict[str, Any]):
+        """Save one VM configuration, atomically."""
+        self.vm_store.put(vm_config)
+
+    def delete_vm_config(self, vm_uuid: str):
+        """Remove one VM configuration."""
+        self.vm_store.delete(vm_uuid)
 
     def load_capabilities(self) -> Dict[str, Any]:
         """Load QEMU capabilities from file."""
@@ -157,6 +161,51 @@ DEFAULT_CONFIG = {
         "default_memory": 1024,
         "default_cpu": "qemu64",
         "default_machine": "q35"
+    },
+    "metrics": {
+        "sample_interval": 1,
+        "hub_lag_threshold_ms": 100
+    },
+    "recording": {
+        "keyframe_interval": 10,
+        "tile_size": 64,
+        "compress_level": 1
+    },
+    "fleet": {
+        "parallelism": 8,
+        "ramp_interval": 0.25,
+        "start_timeout": 120
+    },
+    "logs": {
+        # QEMU output of a running VM is rotated at this size or age (seconds)
+        "rotate_bytes": 10485760,
+        "rotate_age": 86400,
+        "compress": True,
+        "compress_level": 6,
+        # Kept per VM; the oldest files go first
+        "retain_files": 50,
+        "retain_bytes": 268435456,
+        "retain_days": 30,
+        "check_interval": 5
+    },
+    "state_sync": {
+        # Clients that reconnect within this many seconds are sent only the changes they missed
+        "history_seconds": 300,
+        # Upper bound on the changes kept for them, whatever the number of VMs
+        "max_history": 200000
+    },
+    "console": {
+        # Bytes of serial console output kept per headless VM for terminals that (re)connect
+        "scrollback": 262144
+    },
+    "shutdown": {
+        "timeout": 60,
+        "term_grace": 5,
+        "leave_running": False
+    },
+    "admin": {
+        # Bearer token for diagnostic endpoints; when empty only local clients may use them
+        "token": ""
     }
 }
 
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class VMConfigStore:
+    """VM configurations stored one file per VM, keyed by UUID.
+
+    A write serializes only the VM that changed into a temporary file in the
+    same directory, fsyncs it and renames it over the old record, so a crash
+    leaves either the previous or the new version of that VM and never a
+    truncated inventory.
+    """
+
+    SUFFIX = '.json'
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def is_valid_uuid(vm_uuid: Any) -> bool:
+        try:
+            return str(uuid.UUID(vm_uuid)) == vm_uuid
+        except (TypeError, ValueError, AttributeError):
+            return False
+
+    def _path(self, vm_uuid: str) -> Path:
+        # Only canonical UUIDs name records, so no value can point outside the directory
+        if not self.is_valid_uuid(vm_uuid):
+            raise ValueError(f"Invalid VM UUID: {vm_uuid!r}")
+        return self.directory / f"{vm_uuid}{self.SUFFIX}"
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        """Every stored record; unreadable ones are logged and skipped"""
+        records = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    if entry.name.endswith('.tmp'):
+                        # Left behind by a write interrupted before its rename
+                        os.unlink(entry.path)
+                    continue
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        records.append(json.loads(f.read()))
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping unreadable VM config {entry.path}: {e}")
+        return records
+
+    def put(self, record: Dict[str, Any]):
+        """Atomically write one VM's record"""
+        data = json.dumps(record, indent=4).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(record['uuid']))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._sync_directory()
+
+    def delete(self, vm_uuid: str):
+        try:
+            os.unlink(self._path(vm_uuid))
+        except FileNotFoundError:
+            return
+        self._sync_directory()
+
+    def _sync_directory(self):
+        """Make the rename or unlink itself durable"""
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def migrate_from(self, vm_file: Path) -> int:
+        """Import a legacy vm.json (name-keyed dict or list) and set it aside as vm.json.migrated"""
+        with open(vm_file, 'r') as f:
+            data = json.load(f)
+        records = [dict(config, name=config.get('name', name)) for name, config in data.items()] \
+            if isinstance(data, dict) else list(data)
+        for record in records:
+            if not self.is_valid_uuid(record.get('uuid')):
+                # Derived from the name so an interrupted migration that is rerun writes the same files
+                record['uuid'] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"qemuweb-vm:{record['name']}"))
+            self.put(record)
+        os.replace(vm_file, vm_file.with_name(vm_file.name + '.migrated'))
+        return len(records)
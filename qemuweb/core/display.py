@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 import numpy as np
 import socketio
 from PIL import Image, UnidentifiedImageError
@@ -14,8 +14,11 @@ import PIL
 import time
 import hashlib
 import cv2
+import sys
 
 from .vnc_client import EventletVNCClient, VNCError
+from .input_channel import InputChannel
+from .metrics import HistogramSet
 
 logger = logging.getLogger(__name__)
 
@@ -47,11 +50,31 @@ KEY_EVENT_MAP = {
     "F9": 0xffc6, "F10": 0xffc7, "F11": 0xffc8, "F12": 0xffc9,
 }
 
+# Per-frame pipeline stages tracked for every display session (milliseconds).
+# Server stages come from the frame timestamps, client stages are reported
+# back by the browser through the 'display_metrics' event.
+LATENCY_STAGES = (
+    'vnc_request',      # framebuffer update request -> last rectangle received
+    'decode',           # rectangles received -> image assembled
+    'encode',           # image assembled -> JPEG/base64 ready
+    'emit',             # Socket.IO emit call
+    'capture_to_emit',  # framebuffer update request -> frame emitted
+    'input_to_frame',   # input received -> next changed frame emitted
+    'client_decode',    # browser: frame received -> image decoded
+    'client_paint',     # browser: image decoded -> painted
+    'input_to_photon',  # browser: input sent -> resulting frame painted
+)
+CLIENT_STAGES = ('client_decode', 'client_paint', 'input_to_photon')
+
 class VMDisplay:
-    def __init__(self, host: str = "localhost", port: int = 5900):
+    def __init__(self, host: str = "localhost", port: int = 5900, vm_name: Optional[str] = None,
+                 recording_manager=None):
         self.host = host
         self.port = port
+        self.vm_name = vm_name
+        self.recording_manager = recording_manager  # Receives changed frames while the VM is being recorded
         self.client = None
+        self.input_channel = InputChannel()
         self.connected = False
         self.frame_interval = 1/30  # 30 FPS target (optimized performance)
         self._last_frame = None
@@ -61,10 +84,20 @@ class VMDisplay:
         self._adaptive_fps = True  # Enable adaptive frame rate
         self._last_frame_time = 0
         self._consecutive_identical_frames = 0
+        self.frames_captured = 0
+        self.frames_unchanged = 0  # Captured but identical to the previous frame, not encoded
+        self.frames_encoded = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0  # Encoded but failed to emit
+        self._vnc_bytes_previous = 0  # Received by VNC clients replaced on reconnect
+        self.latency = HistogramSet(LATENCY_STAGES)
+        self._pending_input = None  # (client timestamp, server receive time) of the oldest unanswered input
+        self.stream_frame = None  # Frame of the running connect_and_stream, lets the profiler scope to this display
         logger.info(f"VMDisplay initialized with host={host}, port={port}")
         
     def connect_and_stream(self, sio: socketio.AsyncServer, room: str):
         """Connect to VNC and start streaming frames"""
+        self.stream_frame = sys._getframe()
         try:
             logger.info(f"Attempting to connect to VNC server at {self.host}:{self.port}")
             
@@ -80,6 +113,10 @@ class VMDisplay:
             self.connected = True
             logger.info(f"Successfully connected to VNC server at {self.host}:{self.port}")
             
+            # Input gets its own writer so it is never stuck behind frame processing
+            self.input_channel.client = self.client
+            self.input_channel.start()
+            
             self._running = True
             logger.info(f"Starting frame streaming for room {room}")
             frames_sent = 0
@@ -112,6 +149,7 @@ class VMDisplay:
                         eventlet.sleep(self.frame_interval * 2)
                         continue
                     
+                    self.frames_captured += 1
                     width, height = img.size
                     
                     # Check if resolution changed
@@ -133,6 +171,9 @@ class VMDisplay:
                         self._last_frame = None  # Force full frame update on resolution change
                         self._last_frame_hash = None  # Reset frame hash on resolution change
                     
+                    # Let the input pump flush anything queued during the frame read
+                    eventlet.sleep(0)
+                    
                     # Convert to base64 - Use JPEG for much better performance
                     img_array = np.array(img)
                     
@@ -142,6 +183,7 @@ class VMDisplay:
                     # Skip encoding if frame hasn't changed (major CPU savings!)
                     if frame_hash == getattr(self, '_last_frame_hash', None):
                         self._consecutive_identical_frames += 1
+                        self.frames_unchanged += 1
                         # Don't send duplicate frames, just update counters
                         consecutive_errors = 0  # Reset error counter on successful capture
                         # Much shorter sleep for identical frames to quickly detect changes
@@ -152,6 +194,9 @@ class VMDisplay:
                     self._consecutive_identical_frames = 0
                     self._last_frame_hash = frame_hash
                     
+                    if self.recording_manager and self.vm_name:
+                        self.recording_manager.submit(self.vm_name, self, img_array)
+                    
                     # Use OpenCV for fast JPEG encoding (much faster than PIL)
                     encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 85]  # Good quality/speed balance
                     success, img_encoded = cv2.imencode('.jpg', cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR), encode_param)
@@ -166,23 +211,40 @@ class VMDisplay:
                         # OpenCV encoded successfully - much faster!
                         img_b64 = base64.b64encode(img_encoded.tobytes()).decode('utf-8')
                     
+                    self.frames_encoded += 1
+                    
                     # Send the frame since it has changed
-                    current_time = time.time()
+                    timings = dict(self.client.frame_timings)
+                    timings['encoded'] = time.time()
+                    
+                    # Echo the client timestamp of the input this frame is the first to reflect
+                    input_ts = None
+                    input_received = None
+                    if self._pending_input and timings.get('request', 0) >= self._pending_input[1]:
+                        input_ts, input_received = self._pending_input
+                        self._pending_input = None
                     
                     try:
+                        timings['emit'] = time.time()
                         sio.emit('vm_frame', {
                             'frame': img_b64,
                             'width': width,
                             'height': height,
                             'encoding': 'base64',
-                            'format': 'jpeg'  # Indicate JPEG format to client
+                            'format': 'jpeg',  # Indicate JPEG format to client
+                            'frame_id': frames_sent + 1,
+                            'timings': {stage: round(ts * 1000, 3) for stage, ts in timings.items()},
+                            'input_ts': input_ts
                         }, room=room)
+                        self._record_frame_latency(timings, time.time(), input_received)
                         self._last_frame = img_b64
                         frames_sent += 1
+                        self.frames_sent = frames_sent
                         logger.debug(f"Sent frame {frames_sent} with dimensions {width}x{height}")
                         consecutive_errors = 0  # Reset error counter on success
                     except Exception as e:
                         logger.error(f"Failed to emit frame: {e}", exc_info=True)
+                        self.frames_dropped += 1
                         eventlet.sleep(self.frame_interval)
                         continue
                         
@@ -233,10 +295,14 @@ class VMDisplay:
                 logger.error(f"Failed to send error message to client: {emit_error}")
         finally:
             # Always clean up
+            self.stream_frame = None
             self.disconnect()
                 
     def disconnect(self):
         """Disconnect from the VNC server"""
+        self.input_channel.stop()
+        if self.recording_manager and self.vm_name:
+            self.recording_manager.release(self.vm_name, self)
         if self.client:
             try:
                 # First stop any ongoing operations
@@ -248,6 +314,7 @@ class VMDisplay:
             except:
                 pass
             finally:
+                self._vnc_bytes_previous += self.client.bytes_received
                 self.client = None
                 
         logger.info("Disconnected from VNC server")
@@ -256,9 +323,11 @@ class VMDisplay:
         """Attempt to reconnect to the VNC server"""
         try:
             if self.client:
+                self._vnc_bytes_previous += self.client.bytes_received
                 self.client.disconnect()
             
             self.client = EventletVNCClient(self.host, self.port)
+            self.input_channel.client = self.client
             if self.client.connect():
                 logger.info("VNC client reconnected successfully")
                 self._last_frame = None  # Force next frame to be sent
@@ -270,11 +339,41 @@ class VMDisplay:
             logger.error(f"Error during reconnection attempt: {e}")
             return False
         
+    def _record_frame_latency(self, timings: Dict[str, float], emitted: float, input_received: Optional[float]):
+        """Record server-side pipeline stage durations for an emitted frame"""
+        request = timings.get('request')
+        received = timings.get('received')
+        decoded = timings.get('decoded')
+        encoded = timings['encoded']
+        
+        if request and received:
+            self.latency.observe('vnc_request', (received - request) * 1000)
+        if received and decoded:
+            self.latency.observe('decode', (decoded - received) * 1000)
+        if decoded:
+            self.latency.observe('encode', (encoded - decoded) * 1000)
+        self.latency.observe('emit', (emitted - timings['emit']) * 1000)
+        if request:
+            self.latency.observe('capture_to_emit', (emitted - request) * 1000)
+        if input_received:
+            self.latency.observe('input_to_frame', (emitted - input_received) * 1000)
+    
+    def record_client_metrics(self, samples: List[Dict[str, Any]]):
+        """Record decode/paint/input-to-photon times reported by the browser"""
+        for sample in samples:
+            for stage in CLIENT_STAGES:
+                value = sample.get(f'{stage}_ms')
+                if isinstance(value, (int, float)) and 0 <= value < 60000:
+                    self.latency.observe(stage, value)
+        
     def handle_input(self, event_type: str, data: Dict[str, Any]):
         """Handle input events from the web client"""
         if not self.connected or not self.client:
             return
             
+        if self._pending_input is None:
+            self._pending_input = (data.get('ts'), time.time())
+            
         try:
             logger.debug(f"Handling input event: {event_type} with data: {data}")
             
@@ -284,7 +383,7 @@ class VMDisplay:
                 self._last_mouse_pos = (x, y)
                 
                 logger.debug(f"Mouse move to {x},{y}")
-                self.client.send_pointer_event(x, y, self._buttons)
+                self.input_channel.send_pointer_event(x, y, self._buttons)
                 
             elif event_type == "mousedown":
                 x = int(data['x'])
@@ -297,7 +396,7 @@ class VMDisplay:
                 
                 logger.debug(f"Mouse down at {x},{y} client_button {button_from_client} mask {button_mask}")
                 self._last_mouse_pos = (x, y)
-                self.client.send_pointer_event(x, y, self._buttons)
+                self.input_channel.send_pointer_event(x, y, self._buttons)
                 
             elif event_type == "mouseup":
                 x = int(data['x'])
@@ -310,7 +409,7 @@ class VMDisplay:
                 
                 logger.debug(f"Mouse up at {x},{y} client_button {button_from_client} mask {button_mask}")
                 self._last_mouse_pos = (x, y)
-                self.client.send_pointer_event(x, y, self._buttons)
+                self.input_channel.send_pointer_event(x, y, self._buttons)
                 
             elif event_type == "keydown" or event_type == "keyup":
                 original_key_name = data['key']
@@ -328,7 +427,7 @@ class VMDisplay:
                     action = "down" if event_type == "keydown" else "up"
                     is_down = (event_type == "keydown")
                     logger.debug(f"Key {action}: original '{original_key_name}', vnc_code '{vnc_key_code}' (code: {data.get('code')})")
-                    self.client.send_key_event(vnc_key_code, is_down)
+                    self.input_channel.send_key_event(vnc_key_code, is_down)
                 else:
                     # Fallback for unmapped keys
                     logger.warning(f"No VNC key mapping for '{original_key_name}' (code: {data.get('code')})")
@@ -336,6 +435,29 @@ class VMDisplay:
         except Exception as e:
             logger.error(f"Error handling input event {event_type}: {e}", exc_info=True)
         
+    @property
+    def vnc_bytes_received(self) -> int:
+        """Bytes read from the VNC server over the life of this session"""
+        client = self.client
+        return self._vnc_bytes_previous + (client.bytes_received if client else 0)
+        
+    def get_stats(self) -> Dict[str, Any]:
+        """Get display statistics for this session"""
+        return {
+            'vm_name': self.vm_name,
+            'connected': self.connected,
+            'width': self.client.width if self.client else 0,
+            'height': self.client.height if self.client else 0,
+            'frames_captured': self.frames_captured,
+            'frames_unchanged': self.frames_unchanged,
+            'frames_encoded': self.frames_encoded,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'vnc_bytes_received': self.vnc_bytes_received,
+            'input': self.input_channel.get_stats(),
+            'latency_ms': self.latency.to_dict()
+        }
+        
     def stop_streaming(self):
         """Stop the frame streaming"""
         logger.info("Stopping frame streaming")
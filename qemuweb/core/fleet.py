@@ -0,0 +1,236 @@
+import fnmatch
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('start', 'stop', 'shutdown', 'reset', 'restart', 'poweroff')
+
+# Running states a start is waiting to reach, and states that end the wait early
+STARTED_STATES = {'running', 'paused', 'crashed', 'stopped'}
+
+class FleetOperation:
+    """One bulk action over a set of VMs and the progress of each."""
+
+    def __init__(self, action: str, names: List[str], parallelism: int, ramp_interval: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.action = action
+        self.names = names
+        self.parallelism = parallelism
+        self.ramp_interval = ramp_interval
+        self.results: Dict[str, Dict[str, Any]] = {name: {'status': 'pending'} for name in names}
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.cancelled = False
+
+    @property
+    def completed(self) -> int:
+        return sum(1 for result in self.results.values() if result['status'] in ('done', 'failed', 'skipped'))
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for result in self.results.values() if result['status'] == 'failed')
+
+    def to_dict(self, include_results: bool = True) -> Dict[str, Any]:
+        data = {
+            'id': self.id,
+            'action': self.action,
+            'total': len(self.names),
+            'completed': self.completed,
+            'failed': self.failed,
+            'parallelism': self.parallelism,
+            'ramp_interval': self.ramp_interval,
+            'created': self.created,
+            'finished': self.finished,
+            'cancelled': self.cancelled
+        }
+        if include_results:
+            data['results'] = self.results
+        return data
+
+class FleetManager:
+    """Runs VM lifecycle actions over many VMs concurrently.
+
+    At most ``parallelism`` actions run at once and new ones are launched no
+    faster than one per ``ramp_interval`` seconds, so mass starts do not turn
+    into a disk and CPU boot storm. A start only frees its slot once the VM is
+    ready (or has failed), which is what bounds the number of booting VMs.
+    Per-VM progress is reported through ``progress_callback(event, data)``.
+    """
+
+    def __init__(self, vm_manager, parallelism: int = 8, ramp_interval: float = 0.25,
+                 start_timeout: float = 120.0, progress_callback: Optional[Callable[[str, Dict], None]] = None,
+                 keep_finished: int = 20):
+        self.vm_manager = vm_manager
+        self.parallelism = parallelism
+        self.ramp_interval = ramp_interval
+        self.start_timeout = start_timeout
+        self.progress_callback = progress_callback
+        self.keep_finished = keep_finished
+        self.operations: 'OrderedDict[str, FleetOperation]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def select(self, names: Optional[List[str]] = None, selector: Optional[Dict[str, Any]] = None) -> List[str]:
+        """VM names from an explicit list and/or a selector.
+
+        The selector matches on ``pattern`` (shell-style glob on the name),
+        ``arch``, ``tag`` and ``state`` (a run state, or 'running'/'stopped');
+        all but the pattern are answered from the VM registry's indexes.
+        """
+        vms = self.vm_manager.vms
+        if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+            raise ValueError("VM names must be a list of strings")
+        if selector is not None and not isinstance(selector, dict):
+            raise ValueError("The selector must be a mapping")
+        if names is not None:
+            unknown = [name for name in names if name not in vms]
+            if unknown:
+                raise ValueError(f"Unknown VMs: {', '.join(unknown)}")
+            candidates = list(dict.fromkeys(names))
+        else:
+            candidates = None
+
+        selector = selector or {}
+        pattern = selector.get('pattern')
+        arch = selector.get('arch')
+        tag = selector.get('tag')
+        state = selector.get('state')
+        if arch or tag or state:
+            # 'running' and 'stopped' mean with and without a live process, whatever the exact state
+            running = {'running': True, 'stopped': False}.get(state)
+            matches = vms.select(arch=arch or None, tag=tag or None,
+                                 state=state or None if running is None else None, running=running)
+            if candidates is None:
+                candidates = matches
+            else:
+                matches = set(matches)
+                candidates = [name for name in candidates if name in matches]
+        elif candidates is None:
+            candidates = list(vms)
+        if pattern:
+            candidates = [name for name in candidates if fnmatch.fnmatchcase(name, pattern)]
+        return candidates
+
+    def _running(self, name: str) -> bool:
+        process = self.vm_manager.processes.get(name)
+        return process is not None and process.poll() is None
+
+    def submit(self, action: str, names: List[str], parallelism: Optional[int] = None,
+               ramp_interval: Optional[float] = None) -> FleetOperation:
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action '{action}', expected one of {', '.join(ACTIONS)}")
+        parallelism = self.parallelism if parallelism is None else parallelism
+        ramp_interval = self.ramp_interval if ramp_interval is None else ramp_interval
+        if isinstance(parallelism, bool) or not isinstance(parallelism, int) or parallelism <= 0:
+            raise ValueError(f"Invalid parallelism {parallelism!r}, expected a positive integer")
+        if isinstance(ramp_interval, bool) or not isinstance(ramp_interval, (int, float)) or ramp_interval < 0:
+            raise ValueError(f"Invalid ramp interval {ramp_interval!r}, expected a non-negative number")
+        operation = FleetOperation(action, list(names), parallelism, float(ramp_interval))
+        with self._lock:
+            self.operations[operation.id] = operation
+            finished = [op_id for op_id, op in self.operations.items() if op.finished]
+            for op_id in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.operations[op_id]
+        threading.Thread(target=self._run, args=(operation,), daemon=True,
+                         name=f"fleet-{action}-{operation.id}").start()
+        logger.info(f"Bulk {action} of {len(names)} VMs started ({operation.id}, "
+                    f"parallelism {operation.parallelism}, ramp {operation.ramp_interval}s)")
+        return operation
+
+    def get(self, operation_id: str) -> Optional[FleetOperation]:
+        return self.operations.get(operation_id)
+
+    def cancel(self, operation_id: str) -> bool:
+        """Stop launching further actions; those already running finish."""
+        operation = self.operations.get(operation_id)
+        if not operation or operation.finished:
+            return False
+        operation.cancelled = True
+        return True
+
+    def _emit(self, event: str, data: Dict[str, Any]):
+        if self.progress_callback:
+            try:
+                self.progress_callback(event, data)
+            except Exception as e:
+                logger.error(f"Failed to report bulk operation progress: {e}")
+
+    def _run(self, operation: FleetOperation):
+        slots = threading.Semaphore(operation.parallelism)
+        workers = []
+        next_launch = time.monotonic()
+        for name in operation.names:
+            slots.acquire()
+            if operation.cancelled:
+                slots.release()
+                self._finish(operation, name, 'skipped', 'Cancelled')
+                continue
+            delay = next_launch - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_launch = time.monotonic() + operation.ramp_interval
+            worker = threading.Thread(target=self._run_one, args=(operation, name, slots), daemon=True)
+            workers.append(worker)
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        operation.finished = time.time()
+        logger.info(f"Bulk {operation.action} {operation.id} finished: "
+                    f"{operation.completed - operation.failed}/{len(operation.names)} succeeded")
+        self._emit('bulk_complete', operation.to_dict())
+
+    def _run_one(self, operation: FleetOperation, name: str, slots: threading.Semaphore):
+        operation.results[name] = {'status': 'running', 'started': time.time()}
+        self._emit('bulk_progress', self._progress(operation, name))
+        try:
+            success, error = self._perform(operation.action, name)
+        except Exception as e:
+            logger.error(f"Bulk {operation.action} of VM {name} failed: {e}")
+            success, error = False, str(e)
+        finally:
+            slots.release()
+        self._finish(operation, name, 'done' if success else 'failed', error)
+
+    def _finish(self, operation: FleetOperation, name: str, status: str, error: Optional[str]):
+        result = operation.results[name]
+        result['status'] = status
+        result['finished'] = time.time()
+        if error:
+            result['error'] = error
+        self._emit('bulk_progress', self._progress(operation, name))
+
+    def _progress(self, operation: FleetOperation, name: str) -> Dict[str, Any]:
+        return dict(operation.results[name], id=operation.id, action=operation.action, name=name,
+                    completed=operation.completed, total=len(operation.names))
+
+    def _perform(self, action: str, name: str):
+        manager = self.vm_manager
+        if action == 'start':
+            if self._running(name):
+                return True, None
+            success, error = manager.start_vm(name)
+            if not success:
+                return False, error
+            # Hold the slot until the VM has booted far enough to answer QMP
+            state = manager.wait_for_state(name, STARTED_STATES, self.start_timeout)
+            if state is None:
+                return False, f"Not ready after {self.start_timeout:g}s"
+            if state == 'stopped':
+                return False, manager.start_errors.get(name, 'QEMU exited during start')
+            return True, None
+        if action == 'stop':
+            if not self._running(name):
+                return True, None
+            return (True, None) if manager.stop_vm(name) else (False, f"Failed to stop VM {name}")
+        if action == 'shutdown':
+            return manager.shutdown_vm(name)
+        if action == 'reset':
+            return manager.reset_vm(name)
+        if action == 'restart':
+            return manager.restart_vm(name)
+        return manager.power_off_vm(name)
@@ -0,0 +1,158 @@
+import logging
+import os
+import sys
+import time
+import traceback
+from typing import Dict, Any, Optional, List
+
+import eventlet
+from eventlet import patcher
+
+from .metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# The watchdog must be a real OS thread: a green one would be stuck behind
+# the very greenlet it is meant to catch
+_native_threading = patcher.original('threading')
+_native_thread = patcher.original('_thread')
+_native_time = patcher.original('time')
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class BlockingSite:
+    """Aggregated stalls attributed to one line of code."""
+
+    __slots__ = ('site', 'count', 'total_ms', 'max_ms', 'last_seen', 'stack')
+
+    def __init__(self, site: str):
+        self.site = site
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        self.stack: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'site': self.site,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'last_seen': self.last_seen,
+            'stack': self.stack
+        }
+
+def _call_site(frame) -> str:
+    """Innermost qemuweb frame of a stack, else the innermost frame"""
+    innermost = frame
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PACKAGE_DIR) and filename != __file__:
+            break
+        frame = frame.f_back
+    frame = frame or innermost
+    filename = frame.f_code.co_filename
+    if filename.startswith(_PACKAGE_DIR):
+        filename = os.path.relpath(filename, os.path.dirname(_PACKAGE_DIR))
+    return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+class HubLagMonitor:
+    """Measures how late the eventlet hub wakes a sleeping greenlet.
+
+    A probe greenlet sleeps for ``interval`` in a loop; any time beyond that
+    is time the hub spent running something that did not yield.
+
+    A native watchdog thread checks the probe's heartbeat. When the probe is
+    overdue by ``threshold_ms`` it captures the stack running on the hub's OS
+    thread, i.e. the greenlet that is blocking, and the stall is attributed
+    to that call site once the probe gets to run again.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold_ms: float = 100.0, max_sites: int = 100):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.max_sites = max_sites
+        self.lag = LatencyHistogram()
+        self.last_lag_ms = 0.0
+        self.stalls = 0
+        self.sites: Dict[str, BlockingSite] = {}
+        self._lock = _native_threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._captured = None  # (site, stack) taken by the watchdog during the current stall
+        self._hub_thread: Optional[int] = None
+        self._running = False
+        self._probe: Optional[eventlet.greenthread.GreenThread] = None
+        self._watchdog: Optional[_native_threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._hub_thread = _native_thread.get_ident()
+        self._heartbeat = time.monotonic()
+        self._probe = eventlet.spawn(self._run)
+        self._watchdog = _native_threading.Thread(target=self._watch, daemon=True, name='hub-watchdog')
+        self._watchdog.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        while self._running:
+            expected = time.monotonic() + self.interval
+            self._heartbeat = expected
+            eventlet.sleep(self.interval)
+            lag_ms = max(0.0, (time.monotonic() - expected) * 1000)
+            self.last_lag_ms = lag_ms
+            self.lag.observe(lag_ms)
+            if lag_ms >= self.threshold_ms:
+                self._record_stall(lag_ms)
+
+    def _watch(self):
+        """Native thread: snapshot the hub's stack once per stall"""
+        poll = min(self.interval, self.threshold_ms / 1000) / 2
+        while self._running:
+            _native_time.sleep(poll)
+            overdue_ms = (time.monotonic() - self._heartbeat) * 1000
+            if overdue_ms < self.threshold_ms or self._captured is not None:
+                continue
+            frame = sys._current_frames().get(self._hub_thread)
+            if frame is None:
+                continue
+            self._captured = (_call_site(frame), traceback.format_stack(frame)[-15:])
+
+    def _record_stall(self, lag_ms: float):
+        captured, self._captured = self._captured, None
+        site, stack = captured if captured else ('unknown', [])
+        with self._lock:
+            self.stalls += 1
+            entry = self.sites.get(site)
+            if entry is None:
+                if len(self.sites) >= self.max_sites:
+                    # Forget the least significant site to stay bounded
+                    del self.sites[min(self.sites.values(), key=lambda s: s.total_ms).site]
+                entry = self.sites[site] = BlockingSite(site)
+            entry.count += 1
+            entry.total_ms += lag_ms
+            entry.max_ms = max(entry.max_ms, lag_ms)
+            entry.last_seen = time.time()
+            entry.stack = [line.rstrip() for line in stack]
+        logger.warning(f"Event loop blocked for {lag_ms:.0f} ms at {site}"
+                       + (''.join(['\n'] + stack).rstrip() if stack else ''))
+
+    def top_sites(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Call sites ordered by total time they kept the hub blocked"""
+        with self._lock:
+            sites = sorted(self.sites.values(), key=lambda s: s.total_ms, reverse=True)[:limit]
+            return [site.to_dict() for site in sites]
+
+    def get_stats(self, limit: int = 10) -> Dict[str, Any]:
+        return {
+            'interval_ms': self.interval * 1000,
+            'threshold_ms': self.threshold_ms,
+            'last_lag_ms': round(self.last_lag_ms, 3),
+            'lag_ms': self.lag.to_dict(),
+            'stalls': self.stalls,
+            'top_sites': self.top_sites(limit)
+        }
@@ -0,0 +1,98 @@
+import logging
+import time
+from typing import Dict, Any
+
+import eventlet
+from eventlet.queue import LightQueue
+
+from .metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+class InputChannel:
+    """Prioritized input path from the browser to a VNC server.
+
+    Input events are queued by the Socket.IO handler and written by a
+    dedicated greenlet, so they go out as soon as the frame loop yields
+    instead of waiting behind a frame read and JPEG encode.
+    """
+
+    def __init__(self, client=None, slow_threshold: float = 0.05):
+        self.client = client
+        self.slow_threshold = slow_threshold  # Log events queued longer than this (seconds)
+        self.events_sent = 0
+        self.events_failed = 0
+        self._queue = LightQueue()
+        self._pump = None
+        self._running = False
+        self.queue_delay = LatencyHistogram()
+
+    def start(self):
+        """Start the input pump"""
+        if self._running:
+            return
+        self._running = True
+        self._pump = eventlet.spawn(self._run)
+
+    def stop(self):
+        """Stop the input pump, dropping anything still queued"""
+        self._running = False
+        # A fresh queue for a later start(); the sentinel wakes the old pump so it exits
+        queue, self._queue = self._queue, LightQueue()
+        queue.put(None)
+
+    def pending(self) -> int:
+        """Number of input events waiting to be written"""
+        return self._queue.qsize()
+
+    def send_key_event(self, key: int, down: bool):
+        """Queue a key event"""
+        self._queue.put((time.monotonic(), 'key', (key, down)))
+
+    def send_pointer_event(self, x: int, y: int, button_mask: int):
+        """Queue a pointer event"""
+        self._queue.put((time.monotonic(), 'pointer', (x, y, button_mask)))
+
+    def _run(self):
+        """Write queued events to the VNC socket as soon as they arrive"""
+        queue = self._queue
+        while self._running:
+            item = queue.get()
+            if item is None or not self._running:
+                break
+
+            queued_at, kind, args = item
+            client = self.client
+            if not client:
+                continue
+
+            delay = time.monotonic() - queued_at
+            try:
+                if kind == 'key':
+                    sent = client.send_key_event(*args)
+                else:
+                    sent = client.send_pointer_event(*args)
+            except Exception as e:
+                logger.error(f"Failed to write {kind} input event: {e}")
+                sent = False
+            if not sent:
+                self.events_failed += 1
+                continue
+            self.events_sent += 1
+
+            self.queue_delay.observe(delay * 1000)
+            if delay > self.slow_threshold:
+                logger.warning(f"Input {kind} event queued for {delay * 1000:.1f} ms")
+            else:
+                logger.debug(f"Input {kind} event queued for {delay * 1000:.2f} ms")
+
+        logger.debug("Input pump stopped")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queueing delay statistics in milliseconds"""
+        return {
+            'events_sent': self.events_sent,
+            'events_failed': self.events_failed,
+            'pending': self.pending(),
+            'queue_delay_ms': self.queue_delay.to_dict()
+        }
@@ -0,0 +1,648 @@
+import bisect
+import gzip
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Any, Callable, Iterable, List, Set, Tuple, IO
+
+from eventlet import tpool
+
+logger = logging.getLogger(__name__)
+
+# <vm name, spaces as underscores>_<YYYYmmdd_HHMMSS>.log is the file a QEMU process writes;
+# rotated segments of it append .<start>-<end> (byte offsets in the whole log), then .gz
+_LOG_NAME = re.compile(r'^(?P<vm>.+)_(?P<stamp>\d{8}_\d{6})\.log'
+                       r'(?:\.(?P<start>\d+)-(?P<end>\d+)(?P<gz>\.gz)?)?$')
+_TEMP_NAME = re.compile(r'_\d{8}_\d{6}\.log\.[\d-]+(?:\.gz)?\.tmp$')
+
+DEFAULT_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+
+def _log_key(name: str) -> str:
+    return name.replace(' ', '_')
+
+def _utf8_cut(data: bytes) -> int:
+    """Length of ``data`` without a multi-byte character cut off at its end"""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte < 0x80:
+            return len(data)
+        if byte >= 0xC0:  # Lead byte: is its sequence complete?
+            needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return len(data) if back >= needed else len(data) - back
+    return len(data)
+
+def _copy_file(source_path: Path, target_path: Path) -> int:
+    """Copy a file as it is now; returns the bytes copied. Opens its own files, for tpool"""
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+        return target.tell()
+
+def _finish_copy(source_path: Path, target_path: Path, copied: int) -> Tuple[int, int]:
+    """Copy what was appended since ``copied``, then empty the source; for tpool.
+
+    Returns the bytes copied in all and the size of the source right after
+    the truncation, which is output that may have been lost.
+    """
+    with open(source_path, 'rb') as source, open(target_path, 'ab') as target:
+        source.seek(copied)
+        length = copied
+        for _ in range(3):
+            shutil.copyfileobj(source, target)
+            length = target.tell()
+            if os.fstat(source.fileno()).st_size == length:
+                break
+        if not length:
+            return 0, 0
+        os.truncate(source_path, 0)
+        return length, os.stat(source_path).st_size
+
+def _read_file(path: Path, offset: int, length: int) -> bytes:
+    """Bytes of a file that may be gone, for tpool"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    except FileNotFoundError:
+        return b''
+
+def _gzip_file(path: Path, level: int) -> Path:
+    """Write ``path`` gzipped next to it; returns the new file. Takes no green locks, for tpool"""
+    target = path.with_name(path.name + '.gz')
+    temp = target.with_name(target.name + '.tmp')
+    with open(path, 'rb') as source, gzip.open(temp, 'wb', compresslevel=level) as compressed:
+        shutil.copyfileobj(source, compressed, 1024 * 1024)
+    os.rename(temp, target)
+    return target
+
+class Segment:
+    """Rotated part of a log: bytes ``start`` to ``end`` of it, plain or gzipped."""
+
+    __slots__ = ('start', 'end', 'path')
+
+    def __init__(self, start: int, end: int, path: Path):
+        self.start = start
+        self.end = end
+        self.path = path
+
+    @property
+    def compressed(self) -> bool:
+        return self.path.suffix == '.gz'
+
+    def read(self, offset: int, length: int,
+             stream: Optional[IO[bytes]] = None) -> Tuple[bytes, Optional[IO[bytes]]]:
+        """Bytes of the segment and, when gzipped, the open stream to continue reading from.
+
+        Seeking a gzip stream forward only decompresses the gap, so passing
+        back the stream of the previous read makes paging through a
+        segment linear instead of decompressing from its start every time.
+        """
+        if not self.compressed:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return f.read(length), None
+        if stream is None or stream.tell() > offset:
+            if stream is not None:
+                stream.close()
+            stream = gzip.open(self.path, 'rb')
+        stream.seek(offset)
+        return stream.read(length), stream
+
+class LogRun:
+    """The log of one QEMU process: rotated segments, then the file QEMU writes to."""
+
+    __slots__ = ('key', 'path', 'segments', 'base', 'opened')
+
+    def __init__(self, key: str, path: Path, opened: float):
+        self.key = key
+        self.path = path
+        self.segments: List[Segment] = []
+        self.base = 0  # Offset of the first byte in ``path`` within the whole log
+        self.opened = opened  # When ``path`` last started empty
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def first(self) -> int:
+        """Lowest offset still on disk; older segments may have been retired"""
+        return self.segments[0].start if self.segments else self.base
+
+class LogIndex:
+    """QEMU log files of each VM, oldest first.
+
+    Built from one directory listing at startup and kept up to date as
+    VMs start and logs rotate, so finding a VM's current log never globs
+    or stats the whole logs directory. Offsets address the whole log of a
+    QEMU process, across its rotated (and compressed) segments.
+    """
+
+    MAX_STREAMS = 32  # Gzip streams kept open for readers paging through compressed segments
+
+    def __init__(self, logs_dir: Path):
+        self.logs_dir = logs_dir
+        self._runs: Dict[str, List[LogRun]] = {}  # VM key -> runs, oldest first
+        self._by_path: Dict[Path, LogRun] = {}
+        self._changed: Set[str] = set()  # Keys whose files changed since the last retention pass
+        # Open gzip streams by segment file and the offset they reached, for the reader that continues there
+        self._streams: 'OrderedDict[Tuple[Path, int], IO[bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.rescan()
+
+    def rescan(self):
+        runs: Dict[Tuple[str, str], LogRun] = {}
+        segments: Dict[Tuple[str, str], Dict[Tuple[int, int], Path]] = {}
+        try:
+            with os.scandir(self.logs_dir) as entries:
+                for entry in entries:
+                    if _TEMP_NAME.search(entry.name):
+                        os.unlink(entry.path)  # Interrupted rotation or compression
+                        continue
+                    match = _LOG_NAME.match(entry.name)
+                    if not match or not entry.is_file():
+                        continue
+                    run_id = (match['vm'], match['stamp'])
+                    if run_id not in runs:
+                        path = self.logs_dir / f"{match['vm']}_{match['stamp']}.log"
+                        opened = datetime.strptime(match['stamp'], "%Y%m%d_%H%M%S").timestamp()
+                        runs[run_id] = LogRun(match['vm'], path, opened)
+                    if match['start'] is not None:
+                        span = (int(match['start']), int(match['end']))
+                        known = segments.setdefault(run_id, {}).get(span)
+                        if known is not None:
+                            # Compressed copies are only renamed into place once complete
+                            plain = known if match['gz'] else Path(entry.path)
+                            plain.unlink(missing_ok=True)
+                            if not match['gz']:
+                                continue
+                        segments[run_id][span] = Path(entry.path)
+        except FileNotFoundError:
+            pass
+        by_key: Dict[str, List[LogRun]] = {}
+        for run_id in sorted(runs):
+            run = runs[run_id]
+            for (start, end), path in sorted(segments.get(run_id, {}).items()):
+                run.segments.append(Segment(start, end, path))
+            if run.segments:
+                run.base = run.segments[-1].end
+                run.opened = max(run.opened, run.segments[-1].path.stat().st_mtime)
+            by_key.setdefault(run.key, []).append(run)
+        with self._lock:
+            self._runs = by_key
+            self._by_path = {run.path: run for runs in by_key.values() for run in runs}
+            self._changed = set(by_key)
+
+    def create(self, name: str) -> Path:
+        """Path for the log of a new QEMU process of ``name``, registered as its newest"""
+        self.logs_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        key = _log_key(name)
+        path = self.logs_dir / f"{key}_{timestamp}.log"
+        with self._lock:
+            runs = self._runs.setdefault(key, [])
+            run = self._by_path.get(path)
+            if run is not None:
+                runs.remove(run)  # Restarted within the same second: the new process appends to it
+            else:
+                run = self._by_path[path] = LogRun(key, path, time.time())
+            runs.append(run)
+            self._changed.add(key)
+        return path
+
+    def latest(self, name: str) -> Optional[LogRun]:
+        with self._lock:
+            runs = self._runs.get(_log_key(name))
+            return runs[-1] if runs else None
+
+    def run(self, path: Path) -> Optional[LogRun]:
+        with self._lock:
+            return self._by_path.get(path)
+
+    def files(self, name: str) -> List[Path]:
+        with self._lock:
+            return [path for run in self._runs.get(_log_key(name), ())
+                    for path in [segment.path for segment in run.segments] + [run.path]]
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._runs)
+
+    def take_changed(self) -> Set[str]:
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return changed
+
+    def size(self, run: LogRun) -> int:
+        """Length of the whole log, rotated segments included"""
+        with self._lock:
+            try:
+                return run.base + run.path.stat().st_size
+            except FileNotFoundError:
+                return run.base
+
+    def read(self, name: str, offset: Optional[int] = None,
+             max_bytes: int = DEFAULT_CHUNK) -> Optional[Dict[str, Any]]:
+        """Read at most ``max_bytes`` of a VM's newest log from ``offset``, or its tail.
+
+        Returns the text as lines (line endings kept, the last one may be
+        unterminated), the byte range they came from and the size of the
+        log, or None if the VM has none. A tail starts at a line boundary.
+        An offset past the end (the log was replaced) reads from the start,
+        flagged with ``reset``; one that was already retired reads from the
+        oldest segment still kept.
+        """
+        run = self.latest(name)
+        if run is None:
+            return None
+        size = self.size(run)
+        reset = offset is not None and offset > size
+        if offset is None:
+            start = max(run.first, size - max_bytes)
+        else:
+            start = run.first if reset else max(offset, run.first)
+        start, data = self._read(run, start, min(max_bytes, size - start))
+        if offset is None and start > run.first:
+            newline = data.find(b'\n')
+            if newline != -1:
+                start += newline + 1
+                data = data[newline + 1:]
+        data = data[:_utf8_cut(data)]
+        return {
+            'file': run.name,
+            'offset': start,
+            'next_offset': start + len(data),
+            'size': size,
+            'reset': reset,
+            'logs': data.decode('utf-8', errors='replace').splitlines(keepends=True),
+        }
+
+    def _read(self, run: LogRun, start: int, length: int) -> Tuple[int, bytes]:
+        """Bytes ``start`` to ``start + length`` of a log, from segments and the live file"""
+        parts: List[bytes] = []
+        position, end = start, start + length
+        retries = 0
+        while position < end:
+            with self._lock:
+                if position < run.first:
+                    if parts:
+                        break  # Retired while reading; return the contiguous part
+                    position = start = run.first
+                if position >= run.base:
+                    # Under the lock, so a rotation cannot truncate the file between lookup and read
+                    parts.append(tpool.execute(_read_file, run.path, position - run.base, end - position))
+                    break
+                segments = run.segments
+                segment = segments[bisect.bisect_right([s.start for s in segments], position) - 1]
+                stream = self._streams.pop((segment.path, position - segment.start), None)
+            try:
+                data, stream = tpool.execute(segment.read, position - segment.start,
+                                             min(end, segment.end) - position, stream)
+            except FileNotFoundError:
+                # Compressed or retired meanwhile: look it up again
+                retries += 1
+                if retries > 3:
+                    break
+                continue
+            if not data:
+                if stream is not None:
+                    stream.close()
+                break
+            parts.append(data)
+            position += len(data)
+            if stream is not None:
+                self._keep_stream(segment, position - segment.start, stream)
+        return start, b''.join(parts)
+
+    def _keep_stream(self, segment: Segment, offset: int, stream: IO[bytes]):
+        """Keep a gzip stream for the next read from where it stopped; only the newest few stay open"""
+        evicted = []
+        with self._lock:
+            if offset >= segment.end - segment.start:
+                evicted.append(stream)  # Read to the end
+            else:
+                self._streams[(segment.path, offset)] = stream
+            while len(self._streams) > self.MAX_STREAMS:
+                evicted.append(self._streams.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def rotate(self, run: LogRun) -> Optional[Segment]:
+        """Move what QEMU has written so far into a new segment and empty its file.
+
+        QEMU keeps its file open in append mode, so after the truncation it
+        writes at the start again. This is copy-then-truncate: whatever QEMU
+        appends between the final size check and the truncation is lost. All
+        copying runs in tpool: first the bulk, then, under the lock, what was
+        appended meanwhile until the size matches, so only the truncation
+        itself is left in that window, and output seen right after it is
+        logged as a possible loss.
+        """
+        base = run.base
+        temp = run.path.with_name(f"{run.path.name}.{base}.tmp")
+        try:
+            copied = tpool.execute(_copy_file, run.path, temp)
+            with self._lock:
+                # The lock keeps readers off the live file; the copying itself runs in tpool
+                length, written = tpool.execute(_finish_copy, run.path, temp, copied)
+                if not length:
+                    temp.unlink()
+                    return None
+                segment = Segment(base, base + length, run.path.with_name(f"{run.path.name}.{base}-{base + length}"))
+                os.rename(temp, segment.path)
+                run.segments.append(segment)
+                run.base = segment.end
+                run.opened = time.time()
+                self._changed.add(run.key)
+        except FileNotFoundError:
+            temp.unlink(missing_ok=True)
+            return None
+        if written:
+            logger.warning(f"{run.path.name} was being written to while rotating at {segment.end} bytes; "
+                           f"output written during the truncation may be missing")
+        return segment
+
+    def compress(self, segment: Segment, level: int = 6):
+        """Replace a plain segment by a gzipped copy; the gzip itself runs in tpool"""
+        if segment.compressed:
+            return
+        target = tpool.execute(_gzip_file, segment.path, level)
+        with self._lock:
+            plain, segment.path = segment.path, target
+        plain.unlink(missing_ok=True)
+
+    def uncompressed(self) -> List[Segment]:
+        with self._lock:
+            return [segment for runs in self._runs.values() for run in runs
+                    for segment in run.segments if not segment.compressed]
+
+    def retire(self, key: str, max_files: int, max_bytes: int, max_age: float, live: Set[Path]) -> int:
+        """Delete a VM's oldest log files beyond the retention limits; returns how many.
+
+        Files QEMU is still writing to are counted but never deleted.
+        """
+        with self._lock:
+            files = [(run, segment, segment.path) for run in self._runs.get(key, ()) for segment in run.segments]
+            files += [(run, None, run.path) for run in self._runs.get(key, ())]
+            # Oldest first: runs by start time, within a run its segments before its file
+            order = {id(run): index for index, run in enumerate(self._runs.get(key, ()))}
+            files.sort(key=lambda file: (order[id(file[0])], file[1] is None, file[1].start if file[1] else 0))
+        sizes = []
+        for run, segment, path in files:
+            try:
+                stat = path.stat()
+                sizes.append((stat.st_size, stat.st_mtime))
+            except FileNotFoundError:
+                sizes.append((0, 0.0))
+        count, total = len(files), sum(size for size, _ in sizes)
+        cutoff = time.time() - max_age
+        retired = 0
+        for (run, segment, path), (size, mtime) in zip(files, sizes):
+            if count <= max_files and total <= max_bytes and mtime >= cutoff:
+                break
+            count -= 1
+            total -= size
+            if path in live:
+                continue
+            with self._lock:
+                if segment is not None:
+                    if segment in run.segments:
+                        run.segments.remove(segment)
+                    path = segment.path  # It may have been compressed since
+                elif run.segments:
+                    continue  # Rotated meanwhile, so it was live after all
+                else:
+                    runs = self._runs.get(key, [])
+                    if run in runs:
+                        runs.remove(run)
+                    self._by_path.pop(run.path, None)
+                    if not runs:
+                        self._runs.pop(key, None)
+            path.unlink(missing_ok=True)
+            with self._lock:
+                streams = [self._streams.pop(key) for key in list(self._streams) if key[0] == path]
+            for stream in streams:
+                stream.close()
+            retired += 1
+        return retired
+
+class LogRotator:
+    """Rotates QEMU logs by size and age, compresses rotated segments and applies retention.
+
+    Checks run on a background thread every ``interval`` seconds; gzip
+    runs on a worker through tpool so compressing never stalls the hub.
+    Retention limits apply to each VM's files separately.
+    """
+
+    def __init__(self, index: LogIndex, live: Callable[[], Iterable[Path]],
+                 rotate_bytes: int = 10 * 1024 * 1024, rotate_age: float = 86400,
+                 compress: bool = True, compress_level: int = 6,
+                 retain_files: int = 50, retain_bytes: int = 256 * 1024 * 1024, retain_days: float = 30,
+                 interval: float = 5.0):
+        self.index = index
+        self.live = live  # Log files QEMU processes are writing to, in append mode
+        self.rotate_bytes = rotate_bytes
+        self.rotate_age = rotate_age
+        self.compress_level = compress_level if compress else None
+        self.retain_files = retain_files
+        self.retain_bytes = retain_bytes
+        self.retain_age = retain_days * 86400
+        self.interval = interval
+        self._pending: 'queue.Queue[Optional[Segment]]' = queue.Queue()
+        self._running = False
+        self._threads: List[threading.Thread] = []
+
+    @classmethod
+    def from_config(cls, index: LogIndex, live: Callable[[], Iterable[Path]], config: Dict) -> 'LogRotator':
+        logs = config.get('logs', {})
+        return cls(index, live,
+                   rotate_bytes=logs.get('rotate_bytes', 10 * 1024 * 1024),
+                   rotate_age=logs.get('rotate_age', 86400),
+                   compress=logs.get('compress', True),
+                   compress_level=logs.get('compress_level', 6),
+                   retain_files=logs.get('retain_files', 50),
+                   retain_bytes=logs.get('retain_bytes', 256 * 1024 * 1024),
+                   retain_days=logs.get('retain_days', 30),
+                   interval=logs.get('check_interval', 5))
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        if self.compress_level is not None:
+            for segment in self.index.uncompressed():
+                self._pending.put(segment)
+        for target, name in ((self._run, 'log-rotator'), (self._compress_worker, 'log-compressor')):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._running = False
+        self._pending.put(None)
+
+    def _run(self):
+        last_sweep = 0.0
+        while self._running:
+            try:
+                self.check()
+                # Age limits apply without any new files, so every VM is looked at now and then
+                if time.monotonic() - last_sweep > 3600:
+                    last_sweep = time.monotonic()
+                    self.apply_retention(self.index.keys())
+                else:
+                    self.apply_retention(self.index.take_changed())
+            except Exception as e:
+                logger.error(f"Log rotation pass failed: {e}")
+            time.sleep(self.interval)
+
+    def check(self):
+        """Rotate every live log that reached the size or age limit"""
+        now = time.time()
+        for path in list(self.live()):
+            run = self.index.run(path)
+            if run is None:
+                continue
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size >= self.rotate_bytes or size and now - run.opened >= self.rotate_age:
+                segment = self.index.rotate(run)
+                if segment is not None:
+                    logger.info(f"Rotated {path.name} at {segment.end} bytes")
+                    if self.compress_level is not None:
+                        self._pending.put(segment)
+
+    def apply_retention(self, keys: Iterable[str]):
+        live = set(self.live())
+        for key in keys:
+            retired = self.index.retire(key, self.retain_files, self.retain_bytes, self.retain_age, live)
+            if retired:
+                logger.info(f"Removed {retired} old log files of {key}")
+            time.sleep(0)  # Yield between VMs; a sweep can cover thousands of them
+
+    def _compress_worker(self):
+        while True:
+            segment = self._pending.get()
+            if segment is None or not self._running:
+                break
+            try:
+                self.index.compress(segment, self.compress_level)
+            except FileNotFoundError:
+                pass  # Retired before its turn
+            except Exception as e:
+                logger.error(f"Failed to compress {segment.path}: {e}")
+
+class _Follower:
+    __slots__ = ('file', 'offset')
+
+    def __init__(self, file: Optional[str], offset: Optional[int]):
+        self.file = file
+        self.offset = offset
+
+class LogStream:
+    """Follows the newest log of VMs for connected clients.
+
+    Each pass checks the size of the log of every followed VM and reads
+    only what was appended since the offset a client was last sent, once
+    for all clients at the same position. Offsets carry on across
+    rotations. A new log (the VM was restarted) is sent from its tail with
+    ``reset`` set. Nothing is read for VMs no one follows.
+    """
+
+    def __init__(self, index: LogIndex, emit: Callable[[str, Dict[str, Any], str], None],
+                 interval: float = 0.5, chunk: int = DEFAULT_CHUNK):
+        self.index = index
+        self.emit = emit  # emit(event, data, sid)
+        self.interval = interval
+        self.chunk = chunk
+        self._followers: Dict[str, Dict[str, _Follower]] = {}  # VM name -> sid -> position
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='log-stream')
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def follow(self, sid: str, name: str, file: Optional[str] = None, offset: Optional[int] = None):
+        """Stream the log of ``name`` to ``sid``, from ``offset`` in ``file`` or its tail.
+
+        The first chunk is sent on the next pass, which also catches up a
+        client that reconnects with the position it had reached.
+        """
+        with self._lock:
+            self._followers.setdefault(name, {})[sid] = _Follower(file, offset)
+
+    def unfollow(self, sid: str, name: Optional[str] = None):
+        with self._lock:
+            names = [name] if name is not None else list(self._followers)
+            for vm_name in names:
+                followers = self._followers.get(vm_name)
+                if followers is not None:
+                    followers.pop(sid, None)
+                    if not followers:
+                        del self._followers[vm_name]
+
+    def _run(self):
+        while self._running:
+            try:
+                behind = self.poll()
+            except Exception as e:
+                logger.error(f"Log stream pass failed: {e}")
+                behind = False
+            # Catch up with a burst of output chunk by chunk, without waiting in between
+            time.sleep(0 if behind else self.interval)
+
+    def poll(self) -> bool:
+        """Send every follower what was appended to its VM's log since its offset.
+
+        Returns whether some follower is still more than a chunk behind.
+        """
+        behind = False
+        with self._lock:
+            followed = {name: dict(followers) for name, followers in self._followers.items()}
+        for name, followers in followed.items():
+            run = self.index.latest(name)
+            if run is None:
+                continue
+            size = self.index.size(run)
+            # Followers at the same position share one read
+            groups: Dict[Optional[int], List[Tuple[str, _Follower]]] = {}
+            for sid, follower in followers.items():
+                offset = follower.offset if follower.file == run.name else None
+                if offset is None or offset != size:
+                    groups.setdefault(offset, []).append((sid, follower))
+            for offset, members in groups.items():
+                try:
+                    chunk = self.index.read(name, offset, self.chunk)
+                except OSError as e:
+                    logger.warning(f"Cannot read log {run.path}: {e}")
+                    continue
+                if chunk is None:
+                    continue
+                # A different file than the client had is shown from scratch
+                chunk['reset'] = chunk['reset'] or offset is None
+                chunk['name'] = name
+                behind = behind or chunk['next_offset'] < chunk['size']
+                for sid, follower in members:
+                    follower.file, follower.offset = chunk['file'], chunk['next_offset']
+                    try:
+                        self.emit('vm_log', chunk, sid)
+                    except Exception as e:
+                        logger.error(f"Failed to send log of {name} to {sid}: {e}")
+        return behind
@@ -1,20 +1,40 @@
 from dataclasses import dataclass, field
-from dataclasses_json import dataclass_json
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple, Set
 import threading
 import subprocess
-import psutil
 import logging
 from pathlib import Path
-from datetime import datetime
 import time
 import os
 import atexit
+import sys
 from ..config.manager import config_manager, DEFAULT_CONFIG
 import uuid  # Import the uuid module
-from .qmp_client import QMPClient
+import psutil
+from .qmp_client import QMPClient, QMPError
+from .supervisor import ProcessSupervisor, AdoptedProcess
+from .ports import PortAllocator, PortError
+from .registry import VMRegistry
+from .sampler import MetricsSampler
+from .timeseries import MetricsHistory
+from .metrics import LatencyHistogram
+from .logs import LogIndex, LogRotator
+from .serial_console import SerialConsole
+
+# Configs are held for every VM, so keep instances compact where the runtime allows it
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+# Run state a VM enters on each QMP lifecycle event
+QMP_EVENT_STATES = {
+    'STOP': 'paused',
+    'RESUME': 'running',
+    'RESET': 'running',
+    'POWERDOWN': 'shutting_down',
+    'SHUTDOWN': 'shutting_down',
+    'GUEST_PANICKED': 'crashed',
+}
+
+@dataclass(**_SLOTS)
 class DiskDevice:
     path: str
     type: str = "hdd"  # "hdd" or "cdrom"
@@ -69,7 +89,7 @@ class DiskDevice:
             logging.error(f"Exception while creating disk image: {e}")
             return False
 
-@dataclass
+@dataclass(**_SLOTS)
 class DisplayConfig:
     type: str = "vnc"  # Will be set based on QEMU capabilities
     address: str = "0.0.0.0"
@@ -118,7 +138,7 @@ class DisplayConfig:
             display.websocket_port = int(data["websocket_port"]) if data["websocket_port"] else None
         return display
 
-@dataclass
+@dataclass(**_SLOTS)
 class GPUConfig:
     enabled: bool = False
     type: str = "virtio"  # virtio, vga, qxl
@@ -139,8 +159,7 @@ class GPUConfig:
             vram=data.get("vram", 64)
         )
 
-@dataclass_json
-@dataclass
+@dataclass(**_SLOTS)
 class VMConfig:
     name: str
     uuid: str = field(default_factory=lambda: str(uuid.uuid4()))  # Generate a unique UUID
@@ -159,19 +178,29 @@ class VMConfig:
     arch: str = "x86_64"
     machine: str = DEFAULT_CONFIG['qemu']['default_machine']
     additional_args: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
     qmp_socket: str = field(init=False)  # Make this field non-initializable directly
+    _dict: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        # Create the directory for QMP sockets if it doesn't exist
-        os.makedirs('/tmp/qmp_sockets', exist_ok=True)
-        logging.debug(f"Ensured QMP socket directory exists for VM config {self.name}")
-        
-        # Generate a unique QMP socket path based on the VM name
+        # Generate a unique QMP socket path based on the VM name; VMManager creates the directory
         safe_name = self.name.replace(" ", "_")  # Replace spaces with underscores for safety
         self.qmp_socket = f"/tmp/qmp_sockets/{safe_name}.qmp"  # Set a unique socket path
 
+    @property
+    def serial_socket(self) -> str:
+        """Unix socket QEMU serves a headless VM's serial console on, next to its QMP socket."""
+        return self.qmp_socket[:-len('.qmp')] + '.serial'
+
+    def invalidate(self):
+        """Drop the cached dict; call after changing the config in place."""
+        self._dict = None
+
     def to_dict(self):
-        data = {
+        """The config as a dict, cached until invalidate(); treat it as read-only."""
+        if self._dict is not None:
+            return self._dict
+        self._dict = {
             'name': self.name,
             'uuid': self.uuid,  # Include UUID in the dictionary
             'cpu': self.cpu,
@@ -189,9 +218,10 @@ class VMConfig:
             'arch': self.arch,
             'machine': self.machine,
             'additional_args': self.additional_args,
+            'tags': self.tags,
             'qmp_socket': self.qmp_socket
         }
-        return data
+        return self._dict
 
     @staticmethod
     def create_from_dict(data: Dict, qemu_caps=None) -> 'VMConfig':
@@ -222,8 +252,8 @@ class VMConfig:
             config_data['gpu'] = GPUConfig()
 
         # Override default machine type for ARM architectures if not specified
-        if config_data['arch'] in ["aarch64", "arm"]:
-            if config_data['machine'] == 'q35':
+        if config_data.get('arch') in ["aarch64", "arm"]:
+            if config_data.get('machine', 'q35') == 'q35':
                 config_data['machine'] = 'virt'
             
             # Enable virtio-gpu for ARM by default if no GPU is explicitly configured
@@ -246,50 +276,253 @@ class VMConfig:
             'headless': False,
             'arch': 'x86_64',
             'machine': current_config['qemu']['default_machine'],
-            'additional_args': []
+            'additional_args': [],
+            'tags': []
         }
         
         for key, default in defaults.items():
             if key not in config_data:
                 config_data[key] = default
+
+        # Tags are free-form labels; keep them unique and in the order given
+        config_data['tags'] = list(dict.fromkeys(str(tag).strip() for tag in config_data['tags'] if str(tag).strip()))
         
         return VMConfig(**config_data)
 
 class VMManager:
     def __init__(self):
-        self.vms: Dict[str, VMConfig] = {}
+        self.vms = VMRegistry()  # name -> VMConfig, indexed by UUID, arch, tag and run state
         self.processes: Dict[str, subprocess.Popen] = {}
-        self.stop_events: Dict[str, threading.Event] = {}
-        self.monitor_threads: Dict[str, threading.Thread] = {}
-        self.status_callback = None
+        self.vm_states: Dict[str, str] = {}  # starting, running, paused, shutting_down, crashed, stopped
+        self.start_errors: Dict[str, str] = {}  # Output of QEMU processes that exited while starting
+        self._start_logs: Dict[str, Path] = {}  # Log file of each VM's current QEMU process
+        self.logs = LogIndex(config_manager.logs_dir)  # Every QEMU log file, per VM
+        self._unrotated_logs: Set[Path] = set()  # Logs of adopted VMs not opened for appending
+        self.qmp_sessions: Dict[str, QMPClient] = {}  # One long-lived QMP connection per running VM
+        self.consoles: Dict[str, SerialConsole] = {}  # Serial console of each running headless VM
+        self._qmp_lock = threading.Lock()
+        self._qmp_metrics: Dict[str, Dict] = {}  # Last block IO counters of each VM, from QMP
+        self._qmp_refreshing: Set[str] = set()  # VMs whose QMP metrics queries are in flight
+        self.qmp_latency = LatencyHistogram()  # Command round trips of sessions closed so far, in ms
+        self._state_lock = threading.Lock()
+        self._state_changed = threading.Condition(self._state_lock)
+        self._shut_down = False
+        # Display ports of all VMs, so concurrent starts never pick the same one
+        self.ports = PortAllocator.from_config(config_manager.config)
         self.stopped_callback = None
+        self.event_callback = None
+        self.change_callback = None  # Called with a VM name whenever its status may have changed
+        self.console_callback = None  # Called with a VM name, serial output and its end offset
+        
+        # One watcher for all QEMU process exits instead of a thread per VM
+        self.supervisor = ProcessSupervisor(self._handle_exit)
+        self.supervisor.start()
+        
+        # Resource usage is sampled in the background; status reads the latest snapshot
+        metrics_config = config_manager.config.get('metrics', {})
+        self.history = MetricsHistory()
+        self.sampler = MetricsSampler(interval=metrics_config.get('sample_interval', 1.0),
+                                      on_sample=self._on_sample)
+        self.sampler.collectors.append(self._collect_qmp_metrics)
+        self.sampler.start()
         
         # Ensure QMP socket directory exists
         os.makedirs('/tmp/qmp_sockets', exist_ok=True)
         logging.info("Ensured QMP socket directory exists: /tmp/qmp_sockets")
         
         self.load_vm_configs()
+        # Pick up VMs left running by a previous qemuweb
+        self.adopt_running_vms()
+        # Logs of running VMs are rotated in place; old ones are compressed and retired
+        self.log_rotator = LogRotator.from_config(self.logs, self._rotatable_logs, config_manager.config)
+        self.log_rotator.start()
         # Register cleanup on exit
         atexit.register(self._cleanup_all_vms)
         
+    def pidfile_path(self, vm: VMConfig) -> Path:
+        """Where QEMU writes its pid; named like the VM's QMP socket."""
+        return config_manager.run_dir / f"{Path(vm.qmp_socket).stem}.pid"
+
+    def _scan_qemu_processes(self) -> Dict[str, psutil.Process]:
+        """Live processes by the QMP socket path on their command line."""
+        found = {}
+        for proc in psutil.process_iter(['cmdline']):
+            for arg in proc.info['cmdline'] or ():
+                if arg.startswith('unix:') and arg.endswith(',server,nowait'):
+                    found[arg[len('unix:'):-len(',server,nowait')]] = proc
+        return found
+
+    def _find_vm_process(self, vm: VMConfig, scanned: Dict[str, psutil.Process]) -> Optional[psutil.Process]:
+        """The QEMU process of a VM, from its pidfile or else the /proc scan."""
+        pidfile = self.pidfile_path(vm)
+        try:
+            proc = psutil.Process(int(pidfile.read_text().strip()))
+            # The pid may have been reused; it must be serving this VM's QMP socket
+            if f"unix:{vm.qmp_socket},server,nowait" in proc.cmdline():
+                return proc
+        except (OSError, ValueError, psutil.Error):
+            pass
+        return scanned.get(vm.qmp_socket)
+
+    def adopt_running_vms(self):
+        """Re-adopt QEMU processes that outlived a previous qemuweb.
+        
+        Each VM is matched through its pidfile, falling back to a scan of
+        /proc for the VM's QMP socket. Adopted VMs are supervised, sampled and
+        attached to QMP like freshly started ones; their display port is
+        recovered from the command line. Stale pidfiles and sockets are removed.
+        """
+        scanned = self._scan_qemu_processes()
+        for name, vm in list(self.vms.items()):
+            proc = self._find_vm_process(vm, scanned)
+            if proc is None:
+                self.pidfile_path(vm).unlink(missing_ok=True)
+                if os.path.exists(vm.qmp_socket):
+                    os.unlink(vm.qmp_socket)
+                continue
+            try:
+                process = AdoptedProcess(proc)
+                dynamic_port = not vm.display.port
+                self._restore_runtime_config(vm, process.args)
+                if vm.display.type in ('vnc', 'spice') and vm.display.port:
+                    # Bound by the VM itself, so no availability check
+                    self.ports.reserve(vm.display.type, name, vm.display.port, dynamic=dynamic_port, verify=False)
+                log_path = Path(os.readlink(f"/proc/{proc.pid}/fd/1")) if os.path.exists('/proc') else None
+            except (OSError, ValueError, psutil.Error, PortError) as e:
+                logging.warning(f"Cannot adopt VM {name} (pid {proc.pid}): {e}")
+                continue
+            self.processes[name] = process
+            if log_path and log_path.parent == config_manager.logs_dir:
+                self._start_logs[name] = log_path
+                if not self._appends_output(proc.pid):
+                    # Truncating it would leave QEMU writing at its old offset
+                    logging.info(f"Log of adopted VM {name} will not be rotated until it restarts")
+                    self._unrotated_logs.add(log_path)
+            self._set_state(name, 'starting')
+            self.supervisor.watch(name, process)
+            self.sampler.track(name, process.pid)
+            self._attach_qmp(name, process)
+            if vm.headless and any(vm.serial_socket in arg for arg in process.args):
+                self._attach_console(vm)
+            logging.info(f"Adopted running VM {name} (pid {process.pid})")
+
+    @staticmethod
+    def _appends_output(pid: int) -> bool:
+        """Whether a process has its stdout open in append mode, so it can be rotated in place."""
+        try:
+            with open(f"/proc/{pid}/fdinfo/1") as f:
+                for line in f:
+                    if line.startswith('flags:'):
+                        return bool(int(line.split()[1], 8) & os.O_APPEND)
+        except (OSError, ValueError, IndexError):
+            pass
+        return False
+
+    def _rotatable_logs(self) -> List[Path]:
+        """Log files running QEMU processes append to"""
+        return [path for path in list(self._start_logs.values()) if path not in self._unrotated_logs]
+
+    def _restore_runtime_config(self, vm: VMConfig, args: List[str]):
+        """Recover the display port a running QEMU was given from its command line."""
+        for option, value in zip(args, args[1:]):
+            if option == '-vnc' and vm.display.type == 'vnc':
+                display = value.split(',')[0].rsplit(':', 1)[-1]
+                self._set_display_port(vm, config_manager.config['vnc']['start_port'] + int(display))
+            elif option == '-spice' and vm.display.type == 'spice':
+                for part in value.split(','):
+                    if part.startswith('port='):
+                        self._set_display_port(vm, int(part[len('port='):]))
+
     def _cleanup_all_vms(self):
         """Clean up all running VMs on program exit."""
-        logging.info("Cleaning up all running VMs...")
-        # Get list of running VMs first since we'll be modifying the processes dict
-        running_vms = [(name, process) for name, process in self.processes.items() if process.poll() is None]
+        self.shutdown_all()
+
+    def shutdown_all(self, timeout: Optional[float] = None, term_grace: Optional[float] = None,
+                     leave_running: Optional[bool] = None):
+        """Shut down every running VM in parallel within one deadline.
         
-        for vm_name, process in running_vms:
+        All guests get an ACPI powerdown at once and are waited for together
+        for up to ``timeout`` seconds. Only the stragglers are then sent
+        SIGTERM, and whatever is left after ``term_grace`` seconds SIGKILL.
+        With ``leave_running`` the VMs are not touched at all, only detached.
+        Defaults come from the ``shutdown`` config section. Runs once.
+        """
+        with self._state_lock:
+            if self._shut_down:
+                return
+            self._shut_down = True
+        shutdown_config = config_manager.config.get('shutdown', {})
+        timeout = shutdown_config.get('timeout', 60) if timeout is None else timeout
+        term_grace = shutdown_config.get('term_grace', 5) if term_grace is None else term_grace
+        leave_running = shutdown_config.get('leave_running', False) if leave_running is None else leave_running
+
+        running = {name: process for name, process in list(self.processes.items()) if process.poll() is None}
+        # Exits below are handled here, not by the watcher
+        self.supervisor.stop()
+        self.sampler.stop()
+        self.log_rotator.stop()
+
+        if leave_running:
+            for name in list(self.qmp_sessions):
+                self._close_qmp(name)
+            for name in list(self.consoles):
+                self._close_console(name)
+            logging.info(f"Leaving {len(running)} VMs running: {', '.join(running) or 'none'}")
+            return
+        if not running:
+            return
+
+        started = time.monotonic()
+        logging.info(f"Shutting down {len(running)} VMs (ACPI, {timeout:g}s deadline)...")
+
+        def powerdown(name: str):
+            self._set_state(name, 'shutting_down')
+            qmp = self.get_qmp(name)
+            if not qmp:
+                return
+            qmp.auto_reconnect = False  # The socket lingers briefly after QEMU exits
             try:
-                logging.info(f"Stopping VM {vm_name} during cleanup")
-                self.stop_vm(vm_name)
-            except Exception as e:
-                logging.error(f"Error stopping VM {vm_name} during cleanup: {e}")
-                # Force kill if stop_vm failed
-                try:
-                    process.kill()
-                    process.wait(timeout=1)
-                except Exception as kill_error:
-                    logging.error(f"Error force killing VM {vm_name}: {kill_error}")
+                qmp.execute('system_powerdown', timeout=min(5.0, max(timeout, 0.1)))
+            except QMPError as e:
+                logging.warning(f"ACPI shutdown of VM {name} failed: {e}")
+
+        requests = [threading.Thread(target=powerdown, args=(name,), daemon=True) for name in running]
+        for request in requests:
+            request.start()
+
+        remaining = self._wait_for_exit(running, started + timeout)
+        if remaining:
+            logging.warning(f"{len(remaining)} VMs ignored ACPI shutdown, terminating: {', '.join(remaining)}")
+            for process in remaining.values():
+                self._signal(process, 'terminate')
+            remaining = self._wait_for_exit(remaining, time.monotonic() + term_grace)
+        if remaining:
+            logging.warning(f"Killing {len(remaining)} VMs: {', '.join(remaining)}")
+            for process in remaining.values():
+                self._signal(process, 'kill')
+            remaining = self._wait_for_exit(remaining, time.monotonic() + 2)
+
+        for name, process in running.items():
+            self._handle_exit(name, process, process.poll())
+        logging.info(f"Shut down {len(running) - len(remaining)} VMs in {time.monotonic() - started:.1f}s")
+
+    @staticmethod
+    def _wait_for_exit(processes: Dict[str, subprocess.Popen], deadline: float) -> Dict[str, subprocess.Popen]:
+        """Poll processes until all have exited or the deadline passes; returns those still alive."""
+        remaining = dict(processes)
+        while remaining:
+            remaining = {name: process for name, process in remaining.items() if process.poll() is None}
+            if not remaining or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        return remaining
+
+    @staticmethod
+    def _signal(process: subprocess.Popen, method: str):
+        try:
+            getattr(process, method)()
+        except OSError:
+            pass  # Exited in the meantime
 
     def list_directory(self, path: str = '/') -> Dict:
         """List contents of a directory."""
@@ -331,44 +564,97 @@ class VMManager:
                 'entries': []
             }
 
-    def set_callbacks(self, status_callback, stopped_callback):
-        self.status_callback = status_callback
+    def set_callbacks(self, stopped_callback, event_callback=None, change_callback=None, console_callback=None):
         self.stopped_callback = stopped_callback
+        self.event_callback = event_callback
+        self.change_callback = change_callback
+        self.console_callback = console_callback
+
+    def _changed(self, name: str):
+        if self.change_callback:
+            self.change_callback(name)
+
+    def _on_sample(self, name: str, snapshot: Dict):
+        self.history.record(name, snapshot)
+        self._changed(name)
 
     def load_vm_configs(self):
-        """Load VM configurations from file."""
+        """Load VM configurations from the config store."""
         try:
-            data = config_manager.load_vm_configs()
-            # Handle both old (dict) and new (list) formats
-            if isinstance(data, dict):
-                for name, config in data.items():
-                    vm_config = VMConfig.from_dict(config)
-                    self.vms[name] = vm_config
-            else:  # list format
-                for vm_data in data:
-                    vm_config = VMConfig.from_dict(vm_data)
-                    self.vms[vm_config.name] = vm_config
+            for vm_data in config_manager.load_vm_configs():
+                vm_config = VMConfig.create_from_dict(vm_data)
+                self.vms[vm_config.name] = vm_config
+            for vm_config in self.vms.values():
+                self._reserve_configured_ports(vm_config)
             logging.info(f"Loaded {len(self.vms)} VM configurations")
         except Exception as e:
             logging.error(f"Error loading VM configs: {str(e)}")
-            self.vms = {}
+            self.vms.clear()
 
-    def save_vm_configs(self):
-        """Save VM configurations to file."""
+    def save_vm_config(self, vm: VMConfig):
+        """Persist one VM's configuration; only that record is rewritten."""
         try:
-            data = [vm.to_dict() for vm in self.vms.values()]
-            config_manager.save_vm_configs(data)
-            logging.info(f"Saved {len(self.vms)} VM configurations")
+            config_manager.save_vm_config(vm.to_dict())
+            logging.info(f"Saved configuration of VM {vm.name}")
         except Exception as e:
-            logging.error(f"Error saving VM configs: {e}")
+            logging.error(f"Error saving configuration of VM {vm.name}: {e}")
 
     def get_vm(self, name: str) -> Optional[VMConfig]:
         """Get a VM configuration by name."""
         return self.vms.get(name)
 
-    def get_all_vms(self) -> List[Dict]:
-        """Get all VM configurations with their current status."""
-        return [self.get_vm_status(name) for name in self.vms.keys() if self.get_vm_status(name) is not None]
+    def find_vm(self, key: str) -> Optional[VMConfig]:
+        """Get a VM configuration by name or UUID."""
+        return self.vms.find(key)
+
+    def get_display_port(self, key: str) -> Tuple[Optional[VMConfig], Optional[int]]:
+        """The VM (by name or UUID) and its display port, if it is running with a display."""
+        vm = self.vms.find(key)
+        if vm is None:
+            return None, None
+        process = self.processes.get(vm.name)
+        if process is None or process.poll() is not None or vm.headless:
+            return vm, None
+        return vm, vm.display.port
+
+    def get_all_vms(self, arch: Optional[str] = None, tag: Optional[str] = None,
+                    state: Optional[str] = None) -> List[Dict]:
+        """Get VM configurations with their current status, optionally filtered.
+
+        Filters are answered from the registry indexes, so only the matching
+        VMs have their status computed.
+        """
+        names = self.vms.select(arch=arch, tag=tag, state=state) if arch or tag or state else list(self.vms)
+        return [status for status in map(self.get_vm_status, names) if status]
+
+    def list_vm_names(self, arch: Optional[str] = None, tag: Optional[str] = None,
+                      states: Optional[List[str]] = None, after: Optional[int] = None,
+                      limit: Optional[int] = None) -> Tuple[List[str], Optional[int]]:
+        """One page of VM names matching the filters, in registry order.
+
+        ``states`` matches any of several run states. ``after`` is the cursor
+        returned with the previous page; the cursor returned with this one is
+        None on the last page. Cursors stay valid while VMs are added or removed.
+        """
+        if states:
+            names = self.vms.ordered(name for state in states
+                                     for name in self.vms.select(arch=arch, tag=tag, state=state))
+        elif arch or tag:
+            names = self.vms.select(arch=arch, tag=tag)
+        else:
+            names = list(self.vms)
+        if after is not None:
+            position = self.vms.position
+            names = [name for name in names if position(name) > after]
+        if limit is None or len(names) <= limit:
+            return names, None
+        names = names[:limit]
+        return names, self.vms.position(names[-1])
+
+    def inventory_version(self, include_metrics: bool = True) -> str:
+        """Changes whenever a listing could: configs, run states and, optionally, sampled metrics."""
+        version = str(self.vms.version)
+        return f"{version}.{self.sampler.generation}" if include_metrics else version
 
     def add_vm(self, config_data: Dict) -> bool:
         """Add a new VM configuration."""
@@ -377,8 +663,13 @@ class VMManager:
             if vm_config.name in self.vms:
                 logging.error(f"VM with name {vm_config.name} already exists")
                 return False
+            # The UUID names the stored record, so it is assigned here and never taken from the client
+            vm_config.uuid = str(uuid.uuid4())
+            vm_config.invalidate()
             self.vms[vm_config.name] = vm_config
-            self.save_vm_configs()
+            self._reserve_configured_ports(vm_config)
+            self.save_vm_config(vm_config)
+            self._changed(vm_config.name)
             logging.info(f"Added new VM: {vm_config.name}")
             return True
         except Exception as e:
@@ -401,8 +692,14 @@ class VMManager:
                 logging.error(f"Cannot change VM name from {name} to {vm_config.name}")
                 return False
             
+            # The UUID names the stored record, so it survives edits
+            vm_config.uuid = self.vms[name].uuid
+            vm_config.invalidate()
             self.vms[name] = vm_config
-            self.save_vm_configs()
+            self.ports.release(name)
+            self._reserve_configured_ports(vm_config)
+            self.save_vm_config(vm_config)
+            self._changed(name)
             logging.info(f"Updated VM: {name}")
             return True
         except Exception as e:
@@ -416,11 +713,15 @@ class VMManager:
             if name in self.processes and self.processes[name].poll() is None:
                 self.stop_vm(name)
             
-            # Remove the config from the dict
-            del self.vms[name]
-            
-            # Save the updated configs
-            self.save_vm_configs()
+            # Remove the config from the dict and its stored record
+            vm = self.vms.pop(name)
+            self.history.remove(name)
+            self.ports.release(name)
+            try:
+                config_manager.delete_vm_config(vm.uuid)
+            except OSError as e:
+                logging.error(f"Error deleting configuration of VM {name}: {e}")
+            self._changed(name)
             
             return True
         return False
@@ -439,64 +740,52 @@ class VMManager:
         os.makedirs('/tmp/qmp_sockets', exist_ok=True)
         logging.debug(f"Ensured QMP socket directory exists for VM {name}")
 
-        # Dynamically assign a VNC port if not set
-        if vm.display.type == "vnc" and not vm.display.port:
-            success, port = self._find_free_port(5900, 6000)
-            if not success:
-                return False, "No free VNC port found"
-            vm.display.port = port
-            
-        elif vm.display.type == "spice" and not vm.display.port:
-            success, port = self._find_free_port(5900, 6000)
-            if not success:
-                return False, "No free SPICE port found"
-            vm.display.port = port
+        # Reserve the display port, assigning one if none is configured
+        try:
+            self._assign_display_port(vm)
+        except PortError as e:
+            return False, str(e)
 
         try:
-            command = self._build_qemu_command(vm)
-            
             # Get the log file path
-            log_dir = config_manager.logs_dir
-            log_dir.mkdir(exist_ok=True)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_file_path = log_dir / f"{name.replace(' ', '_')}_{timestamp}.log"
+            log_file_path = self.logs.create(name)
+            command = self._build_qemu_command(vm, log_file_path)
 
-            # Open the log file
-            log_file = open(log_file_path, 'w')
+            # Open the log file; appending lets it be rotated while QEMU writes to it
+            log_file = open(log_file_path, 'a')
 
             logging.info(f"Starting VM {name} with command: {' '.join(command)}")
             logging.info(f"VM {name} logs will be written to {log_file_path}")
 
-            process = subprocess.Popen(command, stdout=log_file, stderr=log_file)
-            
-            # Give QEMU a moment to start up or fail
-            time.sleep(1)
-            
-            # Check if the process exited quickly, which might indicate an error
-            if process.poll() is not None:
-                # Read the log to get the error
-                log_file.close()
-                with open(log_file_path, 'r') as f:
-                    error_output = f.read().strip()
-                
-                # If there's no output, provide a generic message.
-                if not error_output:
-                    error_output = "QEMU process failed to start with no specific error message."
-
-                logging.error(f"Failed to start VM {name}: {error_output}")
-                return False, error_output
+            # Drop any session and socket left over from a previous run of this VM,
+            # so the readiness probe below only sees the new QEMU's socket
+            self._close_qmp(name)
+            self._close_console(name)
+            for path in (vm.qmp_socket, vm.serial_socket):
+                if os.path.exists(path):
+                    os.unlink(path)
+            with log_file:
+                # Own session: a Ctrl+C aimed at qemuweb must not reach the guests,
+                # shutdown_all decides what happens to them
+                process = subprocess.Popen(command, stdout=log_file, stderr=log_file, start_new_session=True)
 
+            # Return right away; the probe reports running once QMP answers,
+            # and the supervisor reports a failure if QEMU exits first
+            self.start_errors.pop(name, None)
+            self._start_logs[name] = log_file_path
             self.processes[name] = process
-            self.stop_events[name] = threading.Event()
-            self._start_monitor_thread(name)
-            
-            if self.status_callback:
-                self.status_callback(self.get_vm_status(name))
+            self._set_state(name, 'starting')
+            self.supervisor.watch(name, process)
+            self.sampler.track(name, process.pid)
+            self._attach_qmp(name, process)
+            if vm.headless:
+                self._attach_console(vm)
                 
             return True, None
         
         except Exception as e:
             logging.error(f"Failed to start VM {name}: {str(e)}")
+            self._release_dynamic_ports(vm)
             return False, str(e)
 
     def stop_vm(self, name: str) -> bool:
@@ -518,20 +807,9 @@ class VMManager:
                     except subprocess.TimeoutExpired:
                         pass
             
-            # Signal monitor thread to stop
-            if name in self.stop_events:
-                self.stop_events[name].set()
-            
-            # Clean up
-            self.processes.pop(name, None)
-            self.monitor_threads.pop(name, None)
-            self.stop_events.pop(name, None)
-            
+            # Clean up, unless the supervisor already saw the exit
+            self._handle_exit(name, process, process.returncode)
             logging.info(f"Stopped VM: {name}")
-            
-            if self.stopped_callback:
-                self.stopped_callback(name)
-            
             return True
             
         except Exception as e:
@@ -617,36 +895,223 @@ class VMManager:
                 except subprocess.TimeoutExpired:
                     pass
             
-            # Signal monitor thread to stop
-            if name in self.stop_events:
-                self.stop_events[name].set()
-            
-            # Clean up
-            self.processes.pop(name, None)
-            self.monitor_threads.pop(name, None)
-            self.stop_events.pop(name, None)
-            
+            # Clean up, unless the supervisor already saw the exit
+            self._handle_exit(name, process, process.returncode)
             logging.info(f"Force powered off VM: {name}")
-            
-            if self.stopped_callback:
-                self.stopped_callback(name)
-            
             return True, None
             
         except Exception as e:
             logging.error(f"Error force powering off VM {name}: {e}")
             return False, str(e)
 
+    def get_qmp(self, name: str) -> Optional[QMPClient]:
+        """Get the VM's QMP session, creating it on first use.
+        
+        The session connects lazily on its first command and reconnects on its
+        own, so callers simply run commands on it.
+        """
+        vm = self.get_vm(name)
+        if not vm:
+            return None
+        with self._qmp_lock:
+            qmp = self.qmp_sessions.get(name)
+            if qmp is None:
+                qmp = QMPClient(vm.qmp_socket,
+                                event_callback=lambda event, message: self._on_qmp_event(name, event, message))
+                self.qmp_sessions[name] = qmp
+            return qmp
+
+    def qmp_execute(self, name: str, command: str, arguments: Optional[Dict] = None, timeout: float = 5.0):
+        """Run a QMP command on a VM's session, raising QMPError on failure."""
+        qmp = self.get_qmp(name)
+        if not qmp:
+            raise QMPError(f"VM {name} not found")
+        return qmp.execute(command, arguments, timeout)
+
+    def _attach_qmp(self, name: str, process: subprocess.Popen, timeout: float = 30.0):
+        """Connect the VM's QMP session in the background; this is the readiness probe.
+        
+        QEMU creates the socket shortly after launch, so keep trying while the
+        process is alive. A completed QMP handshake moves the VM from starting to
+        running; once connected the session reconnects by itself.
+        """
+        qmp = self.get_qmp(name)
+        
+        def ready():
+            if self.processes.get(name) is not process or self.vm_states.get(name) != 'starting':
+                return
+            state = 'running'
+            if qmp.connected:
+                try:
+                    # An adopted VM may have been paused while nobody was watching
+                    if (qmp.execute('query-status', timeout=2.0) or {}).get('status') == 'paused':
+                        state = 'paused'
+                except QMPError:
+                    pass
+            self._set_state(name, state)
+        
+        def connect():
+            deadline = time.monotonic() + timeout
+            delay = 0.05
+            while time.monotonic() < deadline and process.poll() is None:
+                if qmp.connected or (os.path.exists(qmp.socket_path) and qmp.connect()):
+                    ready()
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+            if process.poll() is None:
+                # Alive but without a monitor; treat it as started rather than stuck
+                logging.warning(f"Could not connect to QMP for VM {name}; lifecycle events unavailable")
+                ready()
+        
+        threading.Thread(target=connect, daemon=True, name=f"qmp-attach-{name}").start()
+
+    def _on_qmp_event(self, name: str, event: str, message: Dict):
+        """Track run state from QMP lifecycle events."""
+        state = QMP_EVENT_STATES.get(event)
+        if state is None:
+            return
+        logging.info(f"VM {name} QMP event: {event}")
+        if self.event_callback:
+            self.event_callback({'name': name, 'event': event, 'data': message.get('data', {})})
+        self._set_state(name, state)
+
+    def _set_state(self, name: str, state: str):
+        """Record a VM's run state, notifying listeners only when it changes."""
+        with self._state_lock:
+            if self.vm_states.get(name) == state:
+                return
+            self.vm_states[name] = state
+            self.vms.set_state(name, 'failed' if state == 'stopped' and name in self.start_errors else state)
+            self._state_changed.notify_all()
+        self._changed(name)
+
+    def wait_for_state(self, name: str, states: Set[str], timeout: Optional[float] = None) -> Optional[str]:
+        """Block until the VM's run state is one of ``states``; returns the state, or None on timeout."""
+        with self._state_changed:
+            if self._state_changed.wait_for(lambda: self.vm_states.get(name, 'stopped') in states, timeout):
+                return self.vm_states.get(name, 'stopped')
+        return None
+
+    def _handle_exit(self, name: str, process: subprocess.Popen, returncode: Optional[int]):
+        """Clean up after a VM process has exited, once per process."""
+        with self._state_lock:
+            if self.processes.get(name) is not process:
+                return  # Already handled by stop_vm/power_off_vm or the supervisor
+            self.processes.pop(name, None)
+            log_path = self._start_logs.pop(name, None)
+            self._unrotated_logs.discard(log_path)
+        self.supervisor.unwatch(name)
+        self.sampler.untrack(name)
+        self._close_qmp(name)
+        self._close_console(name)
+        vm = self.vms.get(name)
+        if vm:
+            self.pidfile_path(vm).unlink(missing_ok=True)
+            self._release_dynamic_ports(vm)
+        state = self.vm_states.get(name)
+        if state == 'starting':
+            self._start_failed(name, log_path, returncode)
+        elif state == 'crashed':
+            logging.warning(f"VM {name} exited after a guest panic (code {returncode})")
+        else:
+            logging.info(f"VM {name} exited with code {returncode}")
+        self._set_state(name, 'stopped')
+        if self.stopped_callback:
+            self.stopped_callback(name)
+
+    def _start_failed(self, name: str, log_path: Optional[Path], returncode: Optional[int]):
+        """Report a QEMU process that exited before becoming ready, with its output."""
+        error_output = ''
+        if log_path:
+            try:
+                with open(log_path, 'r', errors='replace') as f:
+                    error_output = f.read()[-4096:].strip()
+            except OSError:
+                pass
+        if not error_output:
+            error_output = f"QEMU process failed to start with no specific error message (exit code {returncode})."
+        logging.error(f"Failed to start VM {name}: {error_output}")
+        self.start_errors[name] = error_output
+        with self._state_lock:
+            self.vm_states[name] = 'failed'
+            self.vms.set_state(name, 'failed')
+            self._state_changed.notify_all()
+        self._changed(name)
+
+    def _collect_qmp_metrics(self, name: str) -> Dict:
+        """Latest block IO counters for the sampler, refreshed in the background.
+        
+        Each VM is queried on its own thread, so all VMs are queried at once
+        and the sampling pass never waits on a monitor. A VM whose previous
+        queries have not returned yet is skipped and keeps its last values.
+        """
+        qmp = self.qmp_sessions.get(name)
+        if not qmp or not qmp.connected:
+            self._qmp_metrics.pop(name, None)
+            return {}
+        if name not in self._qmp_refreshing:
+            self._qmp_refreshing.add(name)
+            threading.Thread(target=self._refresh_qmp_metrics, args=(name, qmp), daemon=True,
+                             name=f"qmp-metrics-{name}").start()
+        return self._qmp_metrics.get(name, {})
+
+    def _refresh_qmp_metrics(self, name: str, qmp: QMPClient):
+        """Query block IO counters, plus vCPU thread ids on first use"""
+        try:
+            if not self.sampler.has_vcpu_threads(name):
+                cpus = qmp.execute('query-cpus-fast', timeout=1.0) or []
+                self.sampler.set_vcpu_threads(name, {cpu['thread-id'] for cpu in cpus if 'thread-id' in cpu})
+            devices = qmp.execute('query-blockstats', timeout=1.0) or []
+            if self.qmp_sessions.get(name) is qmp:
+                self._qmp_metrics[name] = {
+                    'disk_read_bytes': sum(device.get('stats', {}).get('rd_bytes', 0) for device in devices),
+                    'disk_write_bytes': sum(device.get('stats', {}).get('wr_bytes', 0) for device in devices),
+                }
+        except QMPError as e:
+            logging.debug(f"QMP metrics unavailable for VM {name}: {e}")
+        finally:
+            self._qmp_refreshing.discard(name)
+
+    def _attach_console(self, vm: VMConfig):
+        """Connect a headless VM's serial console in the background; output goes to console_callback."""
+        console_config = config_manager.config.get('console', {})
+        console = SerialConsole(vm.name, vm.serial_socket, on_output=self._on_console_output,
+                                scrollback=console_config.get('scrollback', 256 * 1024))
+        self._close_console(vm.name)
+        self.consoles[vm.name] = console
+        console.start()
+
+    def _on_console_output(self, name: str, data: bytes, offset: int):
+        if self.console_callback:
+            self.console_callback(name, data, offset)
+
+    def _close_console(self, name: str):
+        console = self.consoles.pop(name, None)
+        if console:
+            console.close()
+
+    def console_write(self, name: str, data: bytes) -> bool:
+        """Type into a headless VM's serial console; False if it has none connected."""
+        console = self.consoles.get(name)
+        return console.write(data) if console else False
+
+    def _close_qmp(self, name: str):
+        """Close a VM's QMP session once its process is gone."""
+        with self._qmp_lock:
+            qmp = self.qmp_sessions.pop(name, None)
+            if qmp:
+                # Kept so the exported command latency keeps counting after the VM stops
+                self.qmp_latency.merge(qmp.latency)
+        self._qmp_metrics.pop(name, None)
+        if qmp:
+            qmp.close()
+
     def _acpi_shutdown(self, name: str) -> bool:
         """Send ACPI shutdown signal to VM via QMP."""
         try:
-            vm = self.get_vm(name)
-            if not vm:
-                return False
-            
-            with QMPClient(vm.qmp_socket) as qmp:
-                return qmp.system_powerdown()
-                
+            qmp = self.get_qmp(name)
+            return qmp.system_powerdown() if qmp else False
         except Exception as e:
             logging.error(f"Error sending ACPI shutdown to VM {name}: {e}")
             return False
@@ -654,13 +1119,8 @@ class VMManager:
     def _hard_reset(self, name: str) -> bool:
         """Send hard reset signal to VM via QMP."""
         try:
-            vm = self.get_vm(name)
-            if not vm:
-                return False
-            
-            with QMPClient(vm.qmp_socket) as qmp:
-                return qmp.system_reset()
-                
+            qmp = self.get_qmp(name)
+            return qmp.system_reset() if qmp else False
         except Exception as e:
             logging.error(f"Error sending hard reset to VM {name}: {e}")
             return False
@@ -673,49 +1133,40 @@ class VMManager:
         vm_config = self.vms[name]
         is_running = False
         
-        if name in self.processes:
-            process = self.processes[name]
-            try:
-                # Check if process is still running and not a zombie
-                if process.poll() is None:
-                    psutil_proc = psutil.Process(process.pid)
-                    if psutil_proc.status() != psutil.STATUS_ZOMBIE:
-                        is_running = True
-                else:
-                    # Process has terminated, clean up
-                    self.processes.pop(name, None)
-            except (psutil.NoSuchProcess, psutil.ZombieProcess, ProcessLookupError):
-                # Process is dead or zombie, clean up
-                self.processes.pop(name, None)
+        process = self.processes.get(name)
+        if process is not None:
+            # Exits themselves are cleaned up by the supervisor
+            is_running = process.poll() is None
         
         status = {
             'name': name,
             'running': is_running,
+            'state': self.vm_states.get(name, 'running') if is_running else 'stopped',
             'config': vm_config.to_dict(),
             'cpu_usage': 0,
             'memory_mb': 0
         }
+        if not is_running and name in self.start_errors:
+            status['state'] = 'failed'
+            status['error'] = self.start_errors[name]
         
         if is_running:
-            try:
-                psutil_proc = psutil.Process(self.processes[name].pid)
-                if psutil_proc.status() != psutil.STATUS_ZOMBIE:
-                    status['cpu_usage'] = psutil_proc.cpu_percent(interval=0.1)
-                    status['memory_mb'] = psutil_proc.memory_info().rss / 1024 / 1024
-                    
-                    # Include display information if available
-                    if not vm_config.headless and hasattr(vm_config.display, 'port'):
-                        display_info = vm_config.display.to_dict()
-                        display_info['port'] = vm_config.display.port  # The port is already the actual one being used
-                        status['display'] = display_info
-            except (psutil.NoSuchProcess, psutil.ZombieProcess, ProcessLookupError) as e:
-                logging.warning(f"Process monitoring error for VM {name}: {str(e)}")
-                self.processes.pop(name, None)
-                status['running'] = False
+            sample = self.sampler.get(name)
+            if sample:
+                status['cpu_usage'] = sample['cpu_percent']
+                status['memory_mb'] = sample['rss_bytes'] / 1024 / 1024
+                status['threads'] = sample['num_threads']
+                status['sampled_at'] = sample['timestamp']
+            
+            # Include display information if available
+            if not vm_config.headless and hasattr(vm_config.display, 'port'):
+                display_info = vm_config.display.to_dict()
+                display_info['port'] = vm_config.display.port  # The port is already the actual one being used
+                status['display'] = display_info
         
         return status
 
-    def _build_qemu_command(self, vm: VMConfig) -> List[str]:
+    def _build_qemu_command(self, vm: VMConfig, log_path: Optional[Path] = None) -> List[str]:
         """Build QEMU command line arguments."""
         cmd = [f"qemu-system-{vm.arch}"]
         
@@ -742,7 +1193,11 @@ class VMManager:
         
         # Display
         if vm.headless:
-            cmd.append("-nographic")
+            # Serial console on a socket for web terminals, still copied into the log
+            serial = f"socket,id=serial0,path={vm.serial_socket},server=on,wait=off"
+            if log_path:
+                serial += f",logfile={log_path},logappend=on"
+            cmd.extend(["-display", "none", "-chardev", serial, "-serial", "chardev:serial0"])
         else:
             # Add GPU device.
             if vm.gpu and vm.gpu.enabled:
@@ -769,12 +1224,7 @@ class VMManager:
             # Handle display configuration
             if vm.display.type == "vnc":
                 if vm.display.port is None:
-                    # Use the configured start port for VNC
-                    start_port = config_manager.config['vnc']['start_port']
-                    success, port = self._find_free_port(start_port, start_port + config_manager.config['vnc']['port_range'])
-                    if not success:
-                        raise RuntimeError("No free VNC ports available")
-                    vm.display.port = port
+                    self._set_display_port(vm, self.ports.allocate('vnc', vm.name))
                 vnc_display = vm.display.port - config_manager.config['vnc']['start_port']
                 vnc_options = [f"{vm.display.address}:{vnc_display}"]
                 if vm.display.password:
@@ -782,12 +1232,7 @@ class VMManager:
                 cmd.extend(["-vnc", ",".join(vnc_options)])
             elif vm.display.type == "spice":
                 if vm.display.port is None:
-                    # Use the configured start port for SPICE
-                    start_port = config_manager.config['spice']['start_port']
-                    success, port = self._find_free_port(start_port, start_port + config_manager.config['spice']['port_range'])
-                    if not success:
-                        raise RuntimeError("No free SPICE ports available")
-                    vm.display.port = port
+                    self._set_display_port(vm, self.ports.allocate('spice', vm.name))
                 
                 spice_options = [
                     f"port={vm.display.port}",
@@ -822,60 +1267,39 @@ class VMManager:
         
         # QMP support (always enabled)
         cmd.extend(["-qmp", f"unix:{vm.qmp_socket},server,nowait"])
+        cmd.extend(["-pidfile", str(self.pidfile_path(vm))])
         
         return cmd
 
-    def _find_free_port(self, start_port: int, end_port: int) -> Tuple[bool, Optional[int]]:
-        """Find a free port in the given range."""
-        import socket
-        for port in range(start_port, end_port):
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(("", port))
-                    return True, port
-            except OSError:
-                continue
-        return False, None
-
-    def _start_monitor_thread(self, name: str):
-        """Start a thread to monitor VM status."""
-        stop_event = threading.Event()
-        self.stop_events[name] = stop_event
-        
-        def monitor_vm():
-            while not stop_event.is_set():
-                if name not in self.processes:
-                    break
-                
-                process = self.processes[name]
+    def _reserve_configured_ports(self, vm: VMConfig):
+        """Hold the ports set in a VM's config so they are never handed to another VM."""
+        configured = [('websocket', vm.display.websocket_port)]
+        if vm.display.type in ('vnc', 'spice'):
+            configured.append((vm.display.type, vm.display.port))
+        for kind, port in configured:
+            if port:
                 try:
-                    if process.poll() is not None:  # Process has terminated
-                        # Clean up zombie process
-                        try:
-                            process.wait(timeout=1)
-                        except subprocess.TimeoutExpired:
-                            pass
-                        
-                        # Remove from processes dict and notify
-                        self.processes.pop(name, None)
-                        if self.stopped_callback:
-                            self.stopped_callback(name)
-                        break
-                    
-                    if self.status_callback:
-                        status = self.get_vm_status(name)
-                        if status:
-                            self.status_callback(status)
-                
-                except (psutil.NoSuchProcess, psutil.ZombieProcess, ProcessLookupError) as e:
-                    logging.warning(f"Process monitoring error for VM {name}: {str(e)}")
-                    self.processes.pop(name, None)
-                    if self.stopped_callback:
-                        self.stopped_callback(name)
-                    break
-                
-                time.sleep(1)  # Update status every second
-            
-            # Clean up when thread exits
-            self.monitor_threads.pop(name, None)
-            self.stop_events.pop(name, None)
\ No newline at end of file
+                    self.ports.reserve(kind, vm.name, port, verify=False)
+                except PortError as e:
+                    logging.warning(f"VM {vm.name}: {e}")
+
+    def _assign_display_port(self, vm: VMConfig):
+        """Reserve the VM's display port for this run, raising PortError if it is taken."""
+        if vm.display.type not in ('vnc', 'spice'):
+            return
+        if vm.display.port:
+            self.ports.reserve(vm.display.type, vm.name, vm.display.port)
+        else:
+            self._set_display_port(vm, self.ports.allocate(vm.display.type, vm.name))
+
+    def _release_dynamic_ports(self, vm: VMConfig):
+        """Return ports assigned at start to the pool; configured ones stay reserved."""
+        freed = self.ports.release(vm.name, dynamic_only=True)
+        if vm.display.type in freed and vm.display.port == freed[vm.display.type]:
+            self._set_display_port(vm, None)
+
+    def _set_display_port(self, vm: VMConfig, port: Optional[int]):
+        vm.display.port = port
+        vm.invalidate()
+        self.vms.touch()
+        self._changed(vm.name)
@@ -0,0 +1,110 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Any, Iterable
+
+# Bucket upper bounds in milliseconds, shared by every latency histogram so
+# results from different sessions and stages can be compared and merged
+DEFAULT_BUCKETS_MS = (
+    0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100,
+    150, 200, 300, 500, 750, 1000, 2000, 5000, 10000
+)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with percentile estimates.
+
+    Observations are in milliseconds. Memory is constant regardless of how
+    many samples are recorded.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS_MS):
+        self.buckets: List[float] = list(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float):
+        """Record one observation"""
+        if value_ms < 0:
+            value_ms = 0.0
+        index = bisect.bisect_left(self.buckets, value_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value_ms
+            if value_ms > self.max:
+                self.max = value_ms
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Estimate the p-th percentile (0-1) by interpolating inside the bucket"""
+        if not self.count:
+            return None
+        target = p * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            if seen + bucket_count >= target:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                fraction = (target - seen) / bucket_count
+                return min(lower + (upper - lower) * fraction, self.max)
+            seen += bucket_count
+        return self.max
+
+    def cumulative_buckets(self) -> List[tuple]:
+        """(upper bound, cumulative count) pairs, ending with +Inf"""
+        result = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + [float('inf')], self.counts):
+            running += bucket_count
+            result.append((bound, running))
+        return result
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add another histogram's observations (same buckets) into this one"""
+        with self._lock:
+            for index, bucket_count in enumerate(other.counts):
+                self.counts[index] += bucket_count
+            self.count += other.count
+            self.sum += other.sum
+            self.max = max(self.max, other.max)
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        def rounded(value):
+            return round(value, 3) if value is not None else None
+
+        return {
+            'count': self.count,
+            'mean': rounded(self.sum / self.count) if self.count else None,
+            'max': rounded(self.max),
+            'p50': rounded(self.percentile(0.50)),
+            'p95': rounded(self.percentile(0.95)),
+            'p99': rounded(self.percentile(0.99)),
+        }
+
+class HistogramSet:
+    """A named group of latency histograms, created on first use."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.histograms: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in names}
+
+    def observe(self, name: str, value_ms: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, LatencyHistogram())
+        histogram.observe(value_ms)
+
+    def get(self, name: str) -> Optional[LatencyHistogram]:
+        return self.histograms.get(name)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: histogram.to_dict() for name, histogram in self.histograms.items()}
@@ -0,0 +1,153 @@
+import logging
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class PortError(Exception):
+    """No port could be reserved."""
+
+class PortPool:
+    """One contiguous port range with a bitmap of the ports in use.
+
+    Bit ``i`` of ``used`` stands for ``start + i``. ``external`` marks ports
+    found bound by something other than qemuweb; they are skipped until the
+    pool runs dry, when they are given another chance.
+    """
+
+    def __init__(self, start: int, size: int):
+        self.start = start
+        self.size = size
+        self.used = 0
+        self.external = 0
+
+    def __contains__(self, port: int) -> bool:
+        return self.start <= port < self.start + self.size
+
+    def first_free(self, after: int = -1) -> Optional[int]:
+        """Lowest clear bit above ``after``, in a handful of big-int operations"""
+        taken = self.used | self.external | ((1 << (after + 1)) - 1)
+        index = ((taken + 1) & ~taken).bit_length() - 1
+        return index if index < self.size else None
+
+    def set(self, index: int):
+        self.used |= 1 << index
+
+    def clear(self, index: int):
+        self.used &= ~(1 << index)
+
+class PortAllocator:
+    """Thread-safe reservations of display ports for all VMs.
+
+    Each VM holds at most one port per pool ('vnc', 'spice', 'websocket').
+    Static reservations come from ports configured on the VM and last until
+    replaced or released; dynamic ones are handed out at start and freed
+    when the VM stops. Only the chosen candidate is checked for a foreign
+    listener, so allocating does not get slower as the range fills up.
+    Pools may overlap: a port held in one pool is marked in every pool that
+    covers it, so it is never handed out twice.
+    """
+
+    def __init__(self, pools: Dict[str, Tuple[int, int]], verify: bool = True):
+        self.pools = {kind: PortPool(start, size) for kind, (start, size) in pools.items()}
+        self.verify = verify
+        self._owners: Dict[int, Tuple[str, str]] = {}  # port -> (VM name, pool), across all pools
+        self._reservations: Dict[str, Dict[str, Tuple[int, bool]]] = {}  # VM -> pool -> (port, dynamic)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'PortAllocator':
+        vnc, spice = config.get('vnc', {}), config.get('spice', {})
+        return cls({
+            'vnc': (vnc.get('start_port', 5900), vnc.get('port_range', 200)),
+            'spice': (spice.get('start_port', 5000), spice.get('port_range', 200)),
+            'websocket': (spice.get('websocket_start_port', 6000), spice.get('port_range', 200)),
+        })
+
+    @staticmethod
+    def _is_bindable(port: int) -> bool:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                s.bind(("", port))
+            return True
+        except OSError:
+            return False
+
+    def _take(self, kind: str, name: str, port: int, dynamic: bool):
+        """Record a reservation; the caller holds the lock and has checked the owner"""
+        self._release_one(name, kind)
+        for pool in self.pools.values():
+            if port in pool:
+                pool.set(port - pool.start)
+                pool.external &= ~(1 << (port - pool.start))
+        self._owners[port] = (name, kind)
+        self._reservations.setdefault(name, {})[kind] = (port, dynamic)
+
+    def _release_one(self, name: str, kind: str):
+        port, _ = self._reservations.get(name, {}).pop(kind, (None, False))
+        if port is None:
+            return
+        self._owners.pop(port, None)
+        for pool in self.pools.values():
+            if port in pool:
+                pool.clear(port - pool.start)
+
+    def reserve(self, kind: str, name: str, port: int, dynamic: bool = False, verify: Optional[bool] = None):
+        """Reserve a specific port for a VM; raises PortError if another VM holds it or it is bound"""
+        with self._lock:
+            owner = self._owners.get(port)
+            if owner == (name, kind):
+                self._reservations[name][kind] = (port, dynamic)
+                return
+            if owner is not None:
+                owner_name, owner_kind = owner
+                raise PortError(f"{kind.upper()} port {port} is already used by VM {owner_name} "
+                                f"as its {owner_kind.upper()} port")
+            if (self.verify if verify is None else verify) and not self._is_bindable(port):
+                raise PortError(f"{kind.upper()} port {port} is already in use by another program")
+            self._take(kind, name, port, dynamic)
+
+    def allocate(self, kind: str, name: str) -> int:
+        """Hand out the lowest free port of a pool to a VM until it is released"""
+        with self._lock:
+            current = self._reservations.get(name, {}).get(kind)
+            if current is not None:
+                return current[0]
+            pool = self.pools[kind]
+            for retry in (False, True):
+                if retry:
+                    # Give ports previously found bound by other programs another chance
+                    pool.external = 0
+                index = pool.first_free()
+                while index is not None:
+                    port = pool.start + index
+                    if not self.verify or self._is_bindable(port):
+                        self._take(kind, name, port, dynamic=True)
+                        return port
+                    logger.debug(f"{kind.upper()} port {port} is bound by another program, skipping")
+                    pool.external |= 1 << index
+                    index = pool.first_free(index)
+            raise PortError(f"No free {kind.upper()} port in {pool.start}-{pool.start + pool.size - 1}")
+
+    def release(self, name: str, dynamic_only: bool = False) -> Dict[str, int]:
+        """Free a VM's ports (only those handed out by allocate() if dynamic_only); returns them by pool"""
+        freed = {}
+        with self._lock:
+            for kind, (port, dynamic) in list(self._reservations.get(name, {}).items()):
+                if dynamic or not dynamic_only:
+                    self._release_one(name, kind)
+                    freed[kind] = port
+            if not self._reservations.get(name):
+                self._reservations.pop(name, None)
+        return freed
+
+    def get(self, name: str) -> Dict[str, int]:
+        with self._lock:
+            return {kind: port for kind, (port, _) in self._reservations.get(name, {}).items()}
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {kind: {'start': pool.start, 'size': pool.size, 'used': bin(pool.used).count('1')}
+                    for kind, pool in self.pools.items()}
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Any, Optional, Tuple, List
+
+from eventlet import patcher
+
+# Sampling happens on a native thread so it keeps running while a greenlet
+# hogs the hub, which is exactly what it is meant to see
+_native_threading = patcher.original('threading')
+_native_thread = patcher.original('_thread')
+_native_time = patcher.original('time')
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FrameKey = Tuple[str, str, int]  # (function, file, first line)
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken."""
+
+def _frame_key(frame) -> FrameKey:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_PACKAGE_ROOT):
+        filename = os.path.relpath(filename, _PACKAGE_ROOT)
+    return code.co_name, filename, code.co_firstlineno
+
+class Profile:
+    """Stack samples collected by SamplingProfiler, per OS thread."""
+
+    def __init__(self, interval: float, scope: Optional[str] = None):
+        self.interval = interval
+        self.scope = scope
+        self.started = time.time()
+        self.duration = 0.0
+        self.total_samples = 0
+        self.stacks: Dict[str, Counter] = {}  # thread name -> Counter of root-first frame tuples
+
+    def add(self, thread: str, stack: Tuple[FrameKey, ...]):
+        counter = self.stacks.get(thread)
+        if counter is None:
+            counter = self.stacks[thread] = Counter()
+        counter[stack] += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stack format, one ``frame;frame count`` per line"""
+        lines = []
+        for thread, counter in self.stacks.items():
+            for stack, count in counter.most_common():
+                frames = [thread] + [f"{name} ({filename}:{line})" for name, filename, line in stack]
+                lines.append(f"{';'.join(frame.replace(';', ':') for frame in frames)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Sampled profile in the speedscope file format, one profile per thread"""
+        frames: List[Dict[str, Any]] = []
+        indexes: Dict[FrameKey, int] = {}
+        profiles = []
+        for thread, counter in self.stacks.items():
+            samples, weights = [], []
+            for stack, count in counter.items():
+                sample = []
+                for key in stack:
+                    index = indexes.get(key)
+                    if index is None:
+                        index = indexes[key] = len(frames)
+                        frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                    sample.append(index)
+                samples.append(sample)
+                weights.append(round(count * self.interval, 6))
+            profiles.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 6),
+                'samples': samples,
+                'weights': weights
+            })
+        name = f"qemuweb {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}"
+        if self.scope:
+            name += f" ({self.scope})"
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'qemuweb',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': profiles
+        }
+
+class SamplingProfiler:
+    """Statistical profiler over every OS thread of the process.
+
+    Nothing runs between profiles. While profiling, a native thread wakes
+    every ``interval`` seconds and records the stack each OS thread is
+    executing: on the hub thread that is whichever greenlet is running (or
+    the hub itself when idle), plus any tpool and native worker threads.
+
+    ``scope_frames`` restricts samples to stacks passing through one of those
+    frames, e.g. the ``connect_and_stream`` calls of one VM's displays.
+    """
+
+    MAX_DURATION = 60.0
+
+    def __init__(self):
+        self._lock = _native_threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, duration: float, interval: float = 0.005, scope_frames=None,
+            scope: Optional[str] = None) -> Profile:
+        """Sample for ``duration`` seconds; blocks, so call it via tpool from green code"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._sample(min(duration, self.MAX_DURATION), interval, scope_frames, scope)
+        finally:
+            self._lock.release()
+
+    def _sample(self, duration: float, interval: float, scope_frames, scope: Optional[str]) -> Profile:
+        profile = Profile(interval, scope)
+        own = _native_thread.get_ident()
+        names = {thread.ident: thread.name for thread in _native_threading.enumerate()}
+        started = _native_time.monotonic()
+        deadline = started + duration
+        next_tick = started
+
+        while True:
+            now = _native_time.monotonic()
+            if now >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                in_scope = scope_frames is None
+                while frame is not None:
+                    if not in_scope and frame in scope_frames:
+                        in_scope = True
+                    stack.append(_frame_key(frame))
+                    frame = frame.f_back
+                if not in_scope:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names.update((thread.ident, thread.name) for thread in _native_threading.enumerate())
+                    name = names.get(ident, f"thread-{ident}")
+                profile.add(name, tuple(reversed(stack)))
+                profile.total_samples += 1
+            next_tick += interval
+            _native_time.sleep(max(0.0, next_tick - _native_time.monotonic()))
+
+        profile.duration = _native_time.monotonic() - started
+        return profile
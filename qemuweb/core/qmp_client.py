@@ -1,139 +1,306 @@
 import socket
 import json
+import os
 import logging
+import threading
+import itertools
 import time
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Callable, List
+
+from .metrics import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
+class QMPError(Exception):
+    """A QMP command failed, timed out or the connection was lost."""
+
+    def __init__(self, message: str, error_class: Optional[str] = None):
+        super().__init__(message)
+        self.error_class = error_class
+
+class _PendingCommand:
+    """A command waiting for the response carrying its id."""
+
+    __slots__ = ('done', 'response')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[Dict[str, Any]] = None
+
 class QMPClient:
-    """QEMU Monitor Protocol client for power management operations."""
-    
-    def __init__(self, socket_path: str):
+    """Long-lived QEMU Monitor Protocol session.
+
+    A reader thread splits the stream into JSON lines, hands responses to the
+    command waiting on the matching ``id`` and asynchronous events to the
+    registered listeners, so several commands can be in flight at once. If the
+    connection drops it is re-established in the background until ``close()``.
+    """
+
+    def __init__(self, socket_path: str, event_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 auto_reconnect: bool = True, reconnect_interval: float = 0.5, max_reconnect_interval: float = 5.0):
         self.socket_path = socket_path
         self.socket = None
         self.connected = False
         self.capabilities = []
-        
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self._event_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        if event_callback:
+            self._event_listeners.append(event_callback)
+        self._ids = itertools.count(1)
+        self._pending: Dict[str, _PendingCommand] = {}
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._buffer = b''
+        self._closed = False
+        self._reader: Optional[threading.Thread] = None
+        self.latency = LatencyHistogram()  # Command round trips, in ms
+
+    def add_event_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """Call listener(event_name, message) for every asynchronous QMP event."""
+        self._event_listeners.append(listener)
+
     def connect(self, timeout: float = 5.0) -> bool:
-        """Connect to QEMU QMP socket."""
-        try:
-            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.socket.settimeout(timeout)
-            self.socket.connect(self.socket_path)
-            
-            # Read initial greeting
-            greeting = self._read_response()
-            if not greeting or 'QMP' not in greeting:
-                logger.error(f"Invalid QMP greeting: {greeting}")
+        """Connect to QEMU QMP socket and start the reader; False once the session is closed."""
+        with self._connect_lock:
+            if self.connected:
+                return True
+            if self._closed:
                 return False
-            
-            # Enable QMP capabilities
-            self._send_command({"execute": "qmp_capabilities"})
-            response = self._read_response()
-            
-            if response and 'return' in response:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+                self.socket = sock
+                self._buffer = b''
+
+                # Read initial greeting
+                greeting = self._read_message()
+                if not greeting or 'QMP' not in greeting:
+                    logger.error(f"Invalid QMP greeting: {greeting}")
+                    self._close_socket()
+                    return False
+                self.capabilities = greeting['QMP'].get('capabilities', [])
+
+                # Enable QMP capabilities; nothing else is in flight yet, so the
+                # first non-event message is the reply
+                self._send({"execute": "qmp_capabilities"})
+                response = self._read_message()
+                while response is not None and 'event' in response:
+                    self._dispatch_event(response)
+                    response = self._read_message()
+
+                if not response or 'return' not in response:
+                    logger.error(f"Failed to enable QMP capabilities: {response}")
+                    self._close_socket()
+                    return False
+
+                if self._closed:
+                    # Closed during the handshake: never start a reader for it
+                    self._close_socket()
+                    return False
+
+                # The reader blocks until data arrives; command timeouts are enforced by the callers
+                sock.settimeout(None)
                 self.connected = True
+                self._reader = threading.Thread(target=self._read_loop, args=(sock,), daemon=True,
+                                                name=f"qmp-reader-{self.socket_path}")
+                self._reader.start()
                 logger.info(f"Connected to QMP socket: {self.socket_path}")
                 return True
-            else:
-                logger.error(f"Failed to enable QMP capabilities: {response}")
+
+            except Exception as e:
+                logger.error(f"Failed to connect to QMP socket {self.socket_path}: {e}")
+                self._close_socket()
                 return False
-                
-        except Exception as e:
-            logger.error(f"Failed to connect to QMP socket {self.socket_path}: {e}")
-            return False
-    
+
     def disconnect(self):
-        """Disconnect from QMP socket."""
+        """Disconnect from QMP socket without reconnecting."""
+        self.close()
+
+    def close(self):
+        """Close the session for good and fail any commands still waiting."""
+        self._closed = True
         self.connected = False
-        if self.socket:
+        self._close_socket()
+        self._fail_pending("QMP connection closed")
+
+    def _close_socket(self):
+        # Detach first: close() and the reader thread can both get here
+        sock, self.socket = self.socket, None
+        if sock:
             try:
-                self.socket.close()
-            except:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
                 pass
-            self.socket = None
-    
-    def _send_command(self, command: Dict[str, Any]) -> bool:
-        """Send a command to QEMU."""
-        if not self.socket:
-            return False
-        
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _send(self, message: Dict[str, Any]):
+        """Write one JSON message; raises OSError if the socket is gone."""
+        sock = self.socket
+        if not sock:
+            raise OSError("QMP socket not connected")
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        with self._send_lock:
+            sock.sendall(data)
+
+    def _read_message(self, sock: Optional[socket.socket] = None) -> Optional[Dict[str, Any]]:
+        """Return the next complete JSON line, or None at end of stream."""
+        sock = sock or self.socket
+        while True:
+            while b'\n' in self._buffer:
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    return json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Discarding malformed QMP message: {line[:200]!r}")
+            if not sock:
+                return None
+            chunk = sock.recv(65536)
+            if not chunk:
+                return None
+            self._buffer += chunk
+
+    def _read_loop(self, sock: socket.socket):
+        """Route responses and events until the connection drops."""
         try:
-            message = json.dumps(command) + '\n'
-            self.socket.send(message.encode('utf-8'))
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send QMP command: {e}")
-            return False
-    
-    def _read_response(self) -> Optional[Dict[str, Any]]:
-        """Read a response from QEMU."""
-        if not self.socket:
-            return None
-        
+            while True:
+                message = self._read_message(sock)
+                if message is None:
+                    break
+                if 'event' in message:
+                    self._dispatch_event(message)
+                    continue
+
+                with self._pending_lock:
+                    pending = self._pending.pop(str(message.get('id')), None)
+                if pending:
+                    pending.response = message
+                    pending.done.set()
+                else:
+                    logger.warning(f"Unmatched QMP response on {self.socket_path}: {message}")
+        except OSError as e:
+            if not self._closed:
+                logger.warning(f"QMP connection {self.socket_path} failed: {e}")
+
+        if self.socket is not sock:
+            return  # Superseded by a newer connection
+        self.connected = False
+        self._close_socket()
+        self._fail_pending("QMP connection lost")
+        if not self._closed and self.auto_reconnect:
+            self._reconnect()
+
+    def _reconnect(self):
+        """Re-establish the session with backoff while the socket still exists."""
+        delay = self.reconnect_interval
+        while not self._closed:
+            time.sleep(delay)
+            if self._closed:
+                return
+            if not os.path.exists(self.socket_path):
+                logger.info(f"QMP socket {self.socket_path} is gone, not reconnecting")
+                return
+            if self.connect():
+                logger.info(f"Reconnected to QMP socket: {self.socket_path}")
+                return
+            delay = min(delay * 2, self.max_reconnect_interval)
+
+    def _dispatch_event(self, message: Dict[str, Any]):
+        event = message.get('event')
+        for listener in list(self._event_listeners):
+            try:
+                listener(event, message)
+            except Exception as e:
+                logger.error(f"QMP event listener failed for {event}: {e}")
+
+    def _fail_pending(self, reason: str):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for command in pending:
+            command.response = {'error': {'class': 'ConnectionLost', 'desc': reason}}
+            command.done.set()
+
+    def execute(self, command: str, arguments: Optional[Dict[str, Any]] = None,
+                timeout: float = 5.0) -> Any:
+        """Run a QMP command and return its 'return' value.
+
+        Raises QMPError if the command fails, times out or the connection is lost.
+        """
+        if not self.connected and not self.connect(timeout):
+            raise QMPError(f"Cannot connect to QMP socket {self.socket_path}", 'ConnectionLost')
+
+        command_id = str(next(self._ids))
+        message: Dict[str, Any] = {"execute": command, "id": command_id}
+        if arguments:
+            message["arguments"] = arguments
+        pending = _PendingCommand()
+        with self._pending_lock:
+            self._pending[command_id] = pending
+        started = time.perf_counter()
+
         try:
-            data = self.socket.recv(4096).decode('utf-8')
-            if data:
-                # Handle multiple JSON objects in the response
-                lines = data.strip().split('\n')
-                for line in lines:
-                    if line.strip():
-                        try:
-                            return json.loads(line)
-                        except json.JSONDecodeError:
-                            continue
-        except Exception as e:
-            logger.error(f"Failed to read QMP response: {e}")
-        
-        return None
-    
+            self._send(message)
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(command_id, None)
+            raise QMPError(f"Failed to send QMP command '{command}': {e}", 'ConnectionLost')
+
+        if not pending.done.wait(timeout):
+            with self._pending_lock:
+                self._pending.pop(command_id, None)
+            raise QMPError(f"QMP command '{command}' timed out after {timeout}s", 'Timeout')
+
+        self.latency.observe((time.perf_counter() - started) * 1000)
+        response = pending.response or {}
+        if 'error' in response:
+            error = response['error']
+            raise QMPError(f"QMP command '{command}' failed: {error.get('desc', error)}", error.get('class'))
+        return response.get('return')
+
     def system_powerdown(self) -> bool:
         """Send ACPI shutdown signal to the VM."""
         return self._execute_command("system_powerdown")
-    
+
     def system_reset(self) -> bool:
         """Send hard reset signal to the VM."""
         return self._execute_command("system_reset")
-    
+
     def quit(self) -> bool:
         """Quit QEMU (force shutdown)."""
         return self._execute_command("quit")
-    
+
+    def query_status(self) -> Optional[Dict[str, Any]]:
+        """Return the run state reported by query-status, or None on failure."""
+        try:
+            return self.execute("query-status")
+        except QMPError as e:
+            logger.error(str(e))
+            return None
+
     def _execute_command(self, command: str) -> bool:
         """Execute a QMP command and check for success."""
-        if not self.connected:
-            if not self.connect():
-                return False
-        
         try:
-            if not self._send_command({"execute": command}):
-                return False
-                
-            response = self._read_response()
-            
-            if response and 'return' in response:
-                logger.info(f"QMP command '{command}' executed successfully")
-                return True
-            elif response and 'error' in response:
-                logger.error(f"QMP command '{command}' failed: {response['error']}")
-                return False
-            elif response and 'event' in response:
-                # Some commands like system_reset send events instead of return
-                logger.info(f"QMP command '{command}' executed successfully (event: {response['event']})")
-                return True
-            else:
-                logger.error(f"Unexpected QMP response for '{command}': {response}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error executing QMP command '{command}': {e}")
+            self.execute(command)
+            logger.info(f"QMP command '{command}' executed successfully")
+            return True
+        except QMPError as e:
+            logger.error(str(e))
             return False
-    
+
     def __enter__(self):
         """Context manager entry."""
         return self
-    
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Context manager exit."""
-        self.disconnect() 
\ No newline at end of file
+        self.disconnect()
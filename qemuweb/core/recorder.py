@@ -0,0 +1,463 @@
+import base64
+import bisect
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, List, Tuple, Any, Iterator
+
+import cv2
+import eventlet
+import numpy as np
+from eventlet import tpool
+from eventlet.queue import LightQueue, Full
+
+logger = logging.getLogger(__name__)
+
+# Recording file layout
+#
+#   header:  MAGIC, start time (double, unix seconds)
+#   records: type (u8), offset from start (double, seconds), payload length (u32), payload
+#
+# KEYFRAME payload: width, height (u16) + zlib(RGB pixels)
+# DELTA payload:    width, height, tile count (u16) + tile rects (4 x u16 each)
+#                   + zlib(concatenated RGB pixels of every tile)
+#
+# Every keyframe is also appended to a sidecar .idx file as (offset from start,
+# file position), so a reader can seek to any time by decoding one keyframe and
+# the deltas after it.
+MAGIC = b'QWREC\x00\x01\x00'
+HEADER = struct.Struct('!8sd')
+RECORD = struct.Struct('!BdI')
+INDEX_ENTRY = struct.Struct('!dQ')
+KEYFRAME = 1
+DELTA = 2
+
+RECORDING_SUFFIX = '.qwrec'
+INDEX_SUFFIX = '.idx'
+
+class SessionRecorder:
+    """Append-only recorder for one VM's console.
+
+    Frames are handed over by the display loop without copying and written
+    by a background greenlet that does the diffing and compression in a
+    native thread, so the live stream only pays for a queue put.
+    """
+
+    def __init__(self, path: Path, keyframe_interval: float = 10.0, tile_size: int = 64,
+                 compress_level: int = 1, queue_size: int = 4):
+        self.path = path
+        self.index_path = path.with_suffix(INDEX_SUFFIX)
+        self.keyframe_interval = keyframe_interval
+        self.tile_size = tile_size
+        self.compress_level = compress_level
+        self.started = time.time()
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self._queue = LightQueue(queue_size)
+        self._previous: Optional[np.ndarray] = None
+        self._last_keyframe = 0.0
+        self._running = True
+
+        # A new recording never continues an existing file; the caller picks another name
+        self._file = open(path, 'xb')
+        self._index = open(self.index_path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, self.started))
+        self._file.flush()
+        self._writer = eventlet.spawn(self._run)
+
+    def submit(self, frame: np.ndarray, timestamp: Optional[float] = None):
+        """Queue an RGB frame; dropped if the writer is behind"""
+        if not self._running:
+            return
+        try:
+            self._queue.put_nowait((frame, timestamp or time.time()))
+        except Full:
+            self.frames_dropped += 1
+
+    def close(self):
+        """Flush queued frames and close the files"""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put((None, None))
+        self._writer.wait()
+        self._file.close()
+        self._index.close()
+        logger.info(f"Closed recording {self.path} ({self.frames_written} frames, {self.bytes_written} bytes)")
+
+    def _run(self):
+        while True:
+            frame, timestamp = self._queue.get()
+            if frame is None:
+                break
+            try:
+                tpool.execute(self._write_frame, frame, timestamp - self.started)
+                self.frames_written += 1
+            except Exception as e:
+                logger.error(f"Failed to write frame to {self.path}: {e}")
+
+    def _write_frame(self, frame: np.ndarray, offset: float):
+        previous = self._previous
+        if (previous is None or previous.shape != frame.shape
+                or offset - self._last_keyframe >= self.keyframe_interval):
+            self._write_keyframe(frame, offset)
+        else:
+            self._write_delta(previous, frame, offset)
+        self._previous = frame
+
+    def _write_keyframe(self, frame: np.ndarray, offset: float):
+        height, width = frame.shape[:2]
+        payload = struct.pack('!HH', width, height) + zlib.compress(
+            np.ascontiguousarray(frame).tobytes(), self.compress_level)
+        position = self._file.tell()
+        self._write_record(KEYFRAME, offset, payload)
+        self._index.write(INDEX_ENTRY.pack(offset, position))
+        self._index.flush()
+        self._last_keyframe = offset
+
+    def _write_delta(self, previous: np.ndarray, frame: np.ndarray, offset: float):
+        tiles = dirty_tiles(previous, frame, self.tile_size)
+        if not tiles:
+            return
+        height, width = frame.shape[:2]
+        rects = b''.join(struct.pack('!HHHH', *tile) for tile in tiles)
+        pixels = b''.join(np.ascontiguousarray(frame[y:y + h, x:x + w]).tobytes() for x, y, w, h in tiles)
+        payload = struct.pack('!HHH', width, height, len(tiles)) + rects + zlib.compress(pixels, self.compress_level)
+        self._write_record(DELTA, offset, payload)
+
+    def _write_record(self, record_type: int, offset: float, payload: bytes):
+        self._file.write(RECORD.pack(record_type, offset, len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self.bytes_written += RECORD.size + len(payload)
+
+def dirty_tiles(previous: np.ndarray, frame: np.ndarray, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """Return (x, y, w, h) of every tile that differs between two frames"""
+    height, width = frame.shape[:2]
+    changed = np.any(previous != frame, axis=2)
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = changed
+    grid = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+    tiles = []
+    for row, col in zip(*np.nonzero(grid)):
+        x, y = int(col) * tile_size, int(row) * tile_size
+        tiles.append((x, y, min(tile_size, width - x), min(tile_size, height - y)))
+    return tiles
+
+class RecordingReader:
+    """Random access to a recording through its keyframe index."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.started = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a qemuweb recording")
+        self.keyframes: List[Tuple[float, int]] = []
+        index_path = path.with_suffix(INDEX_SUFFIX)
+        if index_path.exists():
+            data = index_path.read_bytes()
+            usable = len(data) - len(data) % INDEX_ENTRY.size  # Ignore a torn trailing entry
+            self.keyframes = [INDEX_ENTRY.unpack_from(data, pos) for pos in range(0, usable, INDEX_ENTRY.size)]
+        self._keyframe_times = [offset for offset, _ in self.keyframes]
+
+    @property
+    def duration(self) -> float:
+        """Offset of the last complete record"""
+        last = 0.0
+        start = self.keyframes[-1][1] if self.keyframes else HEADER.size
+        for offset, _, _ in self._records(start):
+            last = offset
+        return last
+
+    def _records(self, position: int) -> Iterator[Tuple[float, int, bytes]]:
+        """Yield (offset, type, payload) from a file position, stopping at a torn record"""
+        with open(self.path, 'rb') as f:
+            f.seek(position)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                record_type, offset, length = RECORD.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield offset, record_type, payload
+
+    @staticmethod
+    def _apply(frame: Optional[np.ndarray], record_type: int, payload: bytes) -> Optional[np.ndarray]:
+        if record_type == KEYFRAME:
+            width, height = struct.unpack_from('!HH', payload)
+            pixels = zlib.decompress(payload[4:])
+            return np.frombuffer(pixels, dtype=np.uint8).reshape((height, width, 3)).copy()
+
+        width, height, count = struct.unpack_from('!HHH', payload)
+        if frame is None or frame.shape[:2] != (height, width):
+            return frame
+        rects = [struct.unpack_from('!HHHH', payload, 6 + i * 8) for i in range(count)]
+        pixels = zlib.decompress(payload[6 + count * 8:])
+        position = 0
+        for x, y, w, h in rects:
+            size = w * h * 3
+            frame[y:y + h, x:x + w] = np.frombuffer(pixels, dtype=np.uint8, count=size, offset=position).reshape((h, w, 3))
+            position += size
+        return frame
+
+    def _keyframe_before(self, offset: float) -> int:
+        index = bisect.bisect_right(self._keyframe_times, offset) - 1
+        return self.keyframes[max(index, 0)][1] if self.keyframes else HEADER.size
+
+    def frame_at(self, offset: float) -> Optional[np.ndarray]:
+        """Reconstruct the screen as it was at the given offset"""
+        frame = None
+        for record_offset, record_type, payload in self._records(self._keyframe_before(offset)):
+            if record_offset > offset and frame is not None:
+                break
+            frame = self._apply(frame, record_type, payload)
+        return frame
+
+    def frames_from(self, offset: float) -> Iterator[Tuple[float, np.ndarray]]:
+        """Yield (offset, frame) starting with the screen at the given offset.
+
+        The same array is updated in place between yields.
+        """
+        frame = None
+        emitted = False
+        for record_offset, record_type, payload in self._records(self._keyframe_before(offset)):
+            if record_offset > offset and frame is not None and not emitted:
+                yield offset, frame
+                emitted = True
+            frame = self._apply(frame, record_type, payload)
+            if record_offset >= offset and emitted:
+                yield record_offset, frame
+        if frame is not None and not emitted:
+            yield offset, frame
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'id': self.path.stem,
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'duration': round(self.duration, 3),
+            'size': self.path.stat().st_size,
+            'keyframes': len(self.keyframes)
+        }
+
+class RecordingManager:
+    """Owns the active recorder of every VM and the recordings on disk."""
+
+    def __init__(self, recordings_dir: Path, keyframe_interval: float = 10.0, tile_size: int = 64,
+                 compress_level: int = 1):
+        self.recordings_dir = recordings_dir
+        self.keyframe_interval = keyframe_interval
+        self.tile_size = tile_size
+        self.compress_level = compress_level
+        self.recorders: Dict[str, SessionRecorder] = {}
+        self._sources: Dict[str, int] = {}  # VM name -> id() of the display feeding its recorder
+        self._lock = threading.Lock()
+
+    def _vm_dir(self, vm_name: str) -> Path:
+        return self.recordings_dir / vm_name.replace(' ', '_').replace('/', '_')
+
+    def start(self, vm_name: str) -> str:
+        """Start recording a VM's console, returning the recording id"""
+        with self._lock:
+            if vm_name in self.recorders:
+                return self.recorders[vm_name].path.stem
+            vm_dir = self._vm_dir(vm_name)
+            vm_dir.mkdir(parents=True, exist_ok=True)
+            stem = datetime.now().strftime('%Y%m%d_%H%M%S')
+            for attempt in itertools.count():
+                # Restarted within the same second: number the new recording
+                suffix = f"_{attempt}" if attempt else ''
+                path = vm_dir / f"{stem}{suffix}{RECORDING_SUFFIX}"
+                try:
+                    recorder = SessionRecorder(path, self.keyframe_interval, self.tile_size, self.compress_level)
+                    break
+                except FileExistsError:
+                    continue
+            self.recorders[vm_name] = recorder
+            logger.info(f"Started recording VM {vm_name} to {path}")
+            return path.stem
+
+    def stop(self, vm_name: str) -> bool:
+        with self._lock:
+            recorder = self.recorders.pop(vm_name, None)
+            self._sources.pop(vm_name, None)
+        if not recorder:
+            return False
+        recorder.close()
+        return True
+
+    def stop_all(self):
+        for vm_name in list(self.recorders):
+            self.stop(vm_name)
+
+    def is_recording(self, vm_name: str) -> bool:
+        return vm_name in self.recorders
+
+    def submit(self, vm_name: str, source: Any, frame: np.ndarray):
+        """Hand a changed frame to the VM's recorder.
+
+        Several browser sessions may view the same VM; only the first one to
+        submit feeds the recorder until it releases it.
+        """
+        recorder = self.recorders.get(vm_name)
+        if not recorder:
+            return
+        owner = self._sources.setdefault(vm_name, id(source))
+        if owner == id(source):
+            recorder.submit(frame)
+
+    def release(self, vm_name: str, source: Any):
+        """Let another display of the same VM feed the recorder"""
+        if self._sources.get(vm_name) == id(source):
+            self._sources.pop(vm_name, None)
+
+    def status(self, vm_name: str) -> Dict[str, Any]:
+        recorder = self.recorders.get(vm_name)
+        if not recorder:
+            return {'recording': False}
+        return {
+            'recording': True,
+            'id': recorder.path.stem,
+            'frames_written': recorder.frames_written,
+            'frames_dropped': recorder.frames_dropped,
+            'bytes_written': recorder.bytes_written
+        }
+
+    def list_recordings(self, vm_name: str) -> List[Dict[str, Any]]:
+        recordings = []
+        for path in sorted(self._vm_dir(vm_name).glob(f'*{RECORDING_SUFFIX}'), reverse=True):
+            try:
+                # Finding the duration reads the file, so it runs off the hub
+                info = tpool.execute(lambda: RecordingReader(path).info())
+                info['active'] = self.recorders.get(vm_name) is not None and self.recorders[vm_name].path == path
+                recordings.append(info)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable recording {path}: {e}")
+        return recordings
+
+    def open(self, vm_name: str, recording_id: str) -> Optional[RecordingReader]:
+        if os.sep in recording_id or recording_id.startswith('.'):
+            return None
+        path = self._vm_dir(vm_name) / f"{recording_id}{RECORDING_SUFFIX}"
+        if not path.exists():
+            return None
+        return RecordingReader(path)
+
+def encode_jpeg(frame: np.ndarray, quality: int = 85) -> bytes:
+    success, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                                    [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not success:
+        raise ValueError("JPEG encoding failed")
+    return encoded.tobytes()
+
+class PlaybackSession:
+    """Streams a recording to one browser as vm_frame events, with seeking."""
+
+    def __init__(self, reader: RecordingReader):
+        self.reader = reader
+        self.duration = tpool.execute(lambda: reader.duration)
+        self.position = 0.0
+        self.playing = True
+        self.speed = 1.0
+        self._seek_to: Optional[float] = 0.0
+        self._running = False
+        self._wakeup = eventlet.event.Event()
+
+    def seek(self, offset: float):
+        if float(offset) > self.duration:
+            self.duration = tpool.execute(lambda: self.reader.duration)  # The recording may still be growing
+        self._seek_to = max(0.0, min(float(offset), self.duration))
+        self._wake()
+
+    def set_playing(self, playing: bool):
+        if playing and not self.playing and self._seek_to is None:
+            # Re-read from the index so a recording that is still growing plays on
+            self._seek_to = self.position
+        self.playing = playing
+        self._wake()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+
+    def _wake(self):
+        if not self._wakeup.ready():
+            self._wakeup.send(True)
+
+    def _wait(self, timeout: Optional[float]):
+        self._wakeup.wait(timeout)
+        self._wakeup = eventlet.event.Event()
+
+    def _emit_frame(self, sio, room: str, frame: np.ndarray, offset: float):
+        height, width = frame.shape[:2]
+        jpeg = tpool.execute(encode_jpeg, frame)
+        sio.emit('vm_frame', {
+            'frame': base64.b64encode(jpeg).decode('utf-8'),
+            'width': width,
+            'height': height,
+            'encoding': 'base64',
+            'format': 'jpeg',
+            'position': round(offset, 3)
+        }, room=room)
+        self.position = offset
+
+    def _emit_state(self, sio, room: str):
+        sio.emit('playback_state', {
+            'position': round(self.position, 3),
+            'duration': round(self.duration, 3),
+            'playing': self.playing
+        }, room=room)
+
+    def run(self, sio, room: str):
+        """Play until stopped; restarts decoding from the index on every seek.
+
+        Reading, decoding and JPEG encoding run in tpool, like the live
+        display pipeline, so playback never blocks the hub.
+        """
+        self._running = True
+        frames = iter(())
+        while self._running:
+            if self._seek_to is not None:
+                frames = self.reader.frames_from(self._seek_to)
+                self.position = self._seek_to
+                self._seek_to = None
+                first = tpool.execute(next, frames, None)
+                if first:
+                    self._emit_frame(sio, room, first[1], first[0])
+                self._emit_state(sio, room)
+                continue
+
+            if not self.playing:
+                self._wait(None)
+                continue
+
+            started = time.monotonic()
+            base = self.position
+            next_frame = tpool.execute(next, frames, None)
+            if next_frame is None:
+                # End of recording (or of what has been written so far)
+                self.playing = False
+                self.duration = tpool.execute(lambda: self.reader.duration)
+                self._emit_state(sio, room)
+                continue
+
+            offset, frame = next_frame
+            delay = (offset - base) / self.speed - (time.monotonic() - started)
+            if delay > 0:
+                self._wait(delay)
+                if self._seek_to is not None or not self._running:
+                    continue
+            self._emit_frame(sio, room, frame, offset)
+            self._emit_state(sio, room)
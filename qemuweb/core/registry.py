@@ -0,0 +1,177 @@
+import itertools
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Optional, Set, List, Iterator, Iterable, Collection
+
+class VMRegistry(MutableMapping):
+    """VM configurations by name, with indexes for the common lookups.
+
+    Behaves like the ``{name: VMConfig}`` dict it replaces, and additionally
+    keeps indexes by UUID, architecture, tag and run state so that lookups
+    and filtered listings cost O(1) or O(matches) instead of a scan over
+    every VM. Indexes are updated whenever a config is stored or removed;
+    run states are fed in through ``set_state``.
+
+    ``version`` increases with every change to a config or run state, so
+    clients can tell an unchanged inventory from a single number.
+    """
+
+    def __init__(self):
+        self._vms: Dict[str, 'VMConfig'] = {}
+        self._by_uuid: Dict[str, str] = {}
+        self._by_arch: Dict[str, Set[str]] = {}
+        self._by_tag: Dict[str, Set[str]] = {}
+        self._by_state: Dict[str, Set[str]] = {}
+        self._states: Dict[str, str] = {}
+        self._running: Set[str] = set()
+        self._sequence: Dict[str, int] = {}  # name -> insertion counter, to list matches in order
+        self._counter = itertools.count()
+        self.version = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _add(index: Dict[str, Set[str]], key: str, name: str):
+        index.setdefault(key, set()).add(name)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, name: str):
+        names = index.get(key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del index[key]
+
+    def _index(self, vm):
+        self._by_uuid[vm.uuid] = vm.name
+        self._add(self._by_arch, vm.arch, vm.name)
+        for tag in vm.tags:
+            self._add(self._by_tag, tag, vm.name)
+
+    def _unindex(self, vm):
+        if self._by_uuid.get(vm.uuid) == vm.name:
+            del self._by_uuid[vm.uuid]
+        self._discard(self._by_arch, vm.arch, vm.name)
+        for tag in vm.tags:
+            self._discard(self._by_tag, tag, vm.name)
+
+    def __getitem__(self, name: str):
+        return self._vms[name]
+
+    def __setitem__(self, name: str, vm):
+        with self._lock:
+            previous = self._vms.get(name)
+            if previous is not None:
+                self._unindex(previous)
+            else:
+                self._sequence[name] = next(self._counter)
+            self._vms[name] = vm
+            self._index(vm)
+            self.version += 1
+
+    def __delitem__(self, name: str):
+        with self._lock:
+            vm = self._vms.pop(name)
+            del self._sequence[name]
+            self._unindex(vm)
+            self.set_state(name, None)
+            self.version += 1
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._vms)
+
+    def __len__(self) -> int:
+        return len(self._vms)
+
+    def __contains__(self, name) -> bool:
+        return name in self._vms
+
+    def clear(self):
+        with self._lock:
+            self._vms.clear()
+            self._by_uuid.clear()
+            self._by_arch.clear()
+            self._by_tag.clear()
+            self._by_state.clear()
+            self._states.clear()
+            self._running.clear()
+            self._sequence.clear()
+            self.version += 1
+
+    def touch(self):
+        """Record a change made to a stored config in place"""
+        with self._lock:
+            self.version += 1
+
+    def get_by_uuid(self, vm_uuid: str):
+        name = self._by_uuid.get(vm_uuid)
+        return self._vms.get(name) if name is not None else None
+
+    def find(self, key: str):
+        """A VM by name, or else by UUID"""
+        vm = self._vms.get(key)
+        return vm if vm is not None else self.get_by_uuid(key)
+
+    def set_state(self, name: str, state: Optional[str]):
+        """Track a VM's run state; None or 'stopped' takes it out of the state index.
+
+        'failed' (exited while starting) is indexed but does not count as running.
+        """
+        with self._lock:
+            previous = self._states.pop(name, None)
+            if previous != (state if state != 'stopped' else None):
+                self.version += 1
+            if previous is not None:
+                self._discard(self._by_state, previous, name)
+                self._running.discard(name)
+            if state and state != 'stopped' and name in self._vms:
+                self._states[name] = state
+                self._add(self._by_state, state, name)
+                if state != 'failed':
+                    self._running.add(name)
+
+    def select(self, arch: Optional[str] = None, tag: Optional[str] = None, state: Optional[str] = None,
+               running: Optional[bool] = None) -> List[str]:
+        """Names matching every given filter, in the order the VMs were added.
+
+        ``state`` is an exact run state ('stopped' for VMs without a live
+        process or start error); ``running`` selects VMs with (True) or
+        without (False) a live process.
+        Cost is bounded by the smallest index involved, not the VM count.
+        """
+        stopped = state == 'stopped'
+        if stopped:
+            if running:
+                return []
+            state = None
+        with self._lock:
+            indexes: List[Collection[str]] = []
+            if arch is not None:
+                indexes.append(self._by_arch.get(arch, ()))
+            if tag is not None:
+                indexes.append(self._by_tag.get(tag, ()))
+            if state is not None:
+                indexes.append(self._by_state.get(state, ()))
+            if running:
+                indexes.append(self._running)
+            excluded = self._states if stopped else self._running if running is False else ()
+
+            if not indexes:
+                return [name for name in self._vms if name not in excluded]
+            indexes.sort(key=len)
+            smallest, others = indexes[0], indexes[1:]
+            matches = [name for name in smallest
+                       if name not in excluded and all(name in other for other in others)]
+            return sorted(matches, key=self._sequence.__getitem__)
+
+    def position(self, name: str) -> int:
+        """Where a VM sits in registry order; increases with every VM added"""
+        return self._sequence[name]
+
+    def ordered(self, names: Iterable[str]) -> List[str]:
+        """Known names from ``names`` in registry order, without duplicates"""
+        sequence = self._sequence
+        return sorted({name for name in names if name in sequence}, key=sequence.__getitem__)
+
+    def tags(self) -> Dict[str, int]:
+        with self._lock:
+            return {tag: len(names) for tag, names in self._by_tag.items()}
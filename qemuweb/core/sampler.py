@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Any, Callable, List, Set
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+class MetricsSampler:
+    """Background sampler of resource usage for every running QEMU process.
+
+    One pass every ``interval`` seconds reads CPU, memory, IO and thread
+    counts for all tracked processes. ``psutil.Process`` objects are kept
+    between passes so ``cpu_percent(None)`` returns the non-blocking delta
+    since the previous pass. Readers get the latest snapshot from a dict.
+
+    ``collectors`` add fields to each snapshot (e.g. QMP block statistics) and
+    ``on_sample(name, snapshot)`` is told about every new snapshot.
+    """
+
+    def __init__(self, interval: float = 2.0, on_sample: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.collectors: List[Callable[[str], Dict[str, Any]]] = []
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        self.last_pass_ms = 0.0
+        self.generation = 0  # Passes that sampled at least one process
+        self._processes: Dict[str, psutil.Process] = {}
+        self._vcpu_threads: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='metrics-sampler')
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def track(self, name: str, pid: int):
+        """Start sampling a VM's process"""
+        try:
+            process = psutil.Process(pid)
+            process.cpu_percent(None)  # Prime the CPU delta
+        except psutil.Error as e:
+            logger.warning(f"Cannot sample VM {name} (pid {pid}): {e}")
+            return
+        with self._lock:
+            self._processes[name] = process
+        # Take a first sample soon rather than up to a full interval later
+        self._wakeup.set()
+
+    def untrack(self, name: str):
+        with self._lock:
+            self._processes.pop(name, None)
+            self._vcpu_threads.pop(name, None)
+            self.snapshots.pop(name, None)
+
+    def has_vcpu_threads(self, name: str) -> bool:
+        return name in self._vcpu_threads
+
+    def set_vcpu_threads(self, name: str, thread_ids: Set[int]):
+        """Native thread ids of a VM's vCPUs, whose CPU time is reported as vcpu_time_s"""
+        self._vcpu_threads[name] = set(thread_ids)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Latest snapshot for a VM, or None if it has not been sampled yet"""
+        return self.snapshots.get(name)
+
+    def _sample(self, name: str, process: psutil.Process) -> Dict[str, Any]:
+        vcpu_threads = self._vcpu_threads.get(name)
+        with process.oneshot():
+            memory = process.memory_info()
+            cpu_times = process.cpu_times()
+            snapshot = {
+                'timestamp': time.time(),
+                'cpu_percent': process.cpu_percent(None),
+                'cpu_user_s': cpu_times.user,
+                'cpu_system_s': cpu_times.system,
+                'rss_bytes': memory.rss,
+                'num_threads': process.num_threads(),
+            }
+            try:
+                io = process.io_counters()
+                snapshot['io_read_bytes'] = io.read_bytes
+                snapshot['io_write_bytes'] = io.write_bytes
+            except (psutil.AccessDenied, AttributeError):
+                # Not permitted for other users' processes, missing on macOS
+                pass
+            if vcpu_threads:
+                snapshot['vcpu_time_s'] = sum(thread.user_time + thread.system_time
+                                              for thread in process.threads() if thread.id in vcpu_threads)
+
+        for collector in self.collectors:
+            try:
+                snapshot.update(collector(name))
+            except Exception as e:
+                logger.debug(f"Metrics collector failed for VM {name}: {e}")
+        return snapshot
+
+    def sample_all(self):
+        """One pass over every tracked process"""
+        started = time.perf_counter()
+        with self._lock:
+            processes = list(self._processes.items())
+        for name, process in processes:
+            try:
+                snapshot = self._sample(name, process)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue  # Exited; the supervisor will untrack it
+            except psutil.Error as e:
+                logger.warning(f"Failed to sample VM {name}: {e}")
+                continue
+            with self._lock:
+                if self._processes.get(name) is not process:
+                    continue
+                self.snapshots[name] = snapshot
+            if self.on_sample:
+                self.on_sample(name, snapshot)
+            time.sleep(0)  # Yield to other green threads between processes
+        if processes:
+            self.generation += 1
+        self.last_pass_ms = (time.perf_counter() - started) * 1000
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self.sample_all()
+            except Exception as e:
+                logger.error(f"Metrics sampling pass failed: {e}")
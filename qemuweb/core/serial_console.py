@@ -0,0 +1,119 @@
+import logging
+import socket
+import threading
+import time
+from typing import Optional, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SerialConsole:
+    """qemuweb's connection to the serial port of one headless VM.
+
+    QEMU serves the port on a Unix socket and accepts one client, so every
+    browser terminal shares this connection. Output is kept in a bounded
+    scrollback and handed to ``on_output(name, data, offset)`` as it
+    arrives; ``offset`` counts every byte received, so a terminal that
+    reconnects asks for what it missed instead of the whole history.
+    """
+
+    def __init__(self, name: str, path: str, on_output: Optional[Callable[[str, bytes, int], None]] = None,
+                 scrollback: int = 256 * 1024, connect_timeout: float = 30.0):
+        self.name = name
+        self.path = path
+        self.on_output = on_output
+        self.scrollback = scrollback
+        self.connect_timeout = connect_timeout
+        self.offset = 0  # Bytes received so far; the scrollback holds the last of them
+        self._buffer = bytearray()
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._running = False
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._run, daemon=True, name=f'serial-{self.name}').start()
+
+    def close(self):
+        self._running = False
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _connect(self) -> Optional[socket.socket]:
+        # QEMU creates the socket while starting up
+        deadline = time.monotonic() + self.connect_timeout
+        while self._running and time.monotonic() < deadline:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                return sock
+            except OSError:
+                sock.close()
+                time.sleep(0.2)
+        return None
+
+    def _run(self):
+        sock = self._connect()
+        if sock is None:
+            if self._running:
+                logger.warning(f"Serial console of VM {self.name} not available at {self.path}")
+            self._running = False
+            return
+        self._sock = sock
+        logger.info(f"Connected to serial console of VM {self.name}")
+        try:
+            while self._running:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                with self._lock:
+                    self._buffer += data
+                    if len(self._buffer) > self.scrollback:
+                        del self._buffer[:len(self._buffer) - self.scrollback]
+                    self.offset += len(data)
+                    offset = self.offset
+                if self.on_output:
+                    try:
+                        self.on_output(self.name, data, offset)
+                    except Exception as e:
+                        logger.error(f"Serial output handler failed for VM {self.name}: {e}")
+        except OSError:
+            pass
+        finally:
+            self.close()
+
+    def history(self, since: Optional[int] = None) -> Tuple[int, bytes, bool]:
+        """Output after ``since``, or the whole scrollback; returns (start offset, data, reset).
+
+        ``reset`` is set when ``since`` can no longer be continued from
+        (it scrolled out, or belongs to an earlier run of the VM) and the
+        whole scrollback is returned instead.
+        """
+        with self._lock:
+            first = self.offset - len(self._buffer)
+            if since is None or not first <= since <= self.offset:
+                return first, bytes(self._buffer), since is not None
+            return since, bytes(self._buffer[since - first:]), False
+
+    def write(self, data: bytes) -> bool:
+        """Send keystrokes to the guest; False if the console is not connected"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._write_lock:
+                sock.sendall(data)
+            return True
+        except OSError:
+            return False
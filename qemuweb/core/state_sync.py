@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, Optional, Any, Callable, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keys of a VM status that clients can subscribe to
+FIELDS = ('running', 'state', 'error', 'config', 'display', 'cpu_usage', 'memory_mb', 'threads', 'sampled_at')
+
+# (version, VM name, field or None for the whole VM, JSON patch operation)
+LogEntry = Tuple[int, str, Optional[str], Dict[str, Any]]
+
+def _pointer(name: str, field: Optional[str] = None) -> str:
+    """JSON pointer to a VM, or one of its fields, in the ``{name: status}`` document"""
+    path = '/' + name.replace('~', '~0').replace('/', '~1')
+    return f"{path}/{field}" if field else path
+
+class Subscription:
+    """What one client view displays, and the last version it was sent."""
+
+    __slots__ = ('vms', 'fields', 'sent')
+
+    def __init__(self, vms: Optional[Set[str]], fields: Optional[Set[str]]):
+        self.vms = vms  # None for every VM
+        self.fields = fields  # None for every field
+        self.sent = 0
+
+    def wants(self, name: str, field: Optional[str]) -> bool:
+        if self.vms is not None and name not in self.vms:
+            return False
+        return field is None or self.fields is None or field in self.fields
+
+    def view(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        if self.fields is None:
+            return doc
+        return {key: value for key, value in doc.items() if key in self.fields}
+
+    def filter(self, name: str, field: Optional[str], op: Dict[str, Any]) -> Dict[str, Any]:
+        if field is None and op['op'] != 'remove':
+            return dict(op, value=self.view(op['value']))
+        return op
+
+class StateSync:
+    """Pushes VM status to subscribed clients as versioned JSON-patch deltas.
+
+    The state is one document, ``{vm name: {field: value}}``. VMManager marks
+    VMs as changed; a background thread coalesces the changes, diffs each
+    VM against its last known status and records the differences as RFC 6902
+    operations under a new version number. Each subscription is only sent
+    the operations for the VMs and fields it asked for, so a dashboard that
+    shows run states never receives metrics and nothing is sent when nothing
+    changed.
+
+    A client resubscribing with the last version it saw gets the operations
+    it missed from a log, or a fresh snapshot if they are no longer all
+    there or the server restarted (``epoch`` differs). The log keeps the
+    last ``history_seconds`` of changes, however many VMs there are, and
+    at most ``max_history`` operations to bound its memory.
+    """
+
+    def __init__(self, vm_manager, emit: Callable[[str, Dict[str, Any], str], None],
+                 interval: float = 0.2, history_seconds: float = 300.0, max_history: int = 200000):
+        self.vm_manager = vm_manager
+        self.emit = emit  # emit(event, data, sid)
+        self.interval = interval
+        self.history_seconds = history_seconds
+        self.max_history = max_history
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._log: 'deque[LogEntry]' = deque()
+        self._versions: 'deque[Tuple[int, float]]' = deque()  # (version, when) of each version in the log
+        self._floor = 0  # Catch-up is possible from this version on
+        self._subscriptions: Dict[str, Dict[str, Subscription]] = {}  # sid -> id -> subscription
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        with self._lock:
+            for name in list(self.vm_manager.vms):
+                doc = self._document(name)
+                if doc is not None:
+                    self._docs[name] = doc
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='state-sync')
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def mark(self, name: str):
+        """Note that a VM's status may have changed; cheap enough to call on every event"""
+        self._dirty.add(name)
+        self._wakeup.set()
+
+    def _document(self, name: str) -> Optional[Dict[str, Any]]:
+        status = self.vm_manager.get_vm_status(name)
+        if status is None:
+            return None
+        return {key: status[key] for key in FIELDS if key in status}
+
+    def subscribe(self, sid: str, subscription_id: str, vms: Optional[Iterable[str]] = None,
+                  fields: Optional[Iterable[str]] = None, since: Optional[int] = None,
+                  epoch: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Register (or replace) a subscription; returns the event and payload to answer with.
+
+        That is a 'state_patch' from ``since`` when the client can be caught
+        up, otherwise a 'state_snapshot' of everything it subscribed to.
+        """
+        unknown = set(fields or ()) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        subscription = Subscription(set(vms) if vms is not None else None,
+                                    set(fields) if fields is not None else None)
+        with self._lock:
+            self._subscriptions.setdefault(sid, {})[subscription_id] = subscription
+            subscription.sent = self.version
+            if epoch == self.epoch and since is not None and self._floor <= since <= self.version:
+                ops = [subscription.filter(name, field, op) for version, name, field, op in self._log
+                       if version > since and subscription.wants(name, field)]
+                return 'state_patch', {'id': subscription_id, 'epoch': self.epoch,
+                                       'from': since, 'to': self.version, 'ops': ops}
+            names = self._docs if subscription.vms is None else \
+                [name for name in subscription.vms if name in self._docs]
+            snapshot = {name: subscription.view(self._docs[name]) for name in names}
+            return 'state_snapshot', {'id': subscription_id, 'epoch': self.epoch,
+                                      'version': self.version, 'vms': snapshot}
+
+    def unsubscribe(self, sid: str, subscription_id: Optional[str] = None):
+        """Drop one subscription of a client, or all of them"""
+        with self._lock:
+            if subscription_id is None:
+                self._subscriptions.pop(sid, None)
+            else:
+                self._subscriptions.get(sid, {}).pop(subscription_id, None)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"State sync pass failed: {e}")
+            # Let a burst of changes (a bulk start, a sampling pass) arrive as one version
+            time.sleep(self.interval)
+
+    def _trim(self):
+        """Drop the oldest versions from the log, whole, once too old or too many"""
+        cutoff = time.time() - self.history_seconds
+        while self._versions and (self._versions[0][1] < cutoff or len(self._log) > self.max_history):
+            version = self._versions.popleft()[0]
+            while self._log and self._log[0][0] <= version:
+                self._log.popleft()
+            self._floor = version
+
+    def flush(self):
+        """Diff every VM marked since the last pass and send the changes"""
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        changes: List[Tuple[str, Optional[str], Dict[str, Any]]] = []
+        docs: Dict[str, Optional[Dict[str, Any]]] = {}
+        for name in dirty:
+            doc = docs[name] = self._document(name)
+            old = self._docs.get(name)
+            if doc is None:
+                if old is not None:
+                    changes.append((name, None, {'op': 'remove', 'path': _pointer(name)}))
+                continue
+            if old is None:
+                changes.append((name, None, {'op': 'add', 'path': _pointer(name), 'value': doc}))
+                continue
+            for field, value in doc.items():
+                if field not in old:
+                    changes.append((name, field, {'op': 'add', 'path': _pointer(name, field), 'value': value}))
+                elif old[field] is not value and old[field] != value:
+                    changes.append((name, field, {'op': 'replace', 'path': _pointer(name, field), 'value': value}))
+            for field in old.keys() - doc.keys():
+                changes.append((name, field, {'op': 'remove', 'path': _pointer(name, field)}))
+        if not changes:
+            return
+
+        with self._lock:
+            for name, doc in docs.items():
+                if doc is None:
+                    self._docs.pop(name, None)
+                else:
+                    self._docs[name] = doc
+            self.version += 1
+            version = self.version
+            self._log.extend((version, name, field, op) for name, field, op in changes)
+            self._versions.append((version, time.time()))
+            self._trim()
+            deliveries = []
+            for sid, subscriptions in self._subscriptions.items():
+                for subscription_id, subscription in subscriptions.items():
+                    ops = [subscription.filter(name, field, op) for name, field, op in changes
+                           if subscription.wants(name, field)]
+                    if ops:
+                        deliveries.append((sid, {'id': subscription_id, 'epoch': self.epoch,
+                                                 'from': subscription.sent, 'to': version, 'ops': ops}))
+                        subscription.sent = version
+
+        for sid, payload in deliveries:
+            try:
+                self.emit('state_patch', payload, sid)
+            except Exception as e:
+                logger.error(f"Failed to send state patch to {sid}: {e}")
@@ -0,0 +1,161 @@
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+class ProcessSupervisor:
+    """Single watcher for the exit of every QEMU process.
+
+    Each process gets a pidfd (Linux 5.3+), which becomes readable when the
+    process exits, and one thread waits on all of them at once. Where pidfds
+    are unavailable the same thread falls back to polling every process once
+    per ``poll_interval``. Either way exits are reported exactly once through
+    ``on_exit(name, process, returncode)`` after the process has been reaped.
+    """
+
+    def __init__(self, on_exit: Callable[[str, subprocess.Popen, Optional[int]], None],
+                 poll_interval: float = 1.0):
+        self.on_exit = on_exit
+        self.poll_interval = poll_interval
+        self.use_pidfd = hasattr(os, 'pidfd_open')
+        self._watched: Dict[str, Tuple[subprocess.Popen, Optional[int]]] = {}
+        self._to_close: List[int] = []  # pidfds released by unwatch(), closed by the watcher thread
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='vm-supervisor')
+        self._thread.start()
+        logger.info(f"VM supervisor started ({'pidfd' if self.use_pidfd else 'polling'})")
+
+    def stop(self):
+        self._running = False
+        self._wake()
+
+    def watch(self, name: str, process: subprocess.Popen):
+        """Start watching a VM process, replacing any previous one for the name"""
+        pidfd = None
+        if self.use_pidfd:
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError as e:
+                # Already gone, or not permitted in this environment; poll it instead
+                logger.debug(f"pidfd_open failed for VM {name}: {e}")
+        with self._lock:
+            previous = self._watched.pop(name, None)
+            self._watched[name] = (process, pidfd)
+            if previous and previous[1] is not None:
+                self._to_close.append(previous[1])
+        self._wake()
+
+    def unwatch(self, name: str):
+        """Stop watching a VM; its exit will not be reported"""
+        with self._lock:
+            entry = self._watched.pop(name, None)
+            if entry and entry[1] is not None:
+                self._to_close.append(entry[1])
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                entries = dict(self._watched)
+            fds = [self._wake_r] + [pidfd for _, pidfd in entries.values() if pidfd is not None]
+            # Processes without a pidfd are polled, so don't block indefinitely
+            polled = any(pidfd is None for _, pidfd in entries.values())
+            try:
+                readable, _, _ = select.select(fds, [], [], self.poll_interval if polled else None)
+            except (OSError, ValueError) as e:
+                logger.warning(f"VM supervisor wait failed: {e}")
+                readable = []
+
+            if self._wake_r in readable:
+                # Single read: a green os.read would wait for more data instead of failing with EAGAIN
+                try:
+                    os.read(self._wake_r, 4096)
+                except (BlockingIOError, OSError):
+                    pass
+
+            with self._lock:
+                to_close, self._to_close = self._to_close, []
+            for pidfd in to_close:
+                os.close(pidfd)
+
+            for name, (process, pidfd) in entries.items():
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                with self._lock:
+                    if self._watched.get(name, (None,))[0] is not process:
+                        continue  # Unwatched or replaced meanwhile
+                    del self._watched[name]
+                if pidfd is not None:
+                    os.close(pidfd)
+                try:
+                    self.on_exit(name, process, returncode)
+                except Exception as e:
+                    logger.error(f"Error handling exit of VM {name}: {e}")
+
+class AdoptedProcess:
+    """Popen-like handle for a QEMU process started by an earlier qemuweb.
+
+    The process is not our child, so it cannot be waited for; liveness comes
+    from psutil (which also guards against pid reuse) and its exit status is
+    unknown, reported as 0.
+    """
+
+    def __init__(self, process: psutil.Process):
+        self._process = process
+        self.pid = process.pid
+        self.args = process.cmdline()
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                alive = self._process.is_running() and self._process.status() != psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                alive = False
+            if not alive:
+                self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(0.1)
+        return self.returncode
+
+    def send_signal(self, signo: int):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, signo)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
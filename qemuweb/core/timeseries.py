@@ -0,0 +1,162 @@
+import threading
+import time
+from typing import Dict, Optional, List, Tuple, Any, Sequence
+
+import numpy as np
+
+# Series recorded for every VM. Counters (disk bytes, vCPU seconds) are stored
+# as per-second rates computed from consecutive samples.
+METRICS = ('cpu_percent', 'rss_bytes', 'disk_read_bps', 'disk_write_bps', 'io_read_bps', 'io_write_bps',
+           'vcpu_percent')
+COUNTERS = {
+    'disk_read_bps': 'disk_read_bytes',
+    'disk_write_bps': 'disk_write_bytes',
+    'io_read_bps': 'io_read_bytes',
+    'io_write_bps': 'io_write_bytes',
+}
+
+# (seconds per slot, number of slots): 1 s for 10 minutes, 1 min for 24 hours
+DEFAULT_TIERS = ((1, 600), (60, 1440))
+
+class RingSeries:
+    """Fixed-size ring of time buckets holding the mean of each metric.
+
+    Slot ``bucket % capacity`` holds bucket ``bucket`` (``timestamp // step``);
+    ``buckets`` records which one, so stale slots left by gaps are ignored.
+    """
+
+    def __init__(self, step: int, capacity: int, width: int):
+        self.step = step
+        self.capacity = capacity
+        self.buckets = np.full(capacity, -1, dtype=np.int64)
+        self.values = np.full((capacity, width), np.nan, dtype=np.float32)
+        self._bucket = -1
+        self._sum = np.zeros(width, dtype=np.float64)
+        self._count = np.zeros(width, dtype=np.int64)
+
+    def add(self, timestamp: float, row: np.ndarray):
+        bucket = int(timestamp // self.step)
+        if bucket != self._bucket:
+            self._flush()
+            self._bucket = bucket
+        present = ~np.isnan(row)
+        self._sum[present] += row[present]
+        self._count[present] += 1
+        # Keep the open bucket visible to queries
+        self._store()
+
+    def _store(self):
+        if self._bucket < 0:
+            return
+        slot = self._bucket % self.capacity
+        self.buckets[slot] = self._bucket
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.values[slot] = np.where(self._count > 0, self._sum / np.maximum(self._count, 1), np.nan)
+
+    def _flush(self):
+        self._store()
+        self._sum[:] = 0
+        self._count[:] = 0
+
+    def span(self) -> int:
+        return self.step * self.capacity
+
+    def read(self, since: float, until: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Bucket start times and rows within [since, until], oldest first"""
+        first, last = int(since // self.step), int(until // self.step)
+        mask = (self.buckets >= first) & (self.buckets <= last)
+        order = np.argsort(self.buckets[mask])
+        return self.buckets[mask][order] * self.step, self.values[mask][order]
+
+class VMSeries:
+    """All resolutions of one VM's metrics."""
+
+    def __init__(self, metrics: Sequence[str], tiers: Sequence[Tuple[int, int]]):
+        self.metrics = tuple(metrics)
+        self.tiers = [RingSeries(step, capacity, len(self.metrics)) for step, capacity in tiers]
+        self._previous: Optional[Dict[str, float]] = None
+
+    def record(self, sample: Dict[str, Any]):
+        timestamp = sample['timestamp']
+        values = dict(sample)
+        previous = self._previous
+        for rate, counter in COUNTERS.items():
+            if counter in sample and previous and counter in previous:
+                elapsed = timestamp - previous['timestamp']
+                delta = sample[counter] - previous[counter]
+                if elapsed > 0 and delta >= 0:  # Counters reset when QEMU restarts
+                    values[rate] = delta / elapsed
+        if 'vcpu_time_s' in sample and previous and 'vcpu_time_s' in previous:
+            elapsed = timestamp - previous['timestamp']
+            if elapsed > 0:
+                values['vcpu_percent'] = max(0.0, (sample['vcpu_time_s'] - previous['vcpu_time_s']) / elapsed * 100)
+        self._previous = {key: value for key, value in sample.items() if isinstance(value, (int, float))}
+
+        row = np.array([values.get(metric, np.nan) for metric in self.metrics], dtype=np.float64)
+        for tier in self.tiers:
+            tier.add(timestamp, row)
+
+    def query(self, since: float, until: float, step: Optional[int] = None) -> Dict[str, Any]:
+        # Finest resolution that still covers the requested window
+        tier = next((tier for tier in self.tiers if until - since <= tier.span()), self.tiers[-1])
+        step = max(int(step or tier.step), tier.step)
+        times, rows = tier.read(since, until)
+
+        if step > tier.step and len(times):
+            # Downsample: mean of the non-missing values in each coarser bucket
+            groups = (times // step).astype(np.int64)
+            unique, inverse = np.unique(groups, return_inverse=True)
+            present = ~np.isnan(rows)
+            sums = np.zeros((len(unique), rows.shape[1]))
+            counts = np.zeros((len(unique), rows.shape[1]))
+            np.add.at(sums, inverse, np.where(present, rows, 0))
+            np.add.at(counts, inverse, present)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rows = np.where(counts > 0, sums / counts, np.nan)
+            times = unique * step
+
+        return {
+            'step': step,
+            'timestamps': times.tolist(),
+            'series': {
+                metric: [None if np.isnan(value) else round(float(value), 3) for value in rows[:, index]]
+                for index, metric in enumerate(self.metrics)
+            }
+        }
+
+class MetricsHistory:
+    """Bounded per-VM metrics history; memory depends only on VM count."""
+
+    def __init__(self, tiers: Sequence[Tuple[int, int]] = DEFAULT_TIERS, metrics: Sequence[str] = METRICS):
+        self.tiers = tuple(tiers)
+        self.metrics = tuple(metrics)
+        self._series: Dict[str, VMSeries] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def retention(self) -> int:
+        return max(step * capacity for step, capacity in self.tiers)
+
+    def record(self, name: str, sample: Dict[str, Any]):
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = VMSeries(self.metrics, self.tiers)
+            series.record(sample)
+
+    def query(self, name: str, since: Optional[float] = None, step: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Series for a VM from ``since`` (unix time, default 10 minutes ago) until now"""
+        now = time.time()
+        since = max(since if since is not None else now - 600, now - self.retention)
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return None
+            return series.query(since, now, step)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._series.pop(name, None)
+
+    def names(self) -> List[str]:
+        return list(self._series)
@@ -3,7 +3,7 @@ import struct
 import logging
 import threading
 import time
-from typing import Optional, Tuple, List, Any
+from typing import Optional, Tuple, List, Any, Dict
 from PIL import Image
 import io
 import eventlet
@@ -38,6 +38,7 @@ class EventletVNCClient:
     COPY_RECT_ENCODING = 1
     RRE_ENCODING = 2
     HEXTILE_ENCODING = 5
+    DESKTOP_SIZE_PSEUDO_ENCODING = -223
     
     def __init__(self, host: str, port: int, password: Optional[str] = None):
         self.host = host
@@ -49,6 +50,12 @@ class EventletVNCClient:
         self.height = 0
         self.pixel_format = None
         self._lock = threading.Lock()
+        # Writes are serialized separately from frame reads so input events
+        # never have to wait for a multi-megabyte framebuffer update
+        self._send_lock = threading.Lock()
+        # Wall-clock timestamps (seconds) for the most recent capture_screen() call
+        self.frame_timings: Dict[str, float] = {}
+        self.bytes_received = 0
         
     def connect(self) -> bool:
         """Connect to VNC server"""
@@ -56,6 +63,8 @@ class EventletVNCClient:
             # Create socket with eventlet patching
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(10)  # 10 second timeout
+            # Input events are tiny and latency sensitive, don't let Nagle batch them
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             logger.info(f"Connecting to VNC server at {self.host}:{self.port}")
             self.socket.connect((self.host, self.port))
@@ -196,7 +205,8 @@ class EventletVNCClient:
     
     def _set_encodings(self):
         """Set supported encodings"""
-        encodings = [self.RAW_ENCODING]  # Only support RAW for now
+        # Only RAW for pixel data, plus DesktopSize so guest resolution changes are announced
+        encodings = [self.RAW_ENCODING, self.DESKTOP_SIZE_PSEUDO_ENCODING]
         
         message = struct.pack('!BxH', self.SET_ENCODINGS, len(encodings))
         for encoding in encodings:
@@ -211,6 +221,8 @@ class EventletVNCClient:
             
         try:
             with self._lock:
+                self.frame_timings = {'request': time.time()}
+                
                 # Request framebuffer update
                 self._request_framebuffer_update(0, 0, self.width, self.height, incremental=False)
                 
@@ -221,6 +233,11 @@ class EventletVNCClient:
             logger.error(f"Screen capture failed: {e}")
             return None
     
+    def _send(self, message: bytes):
+        """Write a complete client message to the socket"""
+        with self._send_lock:
+            self.socket.sendall(message)
+    
     def _request_framebuffer_update(self, x: int, y: int, width: int, height: int, incremental: bool = True):
         """Request a framebuffer update"""
         message = struct.pack('!BBHHHH', 
@@ -228,7 +245,7 @@ class EventletVNCClient:
             1 if incremental else 0,
             x, y, width, height
         )
-        self.socket.send(message)
+        self._send(message)
     
     def _recv_all(self, size: int) -> Optional[bytes]:
         """Receive exactly size bytes from socket"""
@@ -239,6 +256,7 @@ class EventletVNCClient:
                 if not chunk:
                     return None
                 data += chunk
+                self.bytes_received += len(chunk)
             except Exception as e:
                 logger.error(f"Error receiving {size} bytes: {e}")
                 return None
@@ -273,6 +291,8 @@ class EventletVNCClient:
             
             # Create numpy array for fast pixel manipulation
             image_array = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            resized = False
+            pixel_rects = 0
             
             # Process rectangles
             for rect_idx in range(num_rects):
@@ -285,7 +305,15 @@ class EventletVNCClient:
                 x, y, w, h, encoding = struct.unpack('!HHHHi', rect_header)
                 logger.debug(f"Rectangle {rect_idx}: ({x},{y}) {w}x{h} encoding={encoding}")
                 
-                if encoding == self.RAW_ENCODING:
+                if encoding == self.DESKTOP_SIZE_PSEUDO_ENCODING:
+                    # Guest changed resolution; the rectangle size is the new framebuffer size
+                    logger.info(f"Desktop resized from {self.width}x{self.height} to {w}x{h}")
+                    self.width, self.height = w, h
+                    image_array = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+                    resized = True
+                    
+                elif encoding == self.RAW_ENCODING:
+                    pixel_rects += 1
                     # For RAW encoding, each pixel is typically 4 bytes (BGRA)
                     bytes_per_pixel = 4
                     data_size = w * h * bytes_per_pixel
@@ -294,6 +322,7 @@ class EventletVNCClient:
                     if not pixel_data:
                         logger.error(f"Failed to read {data_size} bytes for rectangle {rect_idx}")
                         return None
+                    self.frame_timings['received'] = time.time()
                     
                     # Bounds checking
                     if y + h > self.height or x + w > self.width:
@@ -312,23 +341,35 @@ class EventletVNCClient:
                     # Copy to the correct region of the image
                     image_array[y:y+h, x:x+w] = rgb_data
                     
+                    # Give queued input events a chance to go out between rectangles
+                    eventlet.sleep(0)
+                    
                 else:
                     logger.warning(f"Unsupported encoding: {encoding}")
                     # Skip this rectangle data - we need to read and discard it
                     # For now, just return None to avoid getting stuck
                     return None
             
+            if resized and not pixel_rects:
+                # A bare resize carries no pixels, fetch the new screen contents instead of
+                # returning a blank frame
+                self._request_framebuffer_update(0, 0, self.width, self.height, incremental=False)
+                return self._read_framebuffer_update()
+            
             # Convert numpy array back to PIL Image
-            return Image.fromarray(image_array)
+            image = Image.fromarray(image_array)
+            self.frame_timings.setdefault('received', time.time())
+            self.frame_timings['decoded'] = time.time()
+            return image
             
         except Exception as e:
             logger.error(f"Failed to read framebuffer update: {e}", exc_info=True)
             return None
     
-    def send_key_event(self, key: int, down: bool):
-        """Send a key event"""
+    def send_key_event(self, key: int, down: bool) -> bool:
+        """Send a key event; False if it could not be written"""
         if not self.connected:
-            return
+            return False
             
         try:
             message = struct.pack('!BBxxI', 
@@ -336,15 +377,17 @@ class EventletVNCClient:
                 1 if down else 0,
                 key
             )
-            self.socket.send(message)
+            self._send(message)
+            return True
             
         except Exception as e:
             logger.error(f"Failed to send key event: {e}")
+            return False
     
-    def send_pointer_event(self, x: int, y: int, button_mask: int):
-        """Send a pointer (mouse) event"""
+    def send_pointer_event(self, x: int, y: int, button_mask: int) -> bool:
+        """Send a pointer (mouse) event; False if it could not be written"""
         if not self.connected:
-            return
+            return False
             
         try:
             # Clamp coordinates
@@ -356,10 +399,12 @@ class EventletVNCClient:
                 button_mask,
                 x, y
             )
-            self.socket.send(message)
+            self._send(message)
+            return True
             
         except Exception as e:
             logger.error(f"Failed to send pointer event: {e}")
+            return False
     
     def is_connected(self) -> bool:
         """Check if the VNC connection is still alive"""
@@ -379,7 +424,7 @@ class EventletVNCClient:
                     1,  # incremental
                     0, 0, 1, 1
                 )
-                self.socket.send(message)
+                self._send(message)
                 return True
             finally:
                 self.socket.settimeout(original_timeout)
@@ -1,6 +1,9 @@
 // WebSocket connection
 const socket = io();
 
+// Log lines kept for the selected VM; older ones are dropped as new ones stream in
+const MAX_LOG_LINES = 2000;
+
 // Main Vue application
 const app = new Vue({
     el: '#app',
@@ -14,14 +17,14 @@ const app = new Vue({
         vmStates: {},
         displayConnections: {},
         vmLogs: [],
-        logRefreshInterval: null,
+        followedLogs: null,
+        logPosition: null,
         currentView: 'vms',
         systemInfo: null,
         windowWidth: window.innerWidth,
         showFileBrowser: false,
         fileBrowserPath: '/',
-        fileBrowserCallback: null,
-        statusRefreshInterval: null
+        fileBrowserCallback: null
     },
     computed: {
         selectedVMState() {
@@ -105,7 +108,8 @@ const app = new Vue({
                     throw new Error(data.error || `Failed to start VM: ${response.statusText}`);
                 }
 
-                this.successMessage = 'VM started successfully';
+                // Failures after launch arrive as a 'failed' state update
+                this.successMessage = 'VM starting';
                 this.$set(this.vmStates, vmName, 'running');
             } catch (error) {
                 this.errorMessage = error.message;
@@ -134,7 +138,8 @@ const app = new Vue({
         // Data Loading
         async loadVMs() {
             try {
-                const response = await fetch('/api/vms');
+                // One request for configs and run states; unchanged lists revalidate with a 304
+                const response = await fetch('/api/vms?fields=name,running,state,config');
                 if (!response.ok) {
                     throw new Error(`Failed to load VMs: ${response.statusText}`);
                 }
@@ -168,18 +173,8 @@ const app = new Vue({
                     })) : []
                 }));
                 
-                // Load initial state for each VM
-                for (const vm of this.vms) {
-                    try {
-                        const stateResponse = await fetch(`/api/vms/${vm.name}/status`);
-                        if (stateResponse.ok) {
-                            const stateData = await stateResponse.json();
-                            this.$set(this.vmStates, vm.name, stateData.running ? 'running' : 'stopped');
-                        }
-                    } catch (error) {
-                        console.error(`Failed to load state for VM ${vm.name}:`, error);
-                        this.$set(this.vmStates, vm.name, 'unknown');
-                    }
+                for (const vm of data) {
+                    this.$set(this.vmStates, vm.name, vm.running ? 'running' : 'stopped');
                 }
             } catch (error) {
                 this.errorMessage = error.message;
@@ -278,65 +273,72 @@ const app = new Vue({
             }
         },
 
-        async fetchVMLogs(vmName) {
-            try {
-                const response = await fetch(`/api/vms/${vmName}/logs`);
-                const data = await response.json();
-                if (data.success) {
-                    this.vmLogs = data.logs;
-                } else {
-                    console.error('Failed to fetch logs:', data.error);
-                }
-            } catch (error) {
-                console.error('Error fetching VM logs:', error);
+        // Stream a VM's log: the tail first, then lines as QEMU writes them
+        followLogs(vmName) {
+            if (this.followedLogs && this.followedLogs !== vmName) {
+                socket.emit('log_unfollow', { name: this.followedLogs });
+            }
+            this.followedLogs = vmName;
+            this.logPosition = null;
+            this.vmLogs = [];
+            if (vmName) {
+                socket.emit('log_follow', { name: vmName });
             }
         },
 
+        applyLogChunk(data) {
+            if (data.name !== this.followedLogs) return;
+            const logs = data.reset ? [] : this.vmLogs.slice();
+            const lines = data.logs.slice();
+            // The previous chunk may have ended in the middle of a line
+            const last = logs.length - 1;
+            if (lines.length && last >= 0 && !logs[last].endsWith('\n')) {
+                logs[last] += lines.shift();
+            }
+            logs.push(...lines);
+            this.vmLogs = logs.length > MAX_LOG_LINES ? logs.slice(-MAX_LOG_LINES) : logs;
+            this.logPosition = { file: data.file, offset: data.next_offset };
+        },
+
         refreshLogs() {
             if (this.selectedVM) {
-                this.fetchVMLogs(this.selectedVM);
+                this.followLogs(this.selectedVM);
             }
         },
 
         async selectVM(vmName) {
             this.selectedVM = vmName;
-            if (this.statusRefreshInterval) {
-                clearInterval(this.statusRefreshInterval);
-                this.statusRefreshInterval = null;
-            }
-            if (vmName) {
-                if (this.logRefreshInterval) {
-                    clearInterval(this.logRefreshInterval);
+            // Stats of the selected VM are pushed as they are sampled
+            this.detailSync.update({ vms: vmName ? [vmName] : [] });
+            this.followLogs(vmName);
+        },
+
+        // Run state of every VM, from the 'vm-list' subscription
+        applyListState(state, names) {
+            for (const name of names || Object.keys(state)) {
+                const vm = state[name];
+                if (!vm) {
+                    this.$delete(this.vmStates, name);
+                    continue;
                 }
-                await this.fetchVMLogs(vmName);
-                if (this.vmStates[vmName] === 'running') {
-                    this.logRefreshInterval = setInterval(() => {
-                        this.fetchVMLogs(vmName);
-                    }, 5000);
-                    // Start polling for VM status (stats)
-                    this.statusRefreshInterval = setInterval(async () => {
-                        await this.fetchVMStatus(vmName);
-                    }, 2000);
-                    // Fetch immediately
-                    await this.fetchVMStatus(vmName);
+                this.$set(this.vmStates, name, vm.running ? 'running' : 'stopped');
+                if (names && vm.state === 'failed' && vm.error) {
+                    this.errorMessage = `Failed to start VM ${name}: ${vm.error}`;
                 }
             }
+            // VMs created or deleted elsewhere need their configs (re)loaded
+            const known = new Set(this.vms.map(vm => vm.name));
+            if (names && [...names].some(name => !state[name] === known.has(name))) {
+                this.loadVMs();
+            }
         },
 
-        async fetchVMStatus(vmName) {
-            try {
-                const response = await fetch(`/api/vms/${vmName}/status`);
-                if (response.ok) {
-                    const data = await response.json();
-                    // Update the VM in the vms array
-                    const idx = this.vms.findIndex(vm => vm.name === vmName);
-                    if (idx !== -1) {
-                        // Merge new stats into the VM object
-                        this.$set(this.vms, idx, Object.assign({}, this.vms[idx], data, { config: this.vms[idx].config }));
-                    }
-                }
-            } catch (error) {
-                console.error('Error fetching VM status:', error);
+        // Stats of the selected VM, from the 'vm-detail' subscription
+        applyDetailState(state) {
+            const stats = state[this.selectedVM];
+            const idx = this.vms.findIndex(vm => vm.name === this.selectedVM);
+            if (stats && idx !== -1) {
+                this.$set(this.vms, idx, Object.assign({}, this.vms[idx], stats));
             }
         },
 
@@ -364,20 +366,19 @@ const app = new Vue({
         this.loadSystemInfo();
         window.addEventListener('resize', this.handleResize);
 
+        // Pushed state: run states of all VMs, and stats of the selected one
+        this.listSync = new StateSync(socket, 'vm-list', { fields: ['running', 'state', 'error'] },
+            (state, names) => this.applyListState(state, names));
+        this.detailSync = new StateSync(socket, 'vm-detail',
+            { vms: [], fields: ['running', 'cpu_usage', 'memory_mb', 'threads', 'sampled_at', 'display'] },
+            (state) => this.applyDetailState(state));
+
         // WebSocket event listeners
-        socket.on('vm_status', (data) => {
-            this.$set(this.vmStates, data.name, data.running ? 'running' : 'stopped');
-            // If the selected VM changed state, start/stop polling
-            if (this.selectedVM === data.name) {
-                if (data.running && !this.statusRefreshInterval) {
-                    this.statusRefreshInterval = setInterval(async () => {
-                        await this.fetchVMStatus(data.name);
-                    }, 2000);
-                    this.fetchVMStatus(data.name);
-                } else if (!data.running && this.statusRefreshInterval) {
-                    clearInterval(this.statusRefreshInterval);
-                    this.statusRefreshInterval = null;
-                }
+        socket.on('vm_log', (data) => this.applyLogChunk(data));
+        socket.on('connect', () => {
+            // Pick the log up where it was before the connection dropped
+            if (this.followedLogs) {
+                socket.emit('log_follow', Object.assign({ name: this.followedLogs }, this.logPosition));
             }
         });
 
@@ -385,17 +386,20 @@ const app = new Vue({
             this.$set(this.vmStates, data.name, 'stopped');
         });
 
+        socket.on('vm_event', (data) => {
+            if (data.event === 'GUEST_PANICKED') {
+                this.errorMessage = `VM ${data.name} guest kernel panicked`;
+            }
+        });
+
         socket.on('vm_error', (data) => {
             this.errorMessage = `Error with VM ${data.name}: ${data.error}`;
         });
     },
     beforeDestroy() {
-        if (this.logRefreshInterval) {
-            clearInterval(this.logRefreshInterval);
-        }
-        if (this.statusRefreshInterval) {
-            clearInterval(this.statusRefreshInterval);
-        }
+        this.followLogs(null);
+        this.listSync.close();
+        this.detailSync.close();
         window.removeEventListener('resize', this.handleResize);
     }
 }); 
\ No newline at end of file
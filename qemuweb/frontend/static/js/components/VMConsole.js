@@ -0,0 +1,121 @@
+// Interactive serial console of a headless VM, bridged over Socket.IO
+Vue.component('vm-console', {
+    props: {
+        vmName: {
+            type: String,
+            required: true
+        },
+        vmState: {
+            type: String,
+            required: true
+        }
+    },
+    data() {
+        return {
+            connected: false,
+            error: null
+        };
+    },
+    mounted() {
+        if (this.vmState === 'running') {
+            this.open();
+        }
+    },
+    beforeDestroy() {
+        this.cleanup();
+    },
+    watch: {
+        vmState(newState) {
+            if (newState === 'running' && !this.socket) {
+                this.open();
+            } else if (newState !== 'running') {
+                this.cleanup();
+            }
+        }
+    },
+    methods: {
+        open() {
+            // Not reactive: the terminal and socket are managed by hand
+            this.term = new Terminal({ rows: 24, cols: 80, scrollback: 5000, convertEol: false });
+            this.term.open(this.$refs.terminal);
+            this.term.onData(data => {
+                this.socket.emit('console_input', { name: this.vmName, data });
+            });
+            this.offset = null;  // Bytes of output written to the terminal so far
+            this.pending = [];   // Live output that arrived before the scrollback
+
+            this.socket = io();
+            this.socket.on('connect', () => {
+                this.connected = true;
+                this.error = null;
+                this.pending = [];
+                // A reconnect only asks for what was missed
+                this.socket.emit('console_open', { name: this.vmName, offset: this.offset });
+            });
+            this.socket.on('disconnect', () => {
+                this.connected = false;
+            });
+            this.socket.on('error', (error) => {
+                this.error = error.message;
+            });
+            this.socket.on('console_output', this.handleOutput);
+        },
+
+        handleOutput(message) {
+            if (message.name !== this.vmName) return;
+            if (message.scrollback) {
+                if (message.reset || this.offset === null) {
+                    this.term.reset();
+                    this.offset = message.offset;
+                }
+                this.write(message);
+                const pending = this.pending;
+                this.pending = null;
+                pending.forEach(this.write);
+            } else if (this.pending) {
+                this.pending.push(message);
+            } else {
+                this.write(message);
+            }
+        },
+
+        write(message) {
+            if (message.offset > this.offset) {
+                // Missed some output: ask for it
+                this.pending = [];
+                this.socket.emit('console_open', { name: this.vmName, offset: this.offset });
+                return;
+            }
+            const data = new Uint8Array(message.data);
+            const skip = this.offset - message.offset;  // Already written
+            if (skip < data.length) {
+                this.term.write(data.subarray(skip));
+                this.offset = message.next_offset;
+            }
+        },
+
+        cleanup() {
+            if (this.socket) {
+                this.socket.emit('console_close', { name: this.vmName });
+                this.socket.disconnect();
+                this.socket = null;
+            }
+            if (this.term) {
+                this.term.dispose();
+                this.term = null;
+            }
+            this.connected = false;
+        }
+    },
+    template: `
+        <div class="bg-gray-900 p-4">
+            <div class="flex justify-between items-center mb-2 text-sm">
+                <span class="text-gray-300">Serial console</span>
+                <span :class="connected ? 'text-green-400' : 'text-gray-500'">
+                    {{ error || (connected ? 'Connected' : 'Connecting...') }}
+                </span>
+            </div>
+            <div ref="terminal" class="overflow-auto"></div>
+        </div>
+    `
+});
@@ -69,6 +69,14 @@ Vue.component('vm-details', {
                 </vm-thumbnail>
             </div>
 
+            <!-- Serial console of headless VMs -->
+            <div v-if="vm.headless && vmState === 'running'" class="-mb-6">
+                <vm-console
+                    :vm-name="vm.name"
+                    :vm-state="vmState">
+                </vm-console>
+            </div>
+
             <!-- Header with dropdown menu -->
             <div class="px-6 py-5 border-b border-gray-200">
                 <div class="flex justify-between items-center">
@@ -21,7 +21,7 @@ Vue.component('vm-display', {
                             <a @click.prevent="zoomToActual(); showScaleMenu = false" class="block px-3 py-1 text-white hover:bg-gray-600 cursor-pointer">Actual Size (100%)</a>
                         </div>
                     </div>
-                    <div class="relative">
+                    <div v-if="!recordingId" class="relative">
                         <button @click="showKeyboardMenu = !showKeyboardMenu" class="p-2 rounded hover:bg-gray-700 flex items-center" title="Keyboard Shortcuts">
                             <i class="fas fa-keyboard mr-1"></i> Shortcuts
                         </button>
@@ -39,7 +39,7 @@ Vue.component('vm-display', {
                             <a @click.prevent="sendWindowsKey(); showKeyboardMenu = false" class="block px-3 py-1 text-white hover:bg-gray-600 cursor-pointer">Windows Key</a>
                         </div>
                     </div>
-                    <div class="relative">
+                    <div v-if="!recordingId" class="relative">
                         <button @click="showPowerMenu = !showPowerMenu" class="p-2 rounded hover:bg-gray-700 flex items-center" title="Power Management">
                             <i class="fas fa-power-off mr-1"></i> Power
                         </button>
@@ -62,6 +62,27 @@ Vue.component('vm-display', {
                 </div>
                 <!-- Right Aligned Controls -->
                 <div class="flex items-center gap-2">
+                    <template v-if="!recordingId">
+                        <button @click="toggleRecording" class="p-2 rounded hover:bg-gray-700" :title="recording ? 'Stop Recording' : 'Record Session'">
+                            <i class="fas fa-circle" :class="recording ? 'text-red-500' : 'text-gray-400'"></i>
+                        </button>
+                        <div class="relative">
+                            <button @click="toggleRecordingsMenu" class="p-2 rounded hover:bg-gray-700" title="Recordings">
+                                <i class="fas fa-film"></i>
+                            </button>
+                            <div v-if="showRecordingsMenu" class="absolute right-0 mt-1 py-1 w-64 bg-gray-700 rounded shadow-xl">
+                                <div v-if="recordings.length === 0" class="px-3 py-1 text-gray-400 text-sm">No recordings</div>
+                                <a v-for="rec in recordings" :key="rec.id" :href="'/vm/' + vmId + '/recordings/' + rec.id" target="_blank"
+                                   class="block px-3 py-1 text-white hover:bg-gray-600 cursor-pointer text-sm">
+                                    {{ rec.started.replace('T', ' ').slice(0, 19) }} ({{ formatPlaybackTime(rec.duration) }})
+                                    <span v-if="rec.active" class="text-red-400 ml-1">&#9679;</span>
+                                </a>
+                            </div>
+                        </div>
+                    </template>
+                    <button @click="toggleLatencyOverlay" class="p-2 rounded hover:bg-gray-700" :class="{ 'bg-gray-700': showLatencyOverlay }" title="Display Latency">
+                        <i class="fas fa-tachometer-alt"></i>
+                    </button>
                     <button @click="toggleFullscreen" class="p-2 rounded hover:bg-gray-700" title="Toggle Fullscreen">
                         <i class="fas" :class="isFullscreen ? 'fa-compress' : 'fa-expand'"></i>
                     </button>
@@ -184,16 +205,47 @@ Vue.component('vm-display', {
                     </div>
                 </div>
                 
+                <!-- Latency Overlay -->
+                <div v-if="showLatencyOverlay"
+                     class="absolute top-2 right-2 p-3 bg-black bg-opacity-75 text-white text-xs font-mono rounded shadow-lg z-30 pointer-events-none">
+                    <div class="font-bold mb-1">Display latency (ms)</div>
+                    <div v-if="!latencyStats" class="text-gray-400">Waiting for samples...</div>
+                    <table v-else>
+                        <tr class="text-gray-400">
+                            <td class="pr-3">stage</td><td class="pr-2 text-right">p50</td><td class="pr-2 text-right">p95</td><td class="text-right">p99</td>
+                        </tr>
+                        <tr v-for="row in latencyRows" :key="row.name">
+                            <td class="pr-3">{{ row.name }}</td>
+                            <td class="pr-2 text-right">{{ formatLatency(row.stats.p50) }}</td>
+                            <td class="pr-2 text-right">{{ formatLatency(row.stats.p95) }}</td>
+                            <td class="text-right">{{ formatLatency(row.stats.p99) }}</td>
+                        </tr>
+                    </table>
+                    <div class="mt-1 text-gray-400">{{ framesReceived }} frames received</div>
+                </div>
+                
                 <canvas ref="canvas" tabindex="0" @contextmenu.prevent="handleContextMenu"
                         class="outline-none" 
                         :style="canvasStyle">
                 </canvas>
             </div>
+            
+            <!-- Playback Bar -->
+            <div v-if="recordingId" class="flex-none w-full p-2 bg-gray-800 text-white flex items-center gap-3 z-50">
+                <button @click="togglePlayback" class="p-2 rounded hover:bg-gray-700" :title="playback.playing ? 'Pause' : 'Play'">
+                    <i class="fas" :class="playback.playing ? 'fa-pause' : 'fa-play'"></i>
+                </button>
+                <input type="range" class="flex-1" min="0" step="0.1"
+                       :max="playback.duration" :value="playback.position"
+                       @change="seekPlayback($event.target.value)">
+                <span class="text-sm font-mono">{{ formatPlaybackTime(playback.position) }} / {{ formatPlaybackTime(playback.duration) }}</span>
+            </div>
         </div>
     `,
 
     props: {
-        vmId: { type: String, required: true }
+        vmId: { type: String, required: true },
+        recordingId: { type: String, default: null }  // Plays back a session recording instead of the live display
     },
 
     data() {
@@ -256,6 +308,18 @@ Vue.component('vm-display', {
             // Input state
             mouseButtons: 0, // Bitmask for mouse buttons (0:left, 1:middle, 2:right)
 
+            // Latency instrumentation
+            metricsFlushInterval: null,
+            showLatencyOverlay: false,
+            latencyStats: null,
+            latencyRefreshInterval: null,
+
+            // Session recording & playback
+            recording: false,
+            recordings: [],
+            showRecordingsMenu: false,
+            playback: { position: 0, duration: 0, playing: false },
+
             // Observers & Timers
             resizeObserver: null,
         };
@@ -270,6 +334,14 @@ Vue.component('vm-display', {
         },
         containerObserverTarget() {
             return this.$refs.container;
+        },
+        latencyRows() {
+            if (!this.latencyStats) return [];
+            const rows = Object.entries(this.latencyStats.latency_ms)
+                .filter(([, stats]) => stats.count > 0)
+                .map(([name, stats]) => ({ name, stats }));
+            rows.push({ name: 'input_queue', stats: this.latencyStats.input.queue_delay_ms });
+            return rows;
         }
     },
 
@@ -307,14 +379,17 @@ Vue.component('vm-display', {
         this.setupSocket();
         this.setupGlobalEventListeners();
         this.setupResizeObserver();
-        this.loadVMStatus();
+        if (this.recordingId) {
+            // Hides the power/status overlays, which don't apply to a recording
+            this.vmStatus = 'playback';
+        } else {
+            this.loadRecordingStatus();
+        }
         
-        // Set up periodic status check for the overlay
-        this.statusCheckInterval = setInterval(() => {
-            if (this.vmStatus === 'stopped' || this.vmStatus === 'unknown' || this.startingVM) {
-                this.loadVMStatus();
-            }
-        }, 2000); // Check every 2 seconds for stopped/unknown/starting states
+        // Report browser-side decode/paint times back to the server once a second.
+        // Kept outside data() so per-frame samples don't go through Vue reactivity.
+        this.frameMetrics = [];
+        this.metricsFlushInterval = setInterval(this.flushFrameMetrics, 1000);
         
         this.$nextTick(() => {
             if (this.containerObserverTarget) {
@@ -335,26 +410,20 @@ Vue.component('vm-display', {
 
     beforeDestroy() {
         this.cleanup();
-        if (this.statusCheckInterval) {
-            clearInterval(this.statusCheckInterval);
+        if (this.metricsFlushInterval) {
+            clearInterval(this.metricsFlushInterval);
+        }
+        if (this.latencyRefreshInterval) {
+            clearInterval(this.latencyRefreshInterval);
         }
     },
 
     methods: {
         // --- VM Status Management ---
-        async loadVMStatus() {
-            try {
-                const response = await fetch(`/api/vms/${this.vmId}/status`);
-                if (response.ok) {
-                    const data = await response.json();
-                    this.vmStatus = data.running ? 'running' : 'stopped';
-                } else {
-                    this.vmStatus = 'unknown';
-                }
-            } catch (error) {
-                console.error('Failed to load VM status:', error);
-                this.vmStatus = 'unknown';
-            }
+        // Run state for the overlay, pushed by the server whenever it changes
+        applyVMState(state) {
+            const vm = state[this.vmId];
+            this.vmStatus = vm ? (vm.running ? 'running' : 'stopped') : 'unknown';
         },
         
         async startVM() {
@@ -373,16 +442,6 @@ Vue.component('vm-display', {
 
                 // VM started successfully, status will be updated via WebSocket
                 console.log('VM start request sent successfully');
-                
-                // Check status immediately and then periodically
-                this.loadVMStatus();
-                setTimeout(() => {
-                    this.loadVMStatus();
-                }, 1000);
-                setTimeout(() => {
-                    this.loadVMStatus();
-                }, 3000);
-                
             } catch (error) {
                 console.error('Failed to start VM:', error);
                 // You could show an error message to the user here
@@ -452,12 +511,12 @@ Vue.component('vm-display', {
         },
         sendCtrlAltDel() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Alt', code: 'AltLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Delete', code: 'Delete' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Delete', code: 'Delete' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Alt', code: 'AltLeft' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keydown', key: 'Delete', code: 'Delete' });
+            this.sendInput({ type: 'keyup', key: 'Delete', code: 'Delete' });
+            this.sendInput({ type: 'keyup', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         toggleFullscreen() {
             if (!document.fullscreenElement) {
@@ -474,7 +533,11 @@ Vue.component('vm-display', {
             this.socket = io();
             this.socket.on('connect', () => {
                 this.connected = true;
-                this.socket.emit('init_display', { vm_id: this.vmId });
+                if (this.recordingId) {
+                    this.socket.emit('init_playback', { vm_id: this.vmId, recording_id: this.recordingId, t: this.playback.position });
+                } else {
+                    this.socket.emit('init_display', { vm_id: this.vmId });
+                }
             });
             this.socket.on('disconnect', () => this.connected = false);
             this.socket.on('error', (error) => {
@@ -486,22 +549,126 @@ Vue.component('vm-display', {
             });
             this.socket.on('vm_frame', this.handleFrame);
             this.socket.on('resolution_changed', this.handleResolutionChange);
-            
-            // Listen for VM status changes
-            this.socket.on('vm_stopped', (data) => {
-                if (data.name === this.vmId) {
-                    this.vmStatus = 'stopped';
-                }
+            this.socket.on('playback_state', (state) => {
+                this.playback = state;
             });
             
-            // Listen for VM status updates
-            this.socket.on('vm_status', (data) => {
-                if (data.name === this.vmId) {
-                    this.vmStatus = data.running ? 'running' : 'stopped';
+            // Run state of this VM, caught up again after reconnects
+            if (!this.recordingId) {
+                this.statusSync = new StateSync(this.socket, 'display-status',
+                    { vms: [this.vmId], fields: ['running', 'state'] }, (state) => this.applyVMState(state));
+            }
+        },
+        sendInput(event) {
+            if (this.recordingId) return;  // Recordings are view-only
+            // Client timestamp lets the server match input to the frame that reflects it
+            event.ts = Date.now();
+            this.socket.emit('vm_input', event);
+        },
+        recordFrameMetrics(data, receivedAt, decodedAt) {
+            // The paint happens on the next animation frame after drawImage
+            requestAnimationFrame(() => {
+                const paintedAt = performance.now();
+                const sample = {
+                    frame_id: data.frame_id,
+                    client_decode_ms: decodedAt - receivedAt,
+                    client_paint_ms: paintedAt - decodedAt
+                };
+                if (data.input_ts) {
+                    sample.input_to_photon_ms = Date.now() - data.input_ts;
+                }
+                if (this.frameMetrics.length < 500) {
+                    this.frameMetrics.push(sample);
                 }
             });
         },
+        flushFrameMetrics() {
+            if (!this.socket || !this.connected || this.frameMetrics.length === 0) return;
+            this.socket.emit('display_metrics', { samples: this.frameMetrics });
+            this.frameMetrics = [];
+        },
+        toggleLatencyOverlay() {
+            this.showLatencyOverlay = !this.showLatencyOverlay;
+            if (this.latencyRefreshInterval) {
+                clearInterval(this.latencyRefreshInterval);
+                this.latencyRefreshInterval = null;
+            }
+            if (this.showLatencyOverlay) {
+                this.loadLatencyStats();
+                this.latencyRefreshInterval = setInterval(this.loadLatencyStats, 2000);
+            } else {
+                this.latencyStats = null;
+            }
+        },
+        async loadLatencyStats() {
+            if (!this.socket) return;
+            try {
+                const response = await fetch(`/api/vms/${this.vmId}/display/stats`);
+                if (!response.ok) return;
+                const data = await response.json();
+                this.latencyStats = (data.sessions || []).find(s => s.session_id === this.socket.id) || null;
+            } catch (error) {
+                console.error('Failed to load display latency stats:', error);
+            }
+        },
+        async loadRecordingStatus() {
+            try {
+                const response = await fetch(`/api/vms/${this.vmId}/recording`);
+                if (response.ok) {
+                    const data = await response.json();
+                    this.recording = data.recording;
+                }
+            } catch (error) {
+                console.error('Failed to load recording status:', error);
+            }
+        },
+        async toggleRecording() {
+            const action = this.recording ? 'stop' : 'start';
+            try {
+                const response = await fetch(`/api/vms/${this.vmId}/recording/${action}`, { method: 'POST' });
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || `Failed to ${action} recording`);
+                }
+                this.recording = action === 'start';
+            } catch (error) {
+                console.error('Failed to toggle recording:', error);
+            }
+        },
+        async toggleRecordingsMenu() {
+            this.showRecordingsMenu = !this.showRecordingsMenu;
+            if (!this.showRecordingsMenu) return;
+            try {
+                const response = await fetch(`/api/vms/${this.vmId}/recordings`);
+                const data = await response.json();
+                this.recordings = data.recordings || [];
+            } catch (error) {
+                console.error('Failed to load recordings:', error);
+            }
+        },
+        togglePlayback() {
+            if (!this.socket) return;
+            let playing = !this.playback.playing;
+            if (playing && this.playback.position >= this.playback.duration) {
+                // Replay from the start once the end has been reached
+                this.socket.emit('playback_control', { t: 0 });
+            }
+            this.socket.emit('playback_control', { playing });
+        },
+        seekPlayback(value) {
+            if (!this.socket) return;
+            this.socket.emit('playback_control', { t: parseFloat(value) });
+        },
+        formatPlaybackTime(seconds) {
+            const total = Math.floor(seconds || 0);
+            const minutes = Math.floor(total / 60);
+            return `${minutes}:${String(total % 60).padStart(2, '0')}`;
+        },
+        formatLatency(value) {
+            return value === null || value === undefined ? '-' : value.toFixed(1);
+        },
         async handleFrame(data) {
+            const receivedAt = performance.now();
             this.framesReceived++;
             if (!this.$refs.canvas) return;
             const canvas = this.$refs.canvas;
@@ -547,7 +714,9 @@ Vue.component('vm-display', {
                     dimensionsChanged = true;
                 }
                 
+                const decodedAt = performance.now();
                 ctx.drawImage(img, 0, 0);
+                this.recordFrameMetrics(data, receivedAt, decodedAt);
 
                 if (dimensionsChanged) {
                     // Use multiple nextTick calls to ensure DOM is fully updated
@@ -806,7 +975,7 @@ Vue.component('vm-display', {
             if (this.isDesktop) {
                 // On desktop, forward scroll events to the VM instead of zooming
                 if (this.connected) {
-                    this.socket.emit('vm_input', {
+                    this.sendInput({
                         type: 'scroll', // Standardized event type for scrolling
                         deltaX: e.deltaX,
                         deltaY: e.deltaY,
@@ -896,7 +1065,7 @@ Vue.component('vm-display', {
         handleCanvasMouseMove(e) {
             if (!this.connected) return;
             const { x, y, valid } = this.getCanvasRelativeCoords(e.clientX, e.clientY);
-            if (valid) this.socket.emit('vm_input', { type: 'mousemove', x, y, buttons: this.mouseButtons });
+            if (valid) this.sendInput({ type: 'mousemove', x, y, buttons: this.mouseButtons });
         },
         handleCanvasMouseDown(e) {
             if (!this.connected) return;
@@ -904,7 +1073,7 @@ Vue.component('vm-display', {
             const { x, y, valid } = this.getCanvasRelativeCoords(e.clientX, e.clientY);
             if (valid) {
                 this.mouseButtons |= (1 << e.button);
-                this.socket.emit('vm_input', { type: 'mousedown', x, y, button: e.button });
+                this.sendInput({ type: 'mousedown', x, y, button: e.button });
             }
         },
         handleCanvasMouseUp(e) {
@@ -912,7 +1081,7 @@ Vue.component('vm-display', {
             const { x, y, valid } = this.getCanvasRelativeCoords(e.clientX, e.clientY);
             if (valid) {
                 this.mouseButtons &= ~(1 << e.button);
-                this.socket.emit('vm_input', { type: 'mouseup', x, y, button: e.button });
+                this.sendInput({ type: 'mouseup', x, y, button: e.button });
             }
              // If all buttons are up, ensure mouseButtons is 0
             if ((e.buttons || 0) === 0) { // e.buttons is a bitmask of currently pressed buttons
@@ -937,7 +1106,7 @@ Vue.component('vm-display', {
             if (!e.metaKey && !e.ctrlKey && e.key !== 'F11' && e.key !== 'F12' && !isModifierOnly ) { // Allow F11 for fullscreen, F12 for dev tools
                  e.preventDefault();
             }
-            this.socket.emit('vm_input', { type: 'keydown', key: e.key, code: e.code });
+            this.sendInput({ type: 'keydown', key: e.key, code: e.code });
         },
         handleGlobalKeyUp(e) {
             if (!this.connected || document.activeElement !== this.$refs.canvas) return;
@@ -945,7 +1114,7 @@ Vue.component('vm-display', {
             if (!e.metaKey && !e.ctrlKey && e.key !== 'F11' && e.key !== 'F12' && !isModifierOnly ) {
                 e.preventDefault();
             }
-            this.socket.emit('vm_input', { type: 'keyup', key: e.key, code: e.code });
+            this.sendInput({ type: 'keyup', key: e.key, code: e.code });
         },
         handleWindowBlur() {
             if (!this.connected) return;
@@ -954,7 +1123,7 @@ Vue.component('vm-display', {
                 if ((this.mouseButtons >> i) & 1) {
                     // We don't know the last coords, send 0,0 or don't send coords.
                     // Most VMs will release button regardless of coords on mouseup.
-                    this.socket.emit('vm_input', { type: 'mouseup', x:0, y:0, button: i });
+                    this.sendInput({ type: 'mouseup', x:0, y:0, button: i });
                 }
             }
             this.mouseButtons = 0;
@@ -1043,7 +1212,7 @@ Vue.component('vm-display', {
                     this.touchState.currentMouseY = Math.max(0, Math.min(this.touchState.currentMouseY, this.vmCanvasHeight - 1));
                     
                     // Send the mouse movement
-                    this.socket.emit('vm_input', { 
+                    this.sendInput({ 
                         type: 'mousemove', 
                         x: Math.floor(this.touchState.currentMouseX), 
                         y: Math.floor(this.touchState.currentMouseY), 
@@ -1113,14 +1282,14 @@ Vue.component('vm-display', {
 
                     if (duration < TAP_DURATION_THRESHOLD && distSq < TAP_MOVE_THRESHOLD_SQ) {
                         // Single finger tap = left click at current mouse position
-                        this.socket.emit('vm_input', { 
+                        this.sendInput({ 
                             type: 'mousedown', 
                             x: Math.floor(this.touchState.currentMouseX), 
                             y: Math.floor(this.touchState.currentMouseY), 
                             button: 0 
                         });
                         setTimeout(() => {
-                            this.socket.emit('vm_input', { 
+                            this.sendInput({ 
                                 type: 'mouseup', 
                                 x: Math.floor(this.touchState.currentMouseX), 
                                 y: Math.floor(this.touchState.currentMouseY), 
@@ -1138,14 +1307,14 @@ Vue.component('vm-display', {
                     
                     if (duration < TAP_DURATION_THRESHOLD) {
                         // Two finger tap = right click at current mouse position
-                        this.socket.emit('vm_input', { 
+                        this.sendInput({ 
                             type: 'mousedown', 
                             x: Math.floor(this.touchState.currentMouseX), 
                             y: Math.floor(this.touchState.currentMouseY), 
                             button: 2 
                         });
                         setTimeout(() => {
-                            this.socket.emit('vm_input', { 
+                            this.sendInput({ 
                                 type: 'mouseup', 
                                 x: Math.floor(this.touchState.currentMouseX), 
                                 y: Math.floor(this.touchState.currentMouseY), 
@@ -1330,19 +1499,19 @@ Vue.component('vm-display', {
             
             // Handle special characters
             if (char === '\n') {
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Enter', code: 'Enter' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Enter', code: 'Enter' });
+                this.sendInput({ type: 'keydown', key: 'Enter', code: 'Enter' });
+                this.sendInput({ type: 'keyup', key: 'Enter', code: 'Enter' });
             } else if (char === '\t') {
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Tab', code: 'Tab' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Tab', code: 'Tab' });
+                this.sendInput({ type: 'keydown', key: 'Tab', code: 'Tab' });
+                this.sendInput({ type: 'keyup', key: 'Tab', code: 'Tab' });
             } else if (char === ' ') {
-                this.socket.emit('vm_input', { type: 'keydown', key: ' ', code: 'Space' });
-                this.socket.emit('vm_input', { type: 'keyup', key: ' ', code: 'Space' });
+                this.sendInput({ type: 'keydown', key: ' ', code: 'Space' });
+                this.sendInput({ type: 'keyup', key: ' ', code: 'Space' });
             } else {
                 // Regular character
                 const code = this.getKeyCodeForChar(char);
-                this.socket.emit('vm_input', { type: 'keydown', key: char, code: code });
-                this.socket.emit('vm_input', { type: 'keyup', key: char, code: code });
+                this.sendInput({ type: 'keydown', key: char, code: code });
+                this.sendInput({ type: 'keyup', key: char, code: code });
             }
         },
         getKeyCodeForChar(char) {
@@ -1378,35 +1547,35 @@ Vue.component('vm-display', {
             // Handle special keys that might not trigger input events properly
             if (e.key === 'Enter' && !e.shiftKey) {
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Enter', code: 'Enter' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Enter', code: 'Enter' });
+                this.sendInput({ type: 'keydown', key: 'Enter', code: 'Enter' });
+                this.sendInput({ type: 'keyup', key: 'Enter', code: 'Enter' });
             } else if (e.key === 'Tab') {
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Tab', code: 'Tab' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Tab', code: 'Tab' });
+                this.sendInput({ type: 'keydown', key: 'Tab', code: 'Tab' });
+                this.sendInput({ type: 'keyup', key: 'Tab', code: 'Tab' });
             } else if (e.key === 'Backspace') {
                 // Always send backspace to VM, regardless of textarea content
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Backspace', code: 'Backspace' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Backspace', code: 'Backspace' });
+                this.sendInput({ type: 'keydown', key: 'Backspace', code: 'Backspace' });
+                this.sendInput({ type: 'keyup', key: 'Backspace', code: 'Backspace' });
                 // Don't prevent default - let textarea handle it for text tracking
             } else if (e.key === 'Escape') {
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Escape', code: 'Escape' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Escape', code: 'Escape' });
+                this.sendInput({ type: 'keydown', key: 'Escape', code: 'Escape' });
+                this.sendInput({ type: 'keyup', key: 'Escape', code: 'Escape' });
             } else if (e.key === 'Delete') {
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: 'Delete', code: 'Delete' });
-                this.socket.emit('vm_input', { type: 'keyup', key: 'Delete', code: 'Delete' });
+                this.sendInput({ type: 'keydown', key: 'Delete', code: 'Delete' });
+                this.sendInput({ type: 'keyup', key: 'Delete', code: 'Delete' });
             } else if (e.key.startsWith('Arrow')) {
                 // Handle arrow keys
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: e.key, code: e.code });
-                this.socket.emit('vm_input', { type: 'keyup', key: e.key, code: e.code });
+                this.sendInput({ type: 'keydown', key: e.key, code: e.code });
+                this.sendInput({ type: 'keyup', key: e.key, code: e.code });
             } else if (e.key === 'Home' || e.key === 'End' || e.key === 'PageUp' || e.key === 'PageDown') {
                 // Handle navigation keys
                 e.preventDefault();
-                this.socket.emit('vm_input', { type: 'keydown', key: e.key, code: e.code });
-                this.socket.emit('vm_input', { type: 'keyup', key: e.key, code: e.code });
+                this.sendInput({ type: 'keydown', key: e.key, code: e.code });
+                this.sendInput({ type: 'keyup', key: e.key, code: e.code });
             }
         },
         adjustPanForViewportChange(oldWidth, oldHeight, newWidth, newHeight) {
@@ -1463,64 +1632,64 @@ Vue.component('vm-display', {
         // --- Keyboard Shortcut Handling ---
         sendCtrlAltDel() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Alt', code: 'AltLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Delete', code: 'Delete' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Delete', code: 'Delete' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Alt', code: 'AltLeft' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keydown', key: 'Delete', code: 'Delete' });
+            this.sendInput({ type: 'keyup', key: 'Delete', code: 'Delete' });
+            this.sendInput({ type: 'keyup', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendPrintScreen() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'PrintScreen', code: 'PrintScreen' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'PrintScreen', code: 'PrintScreen' });
+            this.sendInput({ type: 'keydown', key: 'PrintScreen', code: 'PrintScreen' });
+            this.sendInput({ type: 'keyup', key: 'PrintScreen', code: 'PrintScreen' });
         },
         sendAltTab() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Alt', code: 'AltLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Tab', code: 'Tab' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Tab', code: 'Tab' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keydown', key: 'Alt', code: 'AltLeft' });
+            this.sendInput({ type: 'keydown', key: 'Tab', code: 'Tab' });
+            this.sendInput({ type: 'keyup', key: 'Tab', code: 'Tab' });
+            this.sendInput({ type: 'keyup', key: 'Alt', code: 'AltLeft' });
         },
         sendCtrlC() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'c', code: 'KeyC' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'c', code: 'KeyC' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'c', code: 'KeyC' });
+            this.sendInput({ type: 'keyup', key: 'c', code: 'KeyC' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendCtrlV() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'v', code: 'KeyV' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'v', code: 'KeyV' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'v', code: 'KeyV' });
+            this.sendInput({ type: 'keyup', key: 'v', code: 'KeyV' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendCtrlX() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'x', code: 'KeyX' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'x', code: 'KeyX' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'x', code: 'KeyX' });
+            this.sendInput({ type: 'keyup', key: 'x', code: 'KeyX' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendCtrlZ() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'z', code: 'KeyZ' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'z', code: 'KeyZ' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'z', code: 'KeyZ' });
+            this.sendInput({ type: 'keyup', key: 'z', code: 'KeyZ' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendCtrlY() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Control', code: 'ControlLeft' });
-            this.socket.emit('vm_input', { type: 'keydown', key: 'y', code: 'KeyY' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'y', code: 'KeyY' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'Control', code: 'ControlLeft' });
+            this.sendInput({ type: 'keydown', key: 'y', code: 'KeyY' });
+            this.sendInput({ type: 'keyup', key: 'y', code: 'KeyY' });
+            this.sendInput({ type: 'keyup', key: 'Control', code: 'ControlLeft' });
         },
         sendWindowsKey() {
             if (!this.connected) return;
-            this.socket.emit('vm_input', { type: 'keydown', key: 'Meta', code: 'MetaLeft' });
-            this.socket.emit('vm_input', { type: 'keyup', key: 'Meta', code: 'MetaLeft' });
+            this.sendInput({ type: 'keydown', key: 'Meta', code: 'MetaLeft' });
+            this.sendInput({ type: 'keyup', key: 'Meta', code: 'MetaLeft' });
         },
 
         // --- Power Management Methods ---
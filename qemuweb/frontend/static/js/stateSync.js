@@ -0,0 +1,87 @@
+// Local copy of the server's VM status for one subscription, kept current with
+// versioned JSON-patch deltas pushed over Socket.IO instead of polling.
+// onUpdate(state, names) is called with the whole { name: {field: value} } state
+// and the names that changed, or null after a full snapshot.
+class StateSync {
+    constructor(socket, id, { vms = null, fields = null } = {}, onUpdate = () => {}) {
+        this.socket = socket;
+        this.id = id;
+        this.vms = vms;
+        this.fields = fields;
+        this.onUpdate = onUpdate;
+        this.state = {};
+        this.version = null;
+        this.epoch = null;
+
+        this.handleConnect = () => this.subscribe();
+        this.handleSnapshot = (message) => {
+            if (message.id !== this.id) return;
+            this.state = message.vms;
+            this.version = message.version;
+            this.epoch = message.epoch;
+            this.onUpdate(this.state, null);
+        };
+        this.handlePatch = (message) => {
+            if (message.id !== this.id) return;
+            if (message.epoch !== this.epoch || message.from !== this.version) {
+                // Missed something (or the server restarted): ask for what is missing
+                this.subscribe();
+                return;
+            }
+            const names = new Set();
+            for (const op of message.ops) {
+                names.add(this.applyOp(op));
+            }
+            this.version = message.to;
+            this.onUpdate(this.state, names);
+        };
+
+        // Reconnects resubscribe with the last version and get only what changed meanwhile
+        socket.on('connect', this.handleConnect);
+        socket.on('state_snapshot', this.handleSnapshot);
+        socket.on('state_patch', this.handlePatch);
+        if (socket.connected) {
+            this.subscribe();
+        }
+    }
+
+    subscribe() {
+        this.socket.emit('state_subscribe', {
+            id: this.id, vms: this.vms, fields: this.fields, since: this.version, epoch: this.epoch
+        });
+    }
+
+    // Change what is subscribed to; the answer is a fresh snapshot
+    update({ vms = this.vms, fields = this.fields } = {}) {
+        this.vms = vms;
+        this.fields = fields;
+        this.version = null;
+        this.subscribe();
+    }
+
+    applyOp(op) {
+        const [name, field] = op.path.slice(1).split('/')
+            .map(part => part.replace(/~1/g, '/').replace(/~0/g, '~'));
+        if (field === undefined) {
+            if (op.op === 'remove') {
+                delete this.state[name];
+            } else {
+                this.state[name] = op.value;
+            }
+        } else if (this.state[name]) {
+            if (op.op === 'remove') {
+                delete this.state[name][field];
+            } else {
+                this.state[name][field] = op.value;
+            }
+        }
+        return name;
+    }
+
+    close() {
+        this.socket.off('connect', this.handleConnect);
+        this.socket.off('state_snapshot', this.handleSnapshot);
+        this.socket.off('state_patch', this.handlePatch);
+        this.socket.emit('state_unsubscribe', { id: this.id });
+    }
+}
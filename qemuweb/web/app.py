@@ -15,10 +15,20 @@ from ..config.manager import config, config_manager
 from ..core.machine import VMManager
 from ..core.capabilities import QEMUCapabilities
 from ..core.vnc import DisplayManager
+from ..core.recorder import RecordingManager
+from ..core.hub_monitor import HubLagMonitor
+from ..core.fleet import FleetManager
+from ..core.state_sync import StateSync
+from ..core.logs import LogStream
+from .json_provider import FastJSONProvider
 
 # Initialize SocketIO without an app
 socketio = SocketIO(logger=False, engineio_logger=False)
 
+def console_room(name: str) -> str:
+    """Socket.IO room of the clients watching a VM's serial console."""
+    return f'console:{name}'
+
 def setup_logging(app):
     """Configure logging for the application."""
     # Create logs directory if it doesn't exist
@@ -59,6 +69,7 @@ def create_app():
     app = Flask(__name__,
                 static_folder='../frontend/static',
                 template_folder='../frontend/templates')
+    app.json = FastJSONProvider(app)
 
     # Configure app
     app.config['SECRET_KEY'] = 'dev'  # Change this in production
@@ -81,12 +92,55 @@ def create_app():
         app.vm_manager = VMManager()
         app.display_manager = DisplayManager()
         app.qemu_capabilities = QEMUCapabilities()
+        app.hub_monitor = HubLagMonitor(
+            threshold_ms=config.get('metrics', {}).get('hub_lag_threshold_ms', 100)
+        )
+        app.hub_monitor.start()
+        recording_config = config.get('recording', {})
+        app.recording_manager = RecordingManager(
+            config_manager.recordings_dir,
+            keyframe_interval=recording_config.get('keyframe_interval', 10),
+            tile_size=recording_config.get('tile_size', 64),
+            compress_level=recording_config.get('compress_level', 1)
+        )
+        
+        fleet_config = config.get('fleet', {})
+        app.fleet_manager = FleetManager(
+            app.vm_manager,
+            parallelism=fleet_config.get('parallelism', 8),
+            ramp_interval=fleet_config.get('ramp_interval', 0.25),
+            start_timeout=fleet_config.get('start_timeout', 120),
+            progress_callback=lambda event, data: socketio.emit(event, data)
+        )
+        
+        # Status reaches clients as deltas for what they subscribed to, not full broadcasts
+        state_sync_config = config.get('state_sync', {})
+        app.state_sync = StateSync(
+            app.vm_manager,
+            emit=lambda event, data, sid: socketio.emit(event, data, room=sid),
+            history_seconds=state_sync_config.get('history_seconds', 300),
+            max_history=state_sync_config.get('max_history', 200000)
+        )
         
         # Set up VM manager callbacks
         app.vm_manager.set_callbacks(
-            status_callback=lambda status: socketio.emit('vm_status', status),
-            stopped_callback=lambda name: socketio.emit('vm_stopped', {'name': name})
+            stopped_callback=lambda name: socketio.emit('vm_stopped', {'name': name}),
+            event_callback=lambda event: socketio.emit('vm_event', event),
+            change_callback=app.state_sync.mark,
+            console_callback=lambda name, data, offset: socketio.emit(
+                'console_output',
+                {'name': name, 'data': data, 'offset': offset - len(data), 'next_offset': offset},
+                room=console_room(name)
+            )
+        )
+        app.state_sync.start()
+
+        # QEMU output is followed from where each client left off instead of re-read on polls
+        app.log_stream = LogStream(
+            app.vm_manager.logs,
+            emit=lambda event, data, sid: socketio.emit(event, data, room=sid)
         )
+        app.log_stream.start()
     
         # Register blueprints
         from .routes import bp as routes_bp
@@ -0,0 +1,36 @@
+import json
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up; the standard library encoder is used without it
+    orjson = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when it is installed.
+
+    Responses are compact and keys keep their insertion order. Anything
+    orjson cannot encode, and pretty-printed output in debug mode, falls
+    back to the standard provider.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is not None and set(kwargs) <= {'separators'}:
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Compact JSON as bytes, for payloads built outside a Flask response"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
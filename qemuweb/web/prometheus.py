@@ -0,0 +1,188 @@
+"""Prometheus text exposition of VM and qemuweb internal metrics.
+
+Everything here reads counters and cached samples that are already kept in
+memory, so a scrape costs no psutil or QMP calls.
+"""
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+
+from ..core.metrics import LatencyHistogram, HistogramSet
+
+Labels = Dict[str, str]
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsWriter:
+    """Accumulates metric families in the Prometheus text format."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Labels, float]]):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            if value is None:
+                continue
+            self.lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+    def gauge(self, name: str, help_text: str, samples: Iterable[Tuple[Labels, float]]):
+        self.metric(name, 'gauge', help_text, samples)
+
+    def counter(self, name: str, help_text: str, samples: Iterable[Tuple[Labels, float]]):
+        self.metric(name, 'counter', help_text, samples)
+
+    def histogram(self, name: str, help_text: str, series: Iterable[Tuple[Labels, LatencyHistogram]]):
+        """Write millisecond LatencyHistograms as a histogram in seconds"""
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            for bound, cumulative in histogram.cumulative_buckets():
+                le = '+Inf' if bound == math.inf else _number(bound / 1000)
+                self.lines.append(f'{name}_bucket{_labels(dict(labels, le=le))} {cumulative}')
+            self.lines.append(f'{name}_sum{_labels(labels)} {_number(histogram.sum / 1000)}')
+            self.lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+def _merged(histograms: Iterable[LatencyHistogram]) -> LatencyHistogram:
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
+
+class DisplayTotals:
+    """Counters and latency of closed display sessions, per VM.
+
+    Each session is folded in when it closes, so the exported totals keep
+    counting after a viewer disconnects instead of going down.
+    """
+
+    COUNTERS = ('frames_captured', 'frames_encoded', 'frames_sent', 'frames_dropped', 'vnc_bytes_received')
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.latency: Dict[str, HistogramSet] = {}
+
+    def add(self, display):
+        if not display.vm_name:
+            return
+        counters = self.counters.setdefault(display.vm_name, dict.fromkeys(self.COUNTERS, 0))
+        for attribute in self.COUNTERS:
+            counters[attribute] += getattr(display, attribute)
+        latency = self.latency.setdefault(display.vm_name, HistogramSet())
+        for stage, histogram in display.latency.histograms.items():
+            latency.histograms.setdefault(stage, LatencyHistogram()).merge(histogram)
+
+def socketio_queue_depths(sio) -> Tuple[int, int]:
+    """(connected clients, messages queued for them) from the Engine.IO server"""
+    eio = getattr(getattr(sio, 'server', None), 'eio', None)
+    sockets = list(getattr(eio, 'sockets', {}).values())
+    depth = 0
+    for socket in sockets:
+        queue = getattr(socket, 'queue', None)
+        if queue is not None:
+            depth += queue.qsize()
+    return len(sockets), depth
+
+def render_metrics(vm_manager, displays: Dict[str, Any], sio=None, hub_monitor=None,
+                   closed: Optional[DisplayTotals] = None) -> str:
+    writer = MetricsWriter()
+    names = list(vm_manager.vms)
+    samples = {name: vm_manager.sampler.get(name) for name in names}
+
+    def per_vm(field: str, scale: float = 1.0):
+        for name in names:
+            sample = samples[name]
+            if sample and field in sample:
+                yield {'vm': name}, sample[field] * scale
+
+    writer.gauge('qemuweb_vm_running', 'Whether the VM process is running',
+                 (({'vm': name}, 1 if vm_manager.processes.get(name) is not None else 0) for name in names))
+    writer.gauge('qemuweb_vm_cpu_percent', 'QEMU process CPU usage (100 = one core)', per_vm('cpu_percent'))
+    writer.gauge('qemuweb_vm_rss_bytes', 'QEMU process resident memory', per_vm('rss_bytes'))
+    writer.gauge('qemuweb_vm_threads', 'QEMU process thread count', per_vm('num_threads'))
+    writer.counter('qemuweb_vm_vcpu_seconds_total', 'CPU time used by the vCPU threads', per_vm('vcpu_time_s'))
+    writer.counter('qemuweb_vm_block_read_bytes_total', 'Bytes read by the guest from its block devices',
+                   per_vm('disk_read_bytes'))
+    writer.counter('qemuweb_vm_block_write_bytes_total', 'Bytes written by the guest to its block devices',
+                   per_vm('disk_write_bytes'))
+    writer.counter('qemuweb_vm_io_read_bytes_total', 'Bytes read from storage by the QEMU process',
+                   per_vm('io_read_bytes'))
+    writer.counter('qemuweb_vm_io_write_bytes_total', 'Bytes written to storage by the QEMU process',
+                   per_vm('io_write_bytes'))
+
+    # Display sessions, aggregated per VM
+    by_vm: Dict[str, List[Any]] = defaultdict(list)
+    for display in list(displays.values()):
+        if display.vm_name:
+            by_vm[display.vm_name].append(display)
+
+    closed = closed or DisplayTotals()
+    display_vms = sorted(set(by_vm) | set(closed.counters))
+
+    def display_total(attribute: str):
+        for name in display_vms:
+            previous = closed.counters.get(name, {}).get(attribute, 0)
+            yield {'vm': name}, previous + sum(getattr(display, attribute) for display in by_vm.get(name, ()))
+
+    writer.gauge('qemuweb_vm_display_viewers', 'Open display sessions',
+                 (({'vm': name}, len(by_vm.get(name, ()))) for name in names))
+    writer.counter('qemuweb_display_frames_captured_total', 'Frames read from the VNC server',
+                   display_total('frames_captured'))
+    writer.counter('qemuweb_display_frames_encoded_total', 'Changed frames encoded to JPEG',
+                   display_total('frames_encoded'))
+    writer.counter('qemuweb_display_frames_sent_total', 'Frames emitted to browsers', display_total('frames_sent'))
+    writer.counter('qemuweb_display_frames_dropped_total', 'Encoded frames that failed to emit',
+                   display_total('frames_dropped'))
+    writer.counter('qemuweb_display_vnc_received_bytes_total', 'Bytes received from VNC servers',
+                   display_total('vnc_bytes_received'))
+
+    stage_series = []
+    for name in display_vms:
+        sets = [display.latency for display in by_vm.get(name, ())]
+        if name in closed.latency:
+            sets.append(closed.latency[name])
+        for stage in sorted({stage for latency in sets for stage in latency.histograms}):
+            stage_series.append(({'vm': name, 'stage': stage},
+                                 _merged(latency.histograms[stage] for latency in sets
+                                         if stage in latency.histograms)))
+    writer.histogram('qemuweb_display_stage_seconds', 'Display pipeline stage latency', stage_series)
+
+    # Internals
+    if sio is not None:
+        clients, depth = socketio_queue_depths(sio)
+        writer.gauge('qemuweb_socketio_clients', 'Connected Socket.IO clients', [({}, clients)])
+        writer.gauge('qemuweb_socketio_queue_depth', 'Messages queued for Socket.IO clients', [({}, depth)])
+
+    sessions = list(vm_manager.qmp_sessions.values())
+    writer.histogram('qemuweb_qmp_command_seconds', 'QMP command round trip time',
+                     [({}, _merged([vm_manager.qmp_latency] + [session.latency for session in sessions]))])
+    writer.gauge('qemuweb_qmp_connected', 'Connected QMP sessions',
+                 [({}, sum(1 for session in sessions if session.connected))])
+    writer.gauge('qemuweb_sampler_pass_seconds', 'Duration of the last metrics sampling pass',
+                 [({}, vm_manager.sampler.last_pass_ms / 1000)])
+
+    if hub_monitor is not None:
+        writer.gauge('qemuweb_hub_lag_last_seconds', 'Most recent eventlet hub scheduling lag',
+                     [({}, hub_monitor.last_lag_ms / 1000)])
+        writer.histogram('qemuweb_hub_lag_seconds', 'Eventlet hub scheduling lag', [({}, hub_monitor.lag)])
+        writer.counter('qemuweb_hub_stalls_total', 'Times the hub lag exceeded the blocking threshold',
+                       [({}, hub_monitor.stalls)])
+
+    return writer.render()
@@ -1,7 +1,7 @@
-from flask import Blueprint, render_template, jsonify, request, send_from_directory, current_app
-from flask_socketio import emit
+from flask import Blueprint, render_template, jsonify, request, send_from_directory, current_app, Response
+from flask_socketio import emit, join_room, leave_room
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 import eventlet
 import logging
 import signal
@@ -9,51 +9,62 @@ import platform
 import psutil
 import sys
 import atexit
+import hmac
+from urllib.parse import urlencode
+from functools import wraps
+from eventlet import tpool
 from eventlet.greenthread import GreenThread
 
-from .app import socketio, create_app
+from .app import socketio, create_app, console_room
 from ..core.machine import VMConfig
 from ..core.display import VMDisplay
-from ..config.manager import config_manager
+from ..core.recorder import PlaybackSession, encode_jpeg
+from ..core.profiler import SamplingProfiler, ProfilerBusy
+from ..core.logs import DEFAULT_CHUNK, MAX_CHUNK
+from .prometheus import render_metrics, DisplayTotals
+from .json_provider import dumps_bytes
+from ..config.manager import config, config_manager
 
 bp = Blueprint('main', __name__)
 
 # Store active display connections
 vm_displays: Dict[str, VMDisplay] = {}
+# Totals of display sessions that have closed, for /metrics
+closed_displays = DisplayTotals()
+# Recording playback sessions, keyed by Socket.IO session
+playbacks: Dict[str, PlaybackSession] = {}
 shutdown_event = eventlet.event.Event()
+profiler = SamplingProfiler()
 
-def stop_vm_process(vm_name: str, process, timeout: int = 5):
-    """Helper function to stop a VM process."""
-    try:
-        logging.info(f"Stopping VM: {vm_name}")
-        # First try graceful shutdown
-        process.terminate()
-        try:
-            process.wait(timeout=timeout)
-            return True
-        except:
-            logging.warning(f"VM {vm_name} did not stop gracefully, forcing...")
-            process.kill()
-            process.wait(timeout=1)
-            return True
-    except Exception as e:
-        logging.error(f"Error stopping VM {vm_name}: {e}")
-        return False
+# Top-level keys of a VM status that ?fields= may select, besides config.<key>
+VM_LIST_FIELDS = {'name', 'running', 'state', 'error', 'config', 'display',
+                  'cpu_usage', 'memory_mb', 'threads', 'sampled_at'}
+# Keys that change with every metrics sample rather than with the inventory
+VM_METRIC_FIELDS = {'cpu_usage', 'memory_mb', 'threads', 'sampled_at'}
+
+def admin_required(view):
+    """Allow a view only with the configured admin token, or from localhost if none is set."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = config.get('admin', {}).get('token')
+        if token:
+            header = request.headers.get('Authorization', '')
+            supplied = (header[7:] if header.startswith('Bearer ') else header).strip()
+            if not hmac.compare_digest(supplied.encode(), token.encode()):
+                return jsonify({'error': 'Admin token required'}), 403
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({'error': 'Only available from localhost unless admin.token is configured'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 def cleanup_resources():
     """Clean up all resources."""
     if not current_app:
         return
         
-    # Stop all VMs first
+    # Stop all VMs first, in parallel
     if hasattr(current_app, 'vm_manager'):
-        logging.info("Stopping all VMs...")
-        # Get list of running VMs
-        running_vms = [(name, vm) for name, vm in current_app.vm_manager.processes.items() if vm.poll() is None]
-        
-        # Stop each VM
-        for vm_name, process in running_vms:
-            stop_vm_process(vm_name, process)
+        current_app.vm_manager.shutdown_all()
             
     # Clean up display connections
     for session_id, display in list(vm_displays.items()):
@@ -64,6 +75,14 @@ def cleanup_resources():
         except Exception as e:
             logging.error(f"Error cleaning up display for session {session_id}: {e}")
     vm_displays.clear()
+    
+    for playback in list(playbacks.values()):
+        playback.stop()
+    playbacks.clear()
+    
+    # Close recordings so their last frames and index entries are flushed
+    if hasattr(current_app, 'recording_manager'):
+        current_app.recording_manager.stop_all()
 
 def signal_handler(signo, frame):
     """Handle shutdown signals."""
@@ -95,6 +114,13 @@ def index():
     """Render the main application page."""
     return render_template('index.html')
 
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of VM and qemuweb metrics."""
+    text = render_metrics(current_app.vm_manager, vm_displays, socketio, current_app.hub_monitor,
+                          closed_displays)
+    return Response(text, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @bp.route('/api/system/info', methods=['GET'])
 def get_system_info():
     """Get system information."""
@@ -112,10 +138,137 @@ def get_system_info():
         logging.error(f"Error getting system info: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/system/hub', methods=['GET'])
+def get_hub_stats():
+    """Event loop lag and the call sites that blocked it the longest."""
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(current_app.hub_monitor.get_stats(limit))
+
+@bp.route('/api/system/profile', methods=['GET'])
+@admin_required
+def profile_server():
+    """Sample the stacks of every thread and greenlet for a few seconds."""
+    seconds = request.args.get('seconds', 5, type=float)
+    interval_ms = request.args.get('interval_ms', 5, type=float)
+    output = request.args.get('format', 'collapsed')
+    vm_name = request.args.get('vm')
+    if output not in ('collapsed', 'speedscope'):
+        return jsonify({'error': "format must be 'collapsed' or 'speedscope'"}), 400
+    if not 0 < seconds <= SamplingProfiler.MAX_DURATION or not 1 <= interval_ms <= 1000:
+        return jsonify({'error': f'seconds must be in (0, {SamplingProfiler.MAX_DURATION:g}] '
+                                 'and interval_ms in [1, 1000]'}), 400
+
+    scope_frames = None
+    if vm_name:
+        # Only the display pipelines streaming this VM
+        scope_frames = {display.stream_frame for display in list(vm_displays.values())
+                        if display.vm_name == vm_name and display.stream_frame is not None}
+        if not scope_frames:
+            return jsonify({'error': f'No active display for VM {vm_name}'}), 404
+
+    try:
+        # The sampler blocks, so it runs on a native thread while this greenlet waits
+        result = tpool.execute(profiler.run, seconds, interval_ms / 1000, scope_frames,
+                               f'display {vm_name}' if vm_name else None)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+
+    logging.info(f"Profiled for {result.duration:.1f}s: {result.total_samples} samples"
+                 + (f" scoped to VM {vm_name}" if vm_name else ""))
+    if output == 'speedscope':
+        return jsonify(result.speedscope())
+    return Response(result.collapsed(), mimetype='text/plain')
+
+def _project_status(status: Dict, fields) -> Dict:
+    """Only the requested keys of a VM status; 'config.<key>' picks single config entries."""
+    projected = {'name': status['name']}
+    for field in fields:
+        if field.startswith('config.'):
+            if 'config' in fields:
+                continue  # Already whole; never add to the shared, cached config dict
+            key = field[len('config.'):]
+            if key in status['config']:
+                projected.setdefault('config', {})[key] = status['config'][key]
+        elif field in status:
+            projected[field] = status[field]
+    return projected
+
 @bp.route('/api/vms', methods=['GET'])
 def list_vms():
-    """List all VMs."""
-    return jsonify(current_app.vm_manager.get_all_vms())
+    """List VMs with their status.
+
+    Query parameters, all optional:
+      arch, tag     filter on the VM registry's indexes
+      state         a run state, or several separated by commas
+      fields        comma separated status keys to return (name is always
+                    included), e.g. ``name,state,config.arch``
+      limit, cursor page through the list; the cursor for the next page is
+                    in the X-Next-Cursor header and a Link rel="next"
+      format=ndjson stream one VM per line (also Accept: application/x-ndjson)
+
+    Responses carry a weak ETag of the inventory version and representation
+    (with Vary: Accept) and answer 304 Not Modified to a matching
+    If-None-Match without building the list.
+    """
+    manager = current_app.vm_manager
+    args = request.args
+
+    fields = None
+    if args.get('fields'):
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in VM_LIST_FIELDS and not field.startswith('config.')]
+        if unknown:
+            return jsonify({'success': False, 'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    try:
+        limit = int(args['limit']) if args.get('limit') else None
+        cursor = int(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit and cursor must be integers'}), 400
+    if limit is not None and limit < 1:
+        return jsonify({'success': False, 'error': 'limit must be at least 1'}), 400
+
+    ndjson = args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+    # Taken before listing, so a change made meanwhile shows up as a new version next time.
+    # The two representations differ in bytes, so they never share a tag
+    include_metrics = fields is None or not VM_METRIC_FIELDS.isdisjoint(fields)
+    etag = manager.inventory_version(include_metrics) + ('.ndjson' if ndjson else '')
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept'}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    states = [state for state in args.get('state', '').split(',') if state]
+    names, next_cursor = manager.list_vm_names(arch=args.get('arch'), tag=args.get('tag'),
+                                               states=states, after=cursor, limit=limit)
+    if next_cursor is not None:
+        query = args.to_dict()
+        query['cursor'] = str(next_cursor)
+        headers['X-Next-Cursor'] = str(next_cursor)
+        headers['Link'] = f'<{request.base_url}?{urlencode(query)}>; rel="next"'
+
+    def statuses():
+        for name in names:
+            status = manager.get_vm_status(name)
+            if status:
+                yield status if fields is None else _project_status(status, fields)
+
+    if ndjson:
+        def lines(batch_size: int = 100):
+            # Statuses are built as they are sent, so memory stays flat however large the fleet
+            batch = []
+            for status in statuses():
+                batch.append(dumps_bytes(status))
+                if len(batch) >= batch_size:
+                    yield b'\n'.join(batch) + b'\n'
+                    batch = []
+            if batch:
+                yield b'\n'.join(batch) + b'\n'
+        return Response(lines(), mimetype='application/x-ndjson', headers=headers)
+
+    response = jsonify(list(statuses()))
+    response.headers.extend(headers)
+    return response
 
 @bp.route('/api/vms', methods=['POST'])
 def create_vm():
@@ -138,6 +291,60 @@ def delete_vm(name: str):
     logging.error(f"Failed to delete VM {name}: {error_msg}")
     return jsonify({'success': False, 'error': error_msg}), 404
 
+def _bulk_request_error(data: Any) -> Optional[str]:
+    """Why a bulk action request body is malformed, or None"""
+    if not isinstance(data, dict):
+        return 'Request body must be a JSON object'
+    if 'names' not in data and 'selector' not in data:
+        return "Provide 'names' or 'selector'"
+    names = data.get('names')
+    if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+        return "'names' must be a list of VM names"
+    if data.get('selector') is not None and not isinstance(data['selector'], dict):
+        return "'selector' must be an object"
+    parallelism = data.get('parallelism')
+    if parallelism is not None and (isinstance(parallelism, bool) or not isinstance(parallelism, int)
+                                    or parallelism <= 0):
+        return "'parallelism' must be a positive integer"
+    ramp_interval = data.get('ramp_interval')
+    if ramp_interval is not None and (isinstance(ramp_interval, bool) or not isinstance(ramp_interval, (int, float))
+                                      or not 0 <= ramp_interval < float('inf')):
+        return "'ramp_interval' must be a non-negative number of seconds"
+    return None
+
+# Under /api/bulk rather than /api/vms/bulk, which would shadow the routes of a VM named "bulk"
+@bp.route('/api/bulk/<action>', methods=['POST'])
+def bulk_action(action: str):
+    """Run start/stop/shutdown/reset/restart/poweroff over many VMs; progress arrives as bulk_progress events."""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    error = _bulk_request_error(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    fleet = current_app.fleet_manager
+    try:
+        names = fleet.select(data.get('names'), data.get('selector'))
+        operation = fleet.submit(action, names, data.get('parallelism'), data.get('ramp_interval'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'operation': operation.to_dict()}), 202
+
+@bp.route('/api/bulk/<operation_id>', methods=['GET'])
+def get_bulk_operation(operation_id: str):
+    """Progress of a bulk operation."""
+    operation = current_app.fleet_manager.get(operation_id)
+    if not operation:
+        return jsonify({'error': 'Operation not found'}), 404
+    return jsonify(operation.to_dict())
+
+@bp.route('/api/bulk/<operation_id>/cancel', methods=['POST'])
+def cancel_bulk_operation(operation_id: str):
+    """Stop launching further actions of a bulk operation."""
+    if current_app.fleet_manager.cancel(operation_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': 'Operation not found or already finished'}), 404
+
 @bp.route('/api/vms/<name>/start', methods=['POST'])
 def start_vm(name: str):
     """Start a VM."""
@@ -202,6 +409,28 @@ def get_vm_status(name: str):
     logging.error(error_msg)
     return jsonify({'success': False, 'error': error_msg}), 404
 
+@bp.route('/api/vms/<name>/metrics', methods=['GET'])
+def get_vm_metrics(name: str):
+    """Get a VM's metrics history.
+    
+    ?since= is a unix timestamp (default: 10 minutes ago), ?step= the
+    bucket size in seconds (default: the finest resolution available).
+    """
+    if not current_app.vm_manager.get_vm(name):
+        return jsonify({'success': False, 'error': 'VM not found'}), 404
+    # Converted by hand: request.args.get(type=...) turns invalid values into None
+    since = request.args.get('since')
+    step = request.args.get('step')
+    try:
+        since = float(since) if since is not None else None
+        step = int(step) if step is not None else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid since or step'}), 400
+    metrics = current_app.vm_manager.history.query(name, since, step)
+    if metrics is None:
+        return jsonify({'success': True, 'step': None, 'timestamps': [], 'series': {}})
+    return jsonify(dict(metrics, success=True))
+
 @bp.route('/api/browse', methods=['GET'])
 def browse_files():
     """Browse files in a directory."""
@@ -227,22 +456,25 @@ def get_qemu_capabilities():
 
 @bp.route('/api/vms/<name>/logs', methods=['GET'])
 def get_vm_logs(name: str):
-    """Get VM logs."""
+    """Get a chunk of the VM's newest log, rotated segments included.
+
+    ``offset`` continues from the ``next_offset`` of a previous response;
+    without it the last ``max_bytes`` are returned. A different ``file`` in
+    the response, or ``reset``, means the VM started a new log.
+    """
     try:
-        # Get all log files for this VM, sorted by timestamp (newest first)
-        log_files = sorted(
-            config_manager.logs_dir.glob(f'{name}_*.log'),
-            key=lambda x: x.stat().st_mtime,
-            reverse=True
-        )
-        
-        if log_files:
-            # Read the most recent log file
-            with open(log_files[0], 'r') as f:
-                logs = f.readlines()
-            return jsonify({'success': True, 'logs': logs})
-        
-        return jsonify({'success': True, 'logs': []})
+        offset = int(request.args['offset']) if request.args.get('offset') else None
+        max_bytes = int(request.args['max_bytes']) if request.args.get('max_bytes') else DEFAULT_CHUNK
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset and max_bytes must be integers'}), 400
+    if offset is not None and offset < 0 or not 0 < max_bytes <= MAX_CHUNK:
+        return jsonify({'success': False,
+                         'error': f'offset must not be negative, max_bytes between 1 and {MAX_CHUNK}'}), 400
+    try:
+        chunk = current_app.vm_manager.logs.read(name, offset, max_bytes)
+        if chunk is None:
+            return jsonify({'success': True, 'logs': [], 'file': None, 'offset': 0, 'next_offset': 0, 'size': 0})
+        return jsonify(dict(chunk, success=True))
     except Exception as e:
         current_app.logger.error(f"Error reading logs for VM {name}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -262,11 +494,77 @@ def get_vm_display(name: str):
     }
     return jsonify(display_info)
 
+@bp.route('/api/vms/<name>/display/stats', methods=['GET'])
+def get_vm_display_stats(name: str):
+    """Get statistics for every open display session of a VM."""
+    if not current_app.vm_manager.get_vm(name):
+        return jsonify({'success': False, 'error': 'VM not found'}), 404
+    
+    sessions = [
+        dict(display.get_stats(), session_id=session_id)
+        for session_id, display in list(vm_displays.items())
+        if display.vm_name == name
+    ]
+    return jsonify({'success': True, 'sessions': sessions})
+
 @bp.route('/vm/<vm_id>/display')
 def vm_display(vm_id):
     """Render the VM display page."""
     return render_template('vm_display.html', vm_id=vm_id)
 
+@bp.route('/vm/<vm_id>/recordings/<recording_id>')
+def vm_recording(vm_id, recording_id):
+    """Render the VM display page in playback mode."""
+    return render_template('vm_display.html', vm_id=vm_id, recording_id=recording_id)
+
+@bp.route('/api/vms/<name>/recording', methods=['GET'])
+def get_recording_status(name: str):
+    """Get the recording status of a VM."""
+    if not current_app.vm_manager.get_vm(name):
+        return jsonify({'success': False, 'error': 'VM not found'}), 404
+    return jsonify(dict(current_app.recording_manager.status(name), success=True))
+
+@bp.route('/api/vms/<name>/recording/start', methods=['POST'])
+def start_recording(name: str):
+    """Start recording a VM's console."""
+    if not current_app.vm_manager.get_vm(name):
+        return jsonify({'success': False, 'error': 'VM not found'}), 404
+    try:
+        recording_id = current_app.recording_manager.start(name)
+        return jsonify({'success': True, 'id': recording_id})
+    except OSError as e:
+        error_msg = f"Failed to start recording VM {name}: {str(e)}"
+        logging.error(error_msg)
+        return jsonify({'success': False, 'error': error_msg}), 500
+
+@bp.route('/api/vms/<name>/recording/stop', methods=['POST'])
+def stop_recording(name: str):
+    """Stop recording a VM's console."""
+    if current_app.recording_manager.stop(name):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': f"VM {name} is not being recorded"}), 400
+
+@bp.route('/api/vms/<name>/recordings', methods=['GET'])
+def list_recordings(name: str):
+    """List the console recordings of a VM, newest first."""
+    return jsonify({'success': True, 'recordings': current_app.recording_manager.list_recordings(name)})
+
+@bp.route('/api/vms/<name>/recordings/<recording_id>/frame', methods=['GET'])
+def get_recording_frame(name: str, recording_id: str):
+    """Get the screen at ?t= seconds into a recording as a JPEG."""
+    reader = current_app.recording_manager.open(name, recording_id)
+    if not reader:
+        return jsonify({'success': False, 'error': 'Recording not found'}), 404
+    try:
+        offset = float(request.args.get('t', 0))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid time offset'}), 400
+    # Decoding and encoding run in tpool so a large recording never stalls the hub
+    frame = tpool.execute(reader.frame_at, offset)
+    if frame is None:
+        return jsonify({'success': False, 'error': 'Recording has no frames'}), 404
+    return Response(tpool.execute(encode_jpeg, frame), mimetype='image/jpeg')
+
 @bp.route('/api/disks/create', methods=['POST'])
 def create_disk():
     """Create a new blank disk image using qemu-img."""
@@ -303,29 +601,33 @@ def handle_init_display(data):
         emit('error', {'message': 'No VM ID provided'})
         return
         
-    # Get VM config and create display
-    all_vms = current_app.vm_manager.get_all_vms()
-    vm = next((vm for vm in all_vms if vm.get('name') == vm_id), None)
+    # Look up just this VM (by name or UUID) and its display port
+    vm, port = current_app.vm_manager.get_display_port(vm_id)
     if not vm:
         logging.error(f'VM not found: {vm_id}')
         emit('error', {'message': 'VM not found'})
         return
+    vm_id = vm.name
         
-    # Get display info
-    display_info = vm.get('display', {})
-    if not display_info or not display_info.get('port'):
+    if not port:
         logging.error(f'Display not configured for VM: {vm_id}')
         emit('error', {'message': 'VM display not configured'})
         return
         
     try:
         # Create display handler
-        port = display_info['port']
         logging.info(f'Creating display handler for port {port}')
-        display = VMDisplay(host='localhost', port=port)
+        display = VMDisplay(host='localhost', port=port, vm_name=vm_id,
+                            recording_manager=current_app.recording_manager)
         
         # Store the display before spawning the thread
+        previous = vm_displays.get(session_id)
         vm_displays[session_id] = display
+        if previous is not None:
+            # Re-initialized from the same session: retire the old stream
+            previous.stop_streaming()
+            eventlet.spawn_after(0, previous.disconnect)
+            closed_displays.add(previous)
         
         def _connect_and_stream():
             try:
@@ -341,14 +643,136 @@ def handle_init_display(data):
         logging.error(f'Error initializing display: {e}', exc_info=True)
         emit('error', {'message': f'Display initialization failed: {str(e)}'})
 
+@socketio.on('init_playback')
+def handle_init_playback(data):
+    """Start streaming a recording to this session as vm_frame events."""
+    session_id = request.sid
+    vm_id = data.get('vm_id')
+    reader = current_app.recording_manager.open(vm_id, data.get('recording_id', '')) if vm_id else None
+    if not reader:
+        emit('error', {'message': 'Recording not found'})
+        return
+    
+    if session_id in playbacks:
+        playbacks.pop(session_id).stop()
+    playback = PlaybackSession(reader)
+    playback.seek(data.get('t', 0))
+    playbacks[session_id] = playback
+    eventlet.spawn(playback.run, socketio, session_id)
+    logging.info(f"Playing recording {reader.path.stem} of VM {vm_id}")
+
+@socketio.on('playback_control')
+def handle_playback_control(data):
+    """Seek, pause or resume this session's playback."""
+    playback = playbacks.get(request.sid)
+    if not playback:
+        return
+    if 't' in data:
+        playback.seek(data['t'])
+    if 'playing' in data:
+        playback.set_playing(bool(data['playing']))
+
+@socketio.on('state_subscribe')
+def handle_state_subscribe(data):
+    """Subscribe to status changes of some VMs and fields.
+
+    ``{id, vms, fields, since, epoch}``: ``vms`` and ``fields`` default to
+    all; ``since``/``epoch`` from the last update received ask for a catch-up
+    instead of a snapshot. Answers with 'state_snapshot' or 'state_patch',
+    after which 'state_patch' events follow as values change.
+    """
+    data = data if isinstance(data, dict) else {}
+    vms, fields, since = data.get('vms'), data.get('fields'), data.get('since')
+    if vms is not None and not isinstance(vms, list) or fields is not None and not isinstance(fields, list) \
+            or since is not None and not isinstance(since, int):
+        emit('error', {'message': 'vms and fields must be lists, since an integer'})
+        return
+    try:
+        event, payload = current_app.state_sync.subscribe(request.sid, str(data.get('id', 'default')),
+                                                          vms, fields, since, data.get('epoch'))
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    emit(event, payload)
+
+@socketio.on('state_unsubscribe')
+def handle_state_unsubscribe(data):
+    """Drop one state subscription of this client, by id."""
+    if isinstance(data, dict) and data.get('id') is not None:
+        current_app.state_sync.unsubscribe(request.sid, str(data['id']))
+
+@socketio.on('log_follow')
+def handle_log_follow(data):
+    """Stream a VM's log as 'vm_log' events.
+
+    ``{name, file, offset}``: ``file`` and ``offset`` from the last 'vm_log'
+    received resume from there, otherwise the stream starts with the tail.
+    """
+    data = data if isinstance(data, dict) else {}
+    name, offset = data.get('name'), data.get('offset')
+    if not isinstance(name, str) or offset is not None and (not isinstance(offset, int) or offset < 0):
+        emit('error', {'message': 'name must be a string, offset a non-negative integer'})
+        return
+    file = data.get('file') if isinstance(data.get('file'), str) else None
+    current_app.log_stream.follow(request.sid, name, file, offset)
+
+@socketio.on('log_unfollow')
+def handle_log_unfollow(data):
+    """Stop streaming one VM's log to this client, or all of them."""
+    name = data.get('name') if isinstance(data, dict) else None
+    current_app.log_stream.unfollow(request.sid, name if isinstance(name, str) else None)
+
+@socketio.on('console_open')
+def handle_console_open(data):
+    """Attach to a headless VM's serial console.
+
+    ``{name, offset}``: answers with a 'console_output' of the scrollback,
+    or only what followed ``offset`` from a previous 'console_output'; live
+    output follows as further 'console_output' events.
+    """
+    data = data if isinstance(data, dict) else {}
+    offset = data.get('offset')
+    if offset is not None and not isinstance(offset, int):
+        emit('error', {'message': 'offset must be an integer'})
+        return
+    vm = current_app.vm_manager.find_vm(str(data.get('name', '')))
+    console = current_app.vm_manager.consoles.get(vm.name) if vm else None
+    if console is None:
+        emit('error', {'message': f"No serial console for VM {data.get('name')}"})
+        return
+    # Join first: output arriving meanwhile is sent twice rather than lost, clients skip it by offset
+    join_room(console_room(vm.name))
+    start, output, reset = console.history(offset)
+    emit('console_output', {'name': vm.name, 'data': output, 'offset': start,
+                            'next_offset': start + len(output), 'reset': reset, 'scrollback': True})
+
+@socketio.on('console_input')
+def handle_console_input(data):
+    """Keystrokes for a headless VM's serial console, as ``{name, data}``."""
+    if not isinstance(data, dict) or not isinstance(data.get('data'), str):
+        return
+    if not current_app.vm_manager.console_write(str(data.get('name', '')), data['data'][:4096].encode('utf-8')):
+        emit('error', {'message': f"Serial console of VM {data.get('name')} is not connected"})
+
+@socketio.on('console_close')
+def handle_console_close(data):
+    """Stop receiving a VM's serial console output."""
+    if isinstance(data, dict) and isinstance(data.get('name'), str):
+        leave_room(console_room(data['name']))
+
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle socket disconnections."""
+    current_app.state_sync.unsubscribe(request.sid)
+    current_app.log_stream.unfollow(request.sid)
     if request.sid in vm_displays:
         display = vm_displays[request.sid]
         display.stop_streaming()
         eventlet.spawn_after(0, display.disconnect)
         del vm_displays[request.sid]
+        closed_displays.add(display)
+    if request.sid in playbacks:
+        playbacks.pop(request.sid).stop()
     logging.info('Client disconnected')
 
 @socketio.on('vm_input')
@@ -360,6 +784,18 @@ def handle_vm_input(data):
         
     display = vm_displays[request.sid]
     try:
-        eventlet.spawn_after(0, display.handle_input, data['type'], data)
+        # Handled inline: this only queues the event for the display's input pump,
+        # which writes it ahead of any frame processing
+        display.handle_input(data['type'], data)
     except Exception as e:
-        logging.error(f'Error handling input event: {e}') 
\ No newline at end of file
+        logging.error(f'Error handling input event: {e}') 
+
+@socketio.on('display_metrics')
+def handle_display_metrics(data):
+    """Record decode/paint latency samples reported by the browser."""
+    display = vm_displays.get(request.sid)
+    if not display:
+        return
+    samples = data.get('samples') if isinstance(data, dict) else None
+    if isinstance(samples, list):
+        display.record_client_metrics(samples[:500])
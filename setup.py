@@ -15,7 +15,6 @@ setup(
         "numpy==1.25.2",
         "pillow==10.0.0",
         "psutil==5.9.5",
-        "dataclasses-json==0.6.1",
         "websockify>=0.11.0",
         "click",
     ],
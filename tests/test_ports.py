@@ -0,0 +1,112 @@
+import pytest
+
+from qemuweb.core.ports import PortAllocator, PortError, PortPool
+
+def test_first_free_finds_lowest_clear_bit():
+    pool = PortPool(5900, 8)
+    assert pool.first_free() == 0
+    pool.set(0)
+    pool.set(1)
+    pool.set(3)
+    assert pool.first_free() == 2
+    assert pool.first_free(after=2) == 4
+    pool.clear(1)
+    assert pool.first_free() == 1
+
+def test_first_free_skips_external_and_reports_full():
+    pool = PortPool(5900, 3)
+    pool.external = 0b010
+    pool.set(0)
+    assert pool.first_free() == 2
+    pool.set(2)
+    assert pool.first_free() is None
+
+def test_first_free_in_a_large_pool():
+    pool = PortPool(10000, 5000)
+    for index in range(4999):
+        pool.set(index)
+    assert pool.first_free() == 4999
+    pool.set(4999)
+    assert pool.first_free() is None
+
+def test_allocate_hands_out_lowest_free_port():
+    ports = PortAllocator({'vnc': (5900, 4)}, verify=False)
+    assert ports.allocate('vnc', 'a') == 5900
+    assert ports.allocate('vnc', 'b') == 5901
+    assert ports.allocate('vnc', 'a') == 5900  # Already holds one
+    assert ports.release('a') == {'vnc': 5900}
+    assert ports.allocate('vnc', 'c') == 5900
+    assert ports.usage()['vnc']['used'] == 2
+
+def test_allocate_raises_when_exhausted():
+    ports = PortAllocator({'vnc': (5900, 2)}, verify=False)
+    ports.allocate('vnc', 'a')
+    ports.allocate('vnc', 'b')
+    with pytest.raises(PortError):
+        ports.allocate('vnc', 'c')
+
+def test_reserve_conflicts_with_other_vm():
+    ports = PortAllocator({'vnc': (5900, 4)}, verify=False)
+    ports.reserve('vnc', 'a', 5902)
+    ports.reserve('vnc', 'a', 5902)  # Same owner: no conflict
+    with pytest.raises(PortError):
+        ports.reserve('vnc', 'b', 5902)
+    assert ports.allocate('vnc', 'b') == 5900
+    assert ports.allocate('vnc', 'c') == 5901
+    assert ports.allocate('vnc', 'd') == 5903
+
+def test_reserve_replaces_previous_port_of_vm():
+    ports = PortAllocator({'vnc': (5900, 4)}, verify=False)
+    ports.reserve('vnc', 'a', 5900)
+    ports.reserve('vnc', 'a', 5901)
+    assert ports.get('a') == {'vnc': 5901}
+    assert ports.allocate('vnc', 'b') == 5900
+
+def test_reserve_outside_pool_is_tracked():
+    ports = PortAllocator({'vnc': (5900, 2)}, verify=False)
+    ports.reserve('vnc', 'a', 7000)
+    with pytest.raises(PortError):
+        ports.reserve('vnc', 'b', 7000)
+    assert ports.usage()['vnc']['used'] == 0
+
+def test_release_dynamic_only_keeps_static_reservations():
+    ports = PortAllocator({'vnc': (5900, 4), 'spice': (5000, 4)}, verify=False)
+    ports.reserve('spice', 'a', 5001)
+    ports.allocate('vnc', 'a')
+    assert ports.release('a', dynamic_only=True) == {'vnc': 5900}
+    assert ports.get('a') == {'spice': 5001}
+
+def test_allocate_skips_ports_bound_by_other_programs(monkeypatch):
+    monkeypatch.setattr(PortAllocator, '_is_bindable', staticmethod(lambda port: port != 5901))
+    ports = PortAllocator({'vnc': (5900, 3)})
+    assert ports.allocate('vnc', 'a') == 5900
+    assert ports.allocate('vnc', 'b') == 5902
+    # Retried once the pool runs dry, and still bound
+    with pytest.raises(PortError):
+        ports.allocate('vnc', 'c')
+    monkeypatch.setattr(PortAllocator, '_is_bindable', staticmethod(lambda port: True))
+    assert ports.allocate('vnc', 'c') == 5901
+
+def test_overlapping_pools_never_share_a_port():
+    # The default pools: websocket 6000-6199 overlaps VNC 5900-6099
+    ports = PortAllocator({'vnc': (5900, 200), 'websocket': (6000, 200)}, verify=False)
+    ports.reserve('websocket', 'a', 6000)
+    with pytest.raises(PortError):
+        ports.reserve('vnc', 'b', 6000)
+    with pytest.raises(PortError):
+        ports.reserve('vnc', 'a', 6000)  # Not even for the same VM
+
+    for index in range(100):
+        ports.allocate('vnc', f'vm{index}')
+    assert ports.allocate('vnc', 'next') == 6001
+    assert ports.allocate('websocket', 'ws') == 6002
+
+    ports.release('a')
+    assert ports.allocate('websocket', 'ws2') == 6000
+
+def test_static_port_outside_a_pool_blocks_the_pool_covering_it():
+    ports = PortAllocator({'vnc': (5900, 4), 'spice': (5000, 4)}, verify=False)
+    ports.reserve('vnc', 'a', 5000)  # A VNC port configured inside the SPICE range
+    assert ports.allocate('spice', 'b') == 5001
+    with pytest.raises(PortError):
+        ports.reserve('spice', 'c', 5000)
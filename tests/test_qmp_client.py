@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import pytest
+
+from qemuweb.core.qmp_client import QMPClient, QMPError
+
+class FakeQMP:
+    """A QMP server on a unix socket that the test drives one message at a time"""
+
+    def __init__(self, path):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+        self.listener.settimeout(5)
+        self.connection = None
+        self.reader = None
+
+    def accept(self):
+        self.connection, _ = self.listener.accept()
+        self.connection.settimeout(5)
+        self.reader = self.connection.makefile('rb')
+        self.send({'QMP': {'version': {}, 'capabilities': []}})
+        assert self.receive()['execute'] == 'qmp_capabilities'
+        self.send({'return': {}})
+
+    def send(self, message):
+        self.connection.sendall((json.dumps(message) + '\n').encode())
+
+    def receive(self):
+        return json.loads(self.reader.readline())
+
+    def drop(self):
+        self.reader.close()
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.connection.close()
+
+    def close(self):
+        if self.connection:
+            self.reader.close()
+            self.connection.close()
+        self.listener.close()
+
+@pytest.fixture
+def session():
+    # Unix socket paths are limited to ~100 bytes, which pytest's tmp_path can exceed
+    directory = tempfile.mkdtemp(prefix='qmp')
+    server = FakeQMP(os.path.join(directory, 'qmp.sock'))
+    client = QMPClient(os.path.join(directory, 'qmp.sock'), auto_reconnect=False)
+    handshake = threading.Thread(target=server.accept)
+    handshake.start()
+    assert client.connect(timeout=5)
+    handshake.join()
+    yield server, client
+    client.close()
+    server.close()
+    shutil.rmtree(directory)
+
+def in_background(client, command, timeout=5.0):
+    """Start client.execute in a thread; returns (thread, outcome) where outcome fills in when it ends"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['return'] = client.execute(command, timeout=timeout)
+        except QMPError as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+def test_execute_returns_result_and_raises_errors(session):
+    server, client = session
+    thread, outcome = in_background(client, 'query-status')
+    request = server.receive()
+    assert request['execute'] == 'query-status'
+    server.send({'id': request['id'], 'return': {'status': 'running'}})
+    thread.join(5)
+    assert outcome == {'return': {'status': 'running'}}
+
+    thread, outcome = in_background(client, 'bogus')
+    request = server.receive()
+    server.send({'id': request['id'], 'error': {'class': 'CommandNotFound', 'desc': 'nope'}})
+    thread.join(5)
+    assert outcome['error'].error_class == 'CommandNotFound'
+
+def test_out_of_order_responses_reach_their_own_waiter(session):
+    server, client = session
+    first, first_outcome = in_background(client, 'query-status')
+    first_request = server.receive()
+    second, second_outcome = in_background(client, 'query-name')
+    second_request = server.receive()
+    assert first_request['id'] != second_request['id']
+
+    server.send({'id': second_request['id'], 'return': {'name': 'vm'}})
+    second.join(5)
+    assert second_outcome == {'return': {'name': 'vm'}}
+    assert first.is_alive()  # Still waiting for its own reply
+
+    server.send({'id': first_request['id'], 'return': {'status': 'paused'}})
+    first.join(5)
+    assert first_outcome == {'return': {'status': 'paused'}}
+
+def test_events_between_replies_go_to_listeners(session):
+    server, client = session
+    events = []
+    delivered = threading.Event()
+
+    def listener(name, message):
+        events.append((name, message.get('data')))
+        if len(events) == 2:
+            delivered.set()
+
+    client.add_event_listener(listener)
+    thread, outcome = in_background(client, 'stop')
+    request = server.receive()
+    server.send({'event': 'STOP', 'data': {}, 'timestamp': {'seconds': 1, 'microseconds': 0}})
+    server.send({'id': request['id'], 'return': {}})
+    server.send({'event': 'RESUME', 'data': {'reason': 'x'}, 'timestamp': {'seconds': 2, 'microseconds': 0}})
+    thread.join(5)
+    assert outcome == {'return': {}}
+    assert delivered.wait(5)
+    assert events == [('STOP', {}), ('RESUME', {'reason': 'x'})]
+
+def test_dropped_connection_fails_commands_in_flight(session):
+    server, client = session
+    first, first_outcome = in_background(client, 'query-status')
+    second, second_outcome = in_background(client, 'query-name')
+    server.receive()
+    server.receive()
+    server.drop()
+    first.join(5)
+    second.join(5)
+    for outcome in (first_outcome, second_outcome):
+        assert outcome['error'].error_class == 'ConnectionLost'
+    assert not client.connected
+
+def test_unanswered_command_times_out(session):
+    server, client = session
+    with pytest.raises(QMPError) as error:
+        client.execute('query-status', timeout=0.1)
+    assert error.value.error_class == 'Timeout'
+    assert client._pending == {}
@@ -0,0 +1,175 @@
+import pytest
+
+from qemuweb.core.state_sync import StateSync
+
+class FakeManager:
+    """Just the parts of VMManager that StateSync reads"""
+
+    def __init__(self):
+        self.statuses = {}
+
+    @property
+    def vms(self):
+        return list(self.statuses)
+
+    def get_vm_status(self, name):
+        status = self.statuses.get(name)
+        return dict(status) if status is not None else None
+
+@pytest.fixture
+def manager():
+    manager = FakeManager()
+    manager.statuses = {
+        'alpha': {'running': False, 'state': 'stopped', 'cpu_usage': 0.0},
+        'beta': {'running': False, 'state': 'stopped', 'cpu_usage': 0.0},
+    }
+    return manager
+
+@pytest.fixture
+def sync(manager):
+    sent = []
+    sync = StateSync(manager, emit=lambda event, data, sid: sent.append((event, data, sid)))
+    sync.sent = sent
+    # Load the initial documents without starting the background pass; tests call flush() themselves
+    sync.start()
+    sync.stop()
+    return sync
+
+def change(sync, manager, name, **fields):
+    manager.statuses[name].update(fields)
+    sync.mark(name)
+    sync.flush()
+
+def patches(sync, sid):
+    return [data for event, data, to in sync.sent if event == 'state_patch' and to == sid]
+
+def test_subscribe_returns_snapshot_of_selected_vms_and_fields(sync):
+    event, payload = sync.subscribe('sid', 'list', vms=['alpha'], fields=['state'])
+    assert event == 'state_snapshot'
+    assert payload['vms'] == {'alpha': {'state': 'stopped'}}
+    assert payload['epoch'] == sync.epoch
+    assert payload['version'] == sync.version
+
+def test_unknown_fields_are_rejected(sync):
+    with pytest.raises(ValueError):
+        sync.subscribe('sid', 'list', fields=['state', 'password'])
+
+def test_changes_are_pushed_as_patches(sync, manager):
+    sync.subscribe('sid', 'list')
+    change(sync, manager, 'alpha', running=True, state='running')
+    [patch] = patches(sync, 'sid')
+    assert (patch['from'], patch['to']) == (0, 1)
+    assert sorted(patch['ops'], key=lambda op: op['path']) == [
+        {'op': 'replace', 'path': '/alpha/running', 'value': True},
+        {'op': 'replace', 'path': '/alpha/state', 'value': 'running'},
+    ]
+
+def test_unchanged_status_sends_nothing(sync, manager):
+    sync.subscribe('sid', 'list')
+    change(sync, manager, 'alpha')
+    assert sync.sent == []
+    assert sync.version == 0
+
+def test_filtered_subscription_never_receives_other_fields(sync, manager):
+    sync.subscribe('states', 'list', fields=['state'])
+    sync.subscribe('beta', 'detail', vms=['beta'])
+    change(sync, manager, 'alpha', cpu_usage=12.5)
+    change(sync, manager, 'alpha', state='running', cpu_usage=20.0)
+    manager.statuses['gamma'] = {'running': False, 'state': 'stopped', 'cpu_usage': 3.0}
+    change(sync, manager, 'gamma')
+
+    ops = [op for patch in patches(sync, 'states') for op in patch['ops']]
+    assert ops == [
+        {'op': 'replace', 'path': '/alpha/state', 'value': 'running'},
+        {'op': 'add', 'path': '/gamma', 'value': {'state': 'stopped'}},  # A new VM, trimmed to the fields
+    ]
+    assert patches(sync, 'beta') == []
+
+    # Catching up is filtered the same way
+    event, payload = sync.subscribe('states', 'list', fields=['state'], since=0, epoch=sync.epoch)
+    assert event == 'state_patch'
+    assert payload['ops'] == ops
+
+def test_catch_up_returns_only_missed_ops(sync, manager):
+    change(sync, manager, 'alpha', state='starting')
+    seen = sync.version
+    change(sync, manager, 'alpha', state='running')
+    change(sync, manager, 'beta', state='starting')
+
+    event, payload = sync.subscribe('sid', 'list', since=seen, epoch=sync.epoch)
+    assert event == 'state_patch'
+    assert (payload['from'], payload['to']) == (seen, sync.version)
+    assert payload['ops'] == [
+        {'op': 'replace', 'path': '/alpha/state', 'value': 'running'},
+        {'op': 'replace', 'path': '/beta/state', 'value': 'starting'},
+    ]
+
+    # Up to date: an empty patch, not a snapshot
+    event, payload = sync.subscribe('sid', 'list', since=sync.version, epoch=sync.epoch)
+    assert (event, payload['ops']) == ('state_patch', [])
+
+def test_wrong_epoch_or_future_version_gets_snapshot(sync, manager):
+    change(sync, manager, 'alpha', state='running')
+    assert sync.subscribe('sid', 'list', since=0, epoch='restarted')[0] == 'state_snapshot'
+    assert sync.subscribe('sid', 'list', since=0)[0] == 'state_snapshot'
+    assert sync.subscribe('sid', 'list', since=sync.version + 1, epoch=sync.epoch)[0] == 'state_snapshot'
+
+def test_trimmed_history_falls_back_to_snapshot(manager):
+    sync = StateSync(manager, emit=lambda *args: None, max_history=2)
+    sync.start()
+    sync.stop()
+    for state in ('a', 'b', 'c'):
+        change(sync, manager, 'alpha', state=state)
+        change(sync, manager, 'beta', state=state)
+
+    # Whole versions are dropped, oldest first, until at most two ops are left
+    assert sync._floor == sync.version - 2
+    assert len(sync._log) == 2
+    assert sync.subscribe('sid', 'list', since=sync._floor - 1, epoch=sync.epoch)[0] == 'state_snapshot'
+    event, payload = sync.subscribe('sid', 'list', since=sync._floor, epoch=sync.epoch)
+    assert event == 'state_patch'
+    assert [op['value'] for op in payload['ops']] == ['c', 'c']
+
+def test_history_expires_by_age(manager, monkeypatch):
+    sync = StateSync(manager, emit=lambda *args: None, history_seconds=60)
+    sync.start()
+    sync.stop()
+    clock = [1000.0]
+    monkeypatch.setattr('qemuweb.core.state_sync.time.time', lambda: clock[0])
+    change(sync, manager, 'alpha', state='running')
+    clock[0] += 30
+    change(sync, manager, 'beta', state='running')
+    assert sync._floor == 0
+
+    clock[0] += 45  # The first change is now 75 s old
+    change(sync, manager, 'alpha', state='paused')
+    assert sync._floor == 1
+    assert sync.subscribe('sid', 'list', since=0, epoch=sync.epoch)[0] == 'state_snapshot'
+    assert sync.subscribe('sid', 'list', since=1, epoch=sync.epoch)[0] == 'state_patch'
+
+def test_deleted_vm_is_sent_as_remove(sync, manager):
+    sync.subscribe('all', 'list', fields=['state'])
+    sync.subscribe('alpha', 'detail', vms=['alpha'])
+    sync.subscribe('beta', 'detail', vms=['beta'])
+    seen = sync.version
+    del manager.statuses['alpha']
+    sync.mark('alpha')
+    sync.flush()
+
+    remove = {'op': 'remove', 'path': '/alpha'}
+    assert patches(sync, 'all')[-1]['ops'] == [remove]
+    assert patches(sync, 'alpha')[-1]['ops'] == [remove]
+    assert patches(sync, 'beta') == []
+    assert sync.subscribe('late', 'list', since=seen, epoch=sync.epoch)[1]['ops'] == [remove]
+    assert 'alpha' not in sync.subscribe('fresh', 'list')[1]['vms']
+
+def test_unsubscribed_clients_get_nothing(sync, manager):
+    sync.subscribe('sid', 'list')
+    sync.subscribe('sid', 'detail', vms=['alpha'])
+    sync.unsubscribe('sid', 'detail')
+    change(sync, manager, 'alpha', state='running')
+    assert [patch['id'] for patch in patches(sync, 'sid')] == ['list']
+
+    sync.unsubscribe('sid')
+    change(sync, manager, 'alpha', state='paused')
+    assert len(patches(sync, 'sid')) == 1
@@ -0,0 +1,128 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.loadtest import QemuwebServer
+
+VM_NAMES = [f"vm-{index:02d}" for index in range(7)]
+
+@pytest.fixture(scope='module')
+def server():
+    server = QemuwebServer('static')
+    server.start()
+    try:
+        for name in VM_NAMES:
+            server.request('POST', '/api/vms', {'name': name, 'arch': 'x86_64', 'machine': 'q35', 'memory': 256})
+        yield server
+    finally:
+        server.stop()
+
+def fetch(server, path, headers=None):
+    """(status, headers, body) of a GET, without raising on 304 or 400"""
+    request = urllib.request.Request(server.base_url + path, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def test_lists_every_vm(server):
+    status, headers, body = fetch(server, '/api/vms')
+    assert status == 200
+    assert [vm['name'] for vm in json.loads(body)] == VM_NAMES
+    assert 'X-Next-Cursor' not in headers
+
+def test_etag_answers_not_modified(server):
+    _, headers, _ = fetch(server, '/api/vms?fields=name,state')
+    etag = headers['ETag']
+    assert etag.startswith('W/')
+
+    status, headers, body = fetch(server, '/api/vms?fields=name,state', {'If-None-Match': etag})
+    assert status == 304
+    assert body == b''
+    assert headers['ETag'] == etag
+
+def test_etag_changes_with_inventory(server):
+    _, headers, _ = fetch(server, '/api/vms?fields=name')
+    etag = headers['ETag']
+    server.request('POST', '/api/vms', {'name': 'extra', 'arch': 'x86_64', 'machine': 'q35', 'memory': 256})
+    try:
+        status, headers, body = fetch(server, '/api/vms?fields=name', {'If-None-Match': etag})
+        assert status == 200
+        assert headers['ETag'] != etag
+        assert 'extra' in [vm['name'] for vm in json.loads(body)]
+    finally:
+        server.request('DELETE', '/api/vms/extra')
+
+def test_cursor_pages_through_the_list(server):
+    names, path, pages = [], '/api/vms?fields=name&limit=3', 0
+    while path:
+        status, headers, body = fetch(server, path)
+        assert status == 200
+        page = [vm['name'] for vm in json.loads(body)]
+        assert 0 < len(page) <= 3
+        names += page
+        pages += 1
+        cursor = headers.get('X-Next-Cursor')
+        if cursor:
+            assert 'rel="next"' in headers['Link']
+        path = f'/api/vms?fields=name&limit=3&cursor={cursor}' if cursor else None
+    assert names == VM_NAMES
+    assert pages == 3
+
+def test_cursor_survives_removal_of_listed_vm(server):
+    server.request('POST', '/api/vms', {'name': 'vm-00a', 'arch': 'x86_64', 'machine': 'q35', 'memory': 256})
+    try:
+        _, headers, body = fetch(server, '/api/vms?fields=name&limit=2')
+        assert [vm['name'] for vm in json.loads(body)] == VM_NAMES[:2]
+        server.request('DELETE', f'/api/vms/{VM_NAMES[0]}')
+        _, _, body = fetch(server, f"/api/vms?fields=name&limit=2&cursor={headers['X-Next-Cursor']}")
+        assert [vm['name'] for vm in json.loads(body)] == VM_NAMES[2:4]
+    finally:
+        server.request('DELETE', '/api/vms/vm-00a')
+        server.request('POST', '/api/vms', {'name': VM_NAMES[0], 'arch': 'x86_64', 'machine': 'q35',
+                                            'memory': 256})
+
+def test_fields_projection(server):
+    _, _, body = fetch(server, '/api/vms?fields=state,config.arch')
+    vms = json.loads(body)
+    assert {tuple(sorted(vm)) for vm in vms} == {('config', 'name', 'state')}
+    assert {vm['config']['arch'] for vm in vms} == {'x86_64'}
+
+def test_ndjson_streams_one_vm_per_line(server):
+    for path, headers in (('/api/vms?format=ndjson&fields=name', None),
+                          ('/api/vms?fields=name', {'Accept': 'application/x-ndjson'})):
+        status, response_headers, body = fetch(server, path, headers)
+        assert status == 200
+        assert response_headers['Content-Type'].startswith('application/x-ndjson')
+        lines = body.decode().splitlines()
+        assert sorted(json.loads(line)['name'] for line in lines) == sorted(VM_NAMES)
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=abc', 'cursor=abc', 'fields=name,nonsense'])
+def test_rejects_bad_parameters(server, query):
+    status, _, body = fetch(server, f'/api/vms?{query}')
+    assert status == 400
+    assert json.loads(body)['success'] is False
+
+def test_representations_have_their_own_etags(server):
+    _, json_headers, _ = fetch(server, '/api/vms?fields=name')
+    _, ndjson_headers, _ = fetch(server, '/api/vms?fields=name', {'Accept': 'application/x-ndjson'})
+    assert json_headers['Vary'] == ndjson_headers['Vary'] == 'Accept'
+    assert json_headers['ETag'] != ndjson_headers['ETag']
+    assert fetch(server, '/api/vms?format=ndjson&fields=name')[1]['ETag'] == ndjson_headers['ETag']
+
+    # A cached JSON list must not be revalidated for an NDJSON request, or the other way round
+    status, headers, body = fetch(server, '/api/vms?fields=name',
+                                  {'Accept': 'application/x-ndjson', 'If-None-Match': json_headers['ETag']})
+    assert status == 200
+    assert headers['Content-Type'].startswith('application/x-ndjson')
+    assert len(body.decode().splitlines()) == len(VM_NAMES)
+    status, _, _ = fetch(server, '/api/vms?fields=name', {'If-None-Match': ndjson_headers['ETag']})
+    assert status == 200
+
+    status, headers, _ = fetch(server, '/api/vms?fields=name',
+                               {'Accept': 'application/x-ndjson', 'If-None-Match': ndjson_headers['ETag']})
+    assert status == 304
+    assert headers['Vary'] == 'Accept'
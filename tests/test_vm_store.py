@@ -0,0 +1,107 @@
+import json
+import os
+import uuid
+
+import pytest
+
+from qemuweb.config.vm_store import VMConfigStore
+
+def record(name, **fields):
+    return dict({'uuid': str(uuid.uuid4()), 'name': name, 'arch': 'x86_64'}, **fields)
+
+def by_name(records):
+    return {record['name']: record for record in records}
+
+def test_put_and_load_all(tmp_path):
+    store = VMConfigStore(tmp_path)
+    first, second = record('first'), record('second')
+    store.put(first)
+    store.put(second)
+    assert by_name(store.load_all()) == {'first': first, 'second': second}
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{r['uuid']}.json" for r in (first, second))
+
+def test_put_replaces_only_that_record(tmp_path):
+    store = VMConfigStore(tmp_path)
+    first, second = record('first'), record('second')
+    store.put(first)
+    store.put(second)
+    store.put(dict(first, memory=2048))
+    loaded = by_name(store.load_all())
+    assert loaded['first']['memory'] == 2048
+    assert loaded['second'] == second
+
+def test_failed_write_keeps_previous_record(tmp_path, monkeypatch):
+    store = VMConfigStore(tmp_path)
+    first = record('first')
+    store.put(first)
+
+    def fail(source, target):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        store.put(dict(first, memory=4096))
+    monkeypatch.undo()
+    assert store.load_all() == [first]
+    assert os.listdir(tmp_path) == [f"{first['uuid']}.json"]
+
+def test_delete(tmp_path):
+    store = VMConfigStore(tmp_path)
+    first = record('first')
+    store.put(first)
+    store.delete(first['uuid'])
+    store.delete(first['uuid'])  # Already gone
+    assert store.load_all() == []
+
+def test_load_all_removes_interrupted_writes_and_skips_unreadable(tmp_path):
+    store = VMConfigStore(tmp_path)
+    first = record('first')
+    store.put(first)
+    (tmp_path / '.abc123.tmp').write_text('{"name": "half')
+    (tmp_path / f"{uuid.uuid4()}.json").write_text('not json')
+    (tmp_path / 'notes.txt').write_text('ignored')
+    assert store.load_all() == [first]
+    assert not (tmp_path / '.abc123.tmp').exists()
+
+@pytest.mark.parametrize('vm_uuid', ['../../escape', 'vm', '', None, 42,
+                                     str(uuid.uuid4()).upper(), '{' + str(uuid.uuid4()) + '}'])
+def test_rejects_non_canonical_uuids(tmp_path, vm_uuid):
+    store = VMConfigStore(tmp_path)
+    with pytest.raises(ValueError):
+        store.put(record('bad', uuid=vm_uuid))
+    with pytest.raises(ValueError):
+        store.delete(vm_uuid)
+    assert list(tmp_path.iterdir()) == []
+    assert list(tmp_path.parent.glob('escape*')) == []
+
+def test_migrate_from_name_keyed_file(tmp_path):
+    legacy = tmp_path / 'vm.json'
+    kept = str(uuid.uuid4())
+    legacy.write_text(json.dumps({
+        'alpha': {'arch': 'x86_64', 'uuid': kept},
+        'beta': {'arch': 'aarch64', 'uuid': '../../beta'},
+        'gamma': {'name': 'gamma', 'arch': 'x86_64'},
+    }))
+    store = VMConfigStore(tmp_path / 'vms')
+    assert store.migrate_from(legacy) == 3
+    assert not legacy.exists()
+    assert (tmp_path / 'vm.json.migrated').exists()
+
+    loaded = by_name(store.load_all())
+    assert set(loaded) == {'alpha', 'beta', 'gamma'}
+    assert loaded['alpha']['uuid'] == kept
+    for name in ('beta', 'gamma'):
+        assert VMConfigStore.is_valid_uuid(loaded[name]['uuid'])
+
+def test_migrate_from_list_is_repeatable(tmp_path):
+    records = [{'name': 'alpha', 'arch': 'x86_64'}, {'name': 'beta', 'arch': 'x86_64'}]
+    uuids = []
+    for attempt in range(2):
+        legacy = tmp_path / 'vm.json'
+        legacy.write_text(json.dumps(records))
+        store = VMConfigStore(tmp_path / 'vms')
+        store.migrate_from(legacy)
+        uuids.append(sorted(record['uuid'] for record in store.load_all()))
+    # A rerun after an interrupted migration derives the same UUIDs, so it writes the same files
+    assert uuids[0] == uuids[1]
+    assert len(os.listdir(tmp_path / 'vms')) == 2